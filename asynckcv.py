@@ -0,0 +1,637 @@
+"""
+An asynchronous HTTP front end to a KeyColumnValueStore, serving the same
+routes as webkcv.py.
+
+Everything happens on a single asyncore event loop (polling, rather than
+selecting, so that it isn't limited to FD_SETSIZE connections), except for
+writes, which can block on persisting the store: those are handed to a pool
+of worker threads, and their responses are sent once they're done.  Long
+polls of the change feed are parked on the loop until the store reports
+changes, so they don't tie up the workers that make them.  Large
+results (get_keys, and slices without a limit) are streamed, a few items at a
+time, as the client reads them, rather than serialized in memory all at once.
+Connections are kept alive, and pipelined requests are answered in order.
+
+The store should be concurrent (see KeyColumnValueStore), since reads happen
+on the event loop while writes happen on the workers.
+"""
+
+import Queue
+import asynchat
+import asyncore
+import json
+import os
+import socket
+import threading
+import urllib
+import urlparse
+from kcvstore import ChangesLost, KeyColumnValueStore
+from timeit import default_timer as clock
+
+
+STATUS = {
+    200: 'OK',
+    201: 'Created',
+    301: 'Moved Permanently',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    410: 'Gone',
+    413: 'Request Entity Too Large',
+    500: 'Internal Server Error',
+}
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 64 * 1024 * 1024
+ITEMS_PER_CHUNK = 256
+MAX_POLL_SECONDS = 20
+
+
+class _Waker(asyncore.file_dispatcher):
+    """Runs callbacks on the event loop on behalf of other threads, which wake
+    the loop up by writing to a pipe."""
+
+    def __init__(self, map):
+        r, self._w = os.pipe()
+        asyncore.file_dispatcher.__init__(self, r, map)  # dups r
+        os.close(r)
+        self._callbacks = Queue.Queue()
+
+    def writable(self):
+        return False
+
+    def call(self, callback, *args):
+        """Arranges for callback(*args) to be called on the event loop.  Can
+        be called from any thread."""
+        self._callbacks.put((callback, args))
+        os.write(self._w, 'x')
+
+    def handle_read(self):
+        self.recv(4096)
+        while True:
+            try:
+                callback, args = self._callbacks.get_nowait()
+            except Queue.Empty:
+                break
+            callback(*args)
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self._w)
+
+
+class _Executor(object):
+    """A pool of worker threads for blocking calls, which hands their results
+    back to the event loop."""
+
+    def __init__(self, waker, workers):
+        self._waker = waker
+        self._calls = Queue.Queue()
+        self._threads = [threading.Thread(target=self._work)
+                         for i in xrange(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, fn, args, callback):
+        """Calls fn(*args) on a worker, then callback(result, error) on the
+        event loop, where error is the exception fn raised, if any."""
+        self._calls.put((fn, args, callback))
+
+    def _work(self):
+        while True:
+            call = self._calls.get()
+            if call is None:
+                return
+            fn, args, callback = call
+            try:
+                result, error = fn(*args), None
+            except Exception as e:
+                result, error = None, e
+            self._waker.call(callback, result, error)
+
+    def shutdown(self):
+        for thread in self._threads:
+            self._calls.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+def _decode(s):
+    """Decodes a path segment, query argument or form value from UTF-8, as
+    Flask does for webkcv, so that they match the (unicode) strings in JSON
+    bodies.  Raises UnicodeDecodeError, a ValueError, if it isn't UTF-8."""
+    return s.decode('utf-8')
+
+
+def _strings(value):
+    """Returns whether part of a decoded JSON body is an array of strings
+    (just like webkcv.strings)."""
+    return isinstance(value, list) and all(isinstance(s, basestring)
+                                           for s in value)
+
+
+def _string_lists(value, size):
+    """Returns whether part of a decoded JSON body is an array of arrays of
+    size strings (just like webkcv.string_lists)."""
+    return isinstance(value, list) and all(
+        _strings(item) and len(item) == size for item in value)
+
+
+def _stream_json(members, name, items):
+    """Yields the pieces of a JSON object with the given members, plus one
+    more, name, whose value is an array of the items, which are only encoded
+    as they're needed."""
+    prefix = json.dumps(members)[:-1]
+    yield '%s%s%s: [' % (prefix, ', ' if members else '', json.dumps(name))
+    first = True
+    for item in items:
+        yield json.dumps(item) if first else ', ' + json.dumps(item)
+        first = False
+    yield ']}'
+
+
+class _StreamProducer(object):
+    """An asynchat producer that sends the pieces of a response body, a few
+    at a time, whenever the socket wants more, in chunked transfer encoding
+    if chunked is true."""
+
+    def __init__(self, pieces, chunked):
+        self._pieces = pieces
+        self._chunked = chunked
+        self._done = False
+
+    def more(self):
+        if self._done:
+            return ''
+        data = []
+        for piece in self._pieces:
+            data.append(piece)
+            if len(data) == ITEMS_PER_CHUNK:
+                break
+        else:
+            self._done = True
+        data = ''.join(data)
+        if not self._chunked:
+            return data
+        if self._done:
+            return '%x\r\n%s\r\n0\r\n\r\n' % (len(data), data) if data \
+                else '0\r\n\r\n'
+        return '%x\r\n%s\r\n' % (len(data), data)
+
+
+class _Request(object):
+    def __init__(self, method, path, query, version, headers, body=''):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    def arg(self, name, default=None):
+        return self.query.get(name, [default])[0]
+
+    def form(self):
+        return dict((_decode(name), _decode(values[0])) for name, values in
+                    urlparse.parse_qs(self.body).iteritems())
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class _Connection(asynchat.async_chat):
+    """A client connection, reading requests and answering them in order."""
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, server.map)
+        self.server = server
+        self._data = []
+        self._size = 0
+        self._head = None  # request line and headers, once read
+        self._requests = []
+        self._busy = False  # waiting on a worker to answer a request
+        self._closing = False
+        self.set_terminator('\r\n\r\n')
+
+    def collect_incoming_data(self, data):
+        if self._closing:
+            return
+        self._size += len(data)
+        if self._head is None and self._size > MAX_HEADER_BYTES:
+            self.error(413, close=True)
+            return
+        self._data.append(data)
+
+    def found_terminator(self):
+        if self._closing:
+            return
+        data, self._data, self._size = ''.join(self._data), [], 0
+        if self._head is None:
+            try:
+                request = self._parse_head(data)
+                length = int(request.headers.get('content-length') or 0)
+            except ValueError:
+                self.error(400, close=True)
+                return
+            if length > MAX_BODY_BYTES:
+                self.error(413, close=True)
+                return
+            if length:
+                self._head = request
+                self.set_terminator(length)
+                return
+        else:
+            request, self._head = self._head, None
+            request.body = data
+            self.set_terminator('\r\n\r\n')
+        self._requests.append(request)
+        self._next()
+
+    def _parse_head(self, data):
+        lines = data.split('\r\n')
+        method, target, version = lines[0].split(' ', 2)
+        headers = {}
+        for line in lines[1:]:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        url = urlparse.urlsplit(target)
+        query = dict((_decode(name), [_decode(value) for value in values])
+                     for name, values in
+                     urlparse.parse_qs(url.query).iteritems())
+        return _Request(method.upper(), url.path, query, version, headers)
+
+    def _next(self):
+        """Handles the queued requests, in order, until one has to wait for
+        a worker."""
+        while self._requests and not self._busy and not self._closing:
+            request = self._requests.pop(0)
+            self._request = request
+            try:
+                self.server.route(self, request)
+            except UnicodeDecodeError:
+                self.error(400)
+            except Exception:
+                self.error(500)
+
+    def error(self, status, close=False):
+        """Sends a JSON error response, closing the connection afterwards if
+        close is true."""
+        if close:
+            self._closing = True
+        self.respond(status, {'error': STATUS[status]})
+
+    def _keep_alive(self):
+        request = self._request
+        connection = request.headers.get('connection', '').lower()
+        if request.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def _start(self, status, headers):
+        keep_alive = not self._closing and self._keep_alive()
+        headers.append(('Connection', 'keep-alive' if keep_alive
+                        else 'close'))
+        self.push('%s %d %s\r\n%s\r\n' % (
+            'HTTP/1.1', status, STATUS[status],
+            ''.join('%s: %s\r\n' % header for header in headers)))
+        return keep_alive
+
+    def respond(self, status, obj):
+        """Sends a JSON response."""
+        body = json.dumps(obj)
+        keep_alive = self._start(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body)))])
+        self.push(body)
+        if not keep_alive:
+            self._closing = True
+            self.close_when_done()
+
+    def respond_stream(self, members, name, items):
+        """Sends a JSON response whose name member is an array of the items,
+        which are only encoded as the client reads them."""
+        chunked = self._request.version != 'HTTP/1.0'
+        headers = [('Content-Type', 'application/json')]
+        if chunked:
+            headers.append(('Transfer-Encoding', 'chunked'))
+        else:
+            self._closing = True
+        keep_alive = self._start(200, headers)
+        self.push_with_producer(_StreamProducer(
+            _stream_json(members, name, items), chunked))
+        if not keep_alive:
+            self._closing = True
+            self.close_when_done()
+
+    def respond_later(self, status, fn, *args):
+        """Calls fn(*args) on a worker, then responds with its result."""
+        self._busy = True
+
+        def done(result, error):
+            self._busy = False
+            if error is None:
+                self.respond(status, {'result': result})
+            else:
+                self.error(500)
+            self._next()
+
+        self.server.executor.submit(fn, args, done)
+
+    def respond_with(self, fn, *args):
+        """Calls fn(*args) on a worker, then responds with the status and
+        JSON object it returns."""
+        self._busy = True
+
+        def done(result, error):
+            self._busy = False
+            if error is None:
+                self.respond(*result)
+            else:
+                self.error(500)
+            self._next()
+
+        self.server.executor.submit(fn, args, done)
+
+    def readable(self):
+        # Stop reading while requests are queued, so that a client can't
+        # pile up an unbounded backlog of them.
+        return not self._requests and asynchat.async_chat.readable(self)
+
+
+class Server(asyncore.dispatcher):
+    """An HTTP server for a KeyColumnValueStore.  serve_forever() runs its
+    event loop, until shutdown() is called (from any thread)."""
+
+    def __init__(self, store, host='127.0.0.1', port=5000, workers=8,
+                 backlog=1024):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.store = store
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(backlog)
+        self.address = self.socket.getsockname()
+        self.waker = _Waker(self.map)
+        self.executor = _Executor(self.waker, workers)
+        self._polls = []  # (conn, seq, limit, deadline) of parked polls
+        self._polls_due = False
+        if store.change_feed:
+            store.watch_changes(self._changed)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            _Connection(pair[0], self)
+
+    def serve_forever(self):
+        # asyncore has no timers, so the loop wakes up in time to answer the
+        # parked polls whose time is up.
+        while self.map:
+            timeout = 30
+            if self._polls:
+                timeout = max(0, min(deadline for _, _, _, deadline
+                                     in self._polls) - clock())
+            asyncore.loop(timeout=timeout, use_poll=True, map=self.map,
+                          count=1)
+            now = clock()
+            if any(deadline <= now for _, _, _, deadline in self._polls):
+                self._answer_polls()
+
+    def shutdown(self):
+        if self.store.change_feed:
+            self.store.unwatch_changes(self._changed)
+        self.executor.shutdown()
+        self.waker.call(asyncore.close_all, self.map)
+
+    def route(self, conn, request):
+        # Keys and columns are unquoted after splitting the path, so that
+        # they can contain (quoted) slashes.
+        parts = [_decode(urllib.unquote(part)) for part in
+                 request.path.strip('/').split('/')] \
+            if request.path != '/' else []
+        method = request.method
+        store = self.store
+        if not parts:
+            if method == 'GET':
+                self._get_keys(conn, request)
+            elif method == 'POST':
+                form = request.form()
+                conn.respond_later(201, store.set, form.get('key'),
+                                   form.get('col'), form.get('val'))
+            else:
+                conn.error(405)
+        elif len(parts) == 1 and parts[0] == '_bulk':
+            if method != 'POST':
+                return conn.error(405)
+            try:
+                triples = request.json()
+            except ValueError:
+                return conn.error(400)
+            if not _string_lists(triples, 3):
+                return conn.respond(400, {
+                    'error': 'expected an array of [key, col, val] strings'})
+            conn.respond_later(201, store.set_many, triples)
+        elif len(parts) == 1 and parts[0] == '_mget':
+            if method != 'POST':
+                return conn.error(405)
+            try:
+                query = request.json()
+            except ValueError:
+                return conn.error(400)
+            # Just like webkcv.multi_get.
+            if not isinstance(query, dict):
+                return conn.respond(400, {'error': 'expected an object'})
+            if not _string_lists(query.get('pairs', []), 2) or \
+                    not _strings(query.get('keys', [])) or \
+                    not all(isinstance(query.get(name),
+                                       (basestring, type(None)))
+                            for name in ('start', 'stop')):
+                return conn.respond(400, {'error': 'expected strings'})
+            conn.respond(200, {
+                'values': store.multi_get(query.get('pairs', [])),
+                'slices': store.multi_get_slice(query.get('keys', []),
+                                                query.get('start'),
+                                                query.get('stop'))})
+        elif len(parts) == 1 and parts[0] == '_changes':
+            if method != 'GET':
+                return conn.error(405)
+            self._changes(conn, request)
+        elif len(parts) == 1:
+            key = parts[0]
+            if method == 'GET':
+                self._get_key_or_slice(conn, request, key)
+            elif method == 'DELETE':
+                conn.respond_later(200, store.delete_key, key)
+            else:
+                conn.error(405)
+        elif len(parts) == 2:
+            key, col = parts
+            if method == 'GET':
+                conn.respond(200, {'value': store.get(key, col)})
+            elif method == 'DELETE':
+                conn.respond_later(200, store.delete, key, col)
+            elif method == 'POST':
+                try:
+                    query = request.json()
+                except ValueError:
+                    return conn.error(400)
+                conn.respond_with(self._update, key, col, query)
+            elif method == 'PUT':
+                # webkcv answers overwrites with a 301, so I do too.
+                conn.respond_later(301, store.set, key, col,
+                                   request.form().get('val'))
+            else:
+                conn.error(405)
+        else:
+            conn.error(404)
+
+    def _changes(self, conn, request):
+        # Just like webkcv.changes, except that a poll with nothing to return
+        # yet is parked on the event loop (which is woken up by _changed)
+        # rather than waiting in changes_since on a thread.
+        try:
+            seq, limit = [None if value is None else int(value) for value in
+                          (request.arg('seq'), request.arg('limit'))]
+            timeout = float(request.arg('timeout', MAX_POLL_SECONDS))
+        except ValueError:
+            return conn.respond(400, {'error': 'expected numbers'})
+        if limit is not None and limit < 1:
+            # A poll for no changes would wait out its timeout.
+            return conn.respond(400, {'error': 'limit must be positive'})
+        if not timeout >= 0:  # NaN included
+            return conn.respond(400, {'error': 'timeout must not be '
+                                      'negative'})
+        timeout = min(timeout, MAX_POLL_SECONDS)
+        poll = (conn, seq, limit, clock() + timeout)
+        if not self._answer_poll(poll):
+            conn._busy = True
+            self._polls.append(poll)
+
+    def _answer_poll(self, poll):
+        """Answers a poll, if it has changes to return (or has lost them, or
+        its time is up), returning whether it did."""
+        conn, seq, limit, deadline = poll
+        if not conn.connected:
+            return True  # the client has given up on it
+        try:
+            next_seq, changes = self.store.changes_since(seq, limit)
+        except ChangesLost as e:
+            conn.respond(410, {'error': str(e)})
+        else:
+            if not changes and seq is not None and clock() < deadline:
+                return False
+            conn.respond(200, {'seq': next_seq, 'changes': changes})
+        if conn._busy:
+            conn._busy = False
+            conn._next()
+        return True
+
+    def _answer_polls(self):
+        self._polls_due = False
+        self._polls = [poll for poll in self._polls
+                       if not self._answer_poll(poll)]
+
+    def _changed(self):
+        # Called by the store, on whatever thread wrote to it, to wake the
+        # loop up to answer the parked polls; once, however many writes
+        # pile up before it gets round to it.
+        if not self._polls_due:
+            self._polls_due = True
+            self.waker.call(self._answer_polls)
+
+    def _update(self, key, col, query):
+        # Just like webkcv.update.
+        if not isinstance(query, dict):
+            return 400, {'error': 'expected an object'}
+        if not all(isinstance(query.get(name), (basestring, type(None)))
+                   for name in ('expected', 'val')) or \
+                not isinstance(query.get('suffix', ''), basestring):
+            return 400, {'error': 'expected strings'}
+        op = query.get('op')
+        store = self.store
+        try:
+            if op == 'compare_and_set':
+                result = store.compare_and_set(key, col, query.get('expected'),
+                                               query.get('val'))
+            elif op == 'increment':
+                result = store.increment(key, col, query.get('delta', 1))
+            elif op == 'append':
+                result = store.append(key, col, query['suffix'])
+            else:
+                return 400, {'error': 'unknown op'}
+        except (KeyError, ValueError) as e:
+            return 400, {'error': str(e)}
+        return 200, {'result': result}
+
+    def _get_keys(self, conn, request):
+        # Just like webkcv.get_keys, except that whole listings are streamed.
+        if request.arg('count') in ('1', 'true'):
+            conn.respond(200, {'count': self.store.count_keys()})
+            return
+        start = request.arg('start')
+        stop = request.arg('stop')
+        try:
+            limit = request.arg('limit')
+            limit = None if limit is None else int(limit)
+        except ValueError:
+            limit = None
+        if limit is not None and limit < 1:
+            return conn.error(400)
+        if limit is None:
+            conn.respond_stream({}, 'keys',
+                                self.store.iter_keys(start, stop))
+            return
+        keys = list(self.store.iter_keys(start, stop, limit=limit + 1,
+                                         after=request.arg('after')))
+        next_after = keys[limit - 1] if len(keys) > limit else None
+        conn.respond(200, {'keys': keys[:limit], 'next': next_after})
+
+    def _get_key_or_slice(self, conn, request, key):
+        # Just like webkcv.get_key_or_slice, except that whole slices are
+        # streamed.
+        start = request.arg('start')
+        stop = request.arg('stop')
+        prefix = request.arg('prefix')
+        if request.arg('count') in ('1', 'true'):
+            if prefix is not None:
+                count = self.store.count_prefix(key, prefix)
+            elif start is None and stop is None:
+                count = self.store.count_columns(key)
+            else:
+                count = self.store.count_slice(key, start, stop)
+            conn.respond(200, {'count': count})
+            return
+        try:
+            limit = request.arg('limit')
+            limit = None if limit is None else int(limit)
+        except ValueError:
+            limit = None
+        if limit is not None and limit < 1:
+            return conn.error(400)
+        if limit is None:
+            if prefix is not None:
+                columns = self.store.iter_prefix(key, prefix)
+            else:
+                columns = self.store.iter_slice(key, start, stop)
+            conn.respond_stream({}, 'columns', columns)
+            return
+        after = request.arg('after')
+        reverse = request.arg('reverse') in ('1', 'true')
+        if prefix is not None:
+            columns = self.store.iter_prefix(key, prefix, limit=limit + 1,
+                                             reverse=reverse, after=after)
+        else:
+            columns = self.store.iter_slice(key, start, stop,
+                                            limit=limit + 1,
+                                            reverse=reverse, after=after)
+        columns = list(columns)
+        next_after = columns[limit - 1][0] if len(columns) > limit else None
+        conn.respond(200, {'columns': columns[:limit], 'next': next_after})
+
+
+if __name__ == '__main__':
+    store = KeyColumnValueStore(path='kcvstore.pickle', concurrent=True,
+                                change_feed=10000)
+    Server(store).serve_forever()
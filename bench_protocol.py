@@ -0,0 +1,109 @@
+"""
+Benchmarks the binary protocol server (kcvproto) against the Flask server
+(webkcv) on localhost, by timing a single client making the same sets and
+gets through each, one request at a time and (for kcvproto) pipelined.
+
+Usage: python bench_protocol.py [number of operations]
+"""
+
+import httplib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib
+from kcvproto import Client, Server
+from kcvstore import KeyColumnValueStore
+from werkzeug.serving import make_server
+
+
+def timed(name, n, fn):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    print '%-32s %8d ops/s' % (name, n / elapsed)
+
+
+def bench_webkcv(n):
+    import webkcv  # opens kcvstore.pickle in the current directory
+    server = make_server('127.0.0.1', 0, webkcv.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    conn = httplib.HTTPConnection('127.0.0.1', server.server_port)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+    def request(method, path, body=None):
+        conn.request(method, path, body, headers)
+        conn.getresponse().read()
+
+    def sets():
+        for i in xrange(n):
+            request('PUT', '/key/%d' % i, urllib.urlencode({'val': 'v'}))
+
+    def gets():
+        for i in xrange(n):
+            request('GET', '/key/%d' % i)
+
+    try:
+        timed('webkcv set', n, sets)
+        timed('webkcv get', n, gets)
+    finally:
+        conn.close()
+        server.shutdown()
+        thread.join()
+        webkcv.store.close()
+
+
+def bench_kcvproto(n):
+    store = KeyColumnValueStore(path='kcvproto.pickle', concurrent=True)
+    server = Server(store, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    client = Client(*server.address)
+
+    def sets():
+        for i in xrange(n):
+            client.set('key', str(i), 'v')
+
+    def gets():
+        for i in xrange(n):
+            client.get('key', str(i))
+
+    def pipelined(method):
+        def run():
+            pipeline = client.pipeline()
+            for i in xrange(n):
+                method(pipeline, 'pipelined', str(i))
+            pipeline.execute()
+        return run
+
+    try:
+        timed('kcvproto set', n, sets)
+        timed('kcvproto get', n, gets)
+        timed('kcvproto set (pipelined)', n,
+              pipelined(lambda p, k, c: p.set(k, c, 'v')))
+        timed('kcvproto get (pipelined)', n,
+              pipelined(lambda p, k, c: p.get(k, c)))
+    finally:
+        client.close()
+        server.shutdown()
+        thread.join()
+        store.close()
+
+
+def main(n):
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    os.chdir(tmp)
+    try:
+        bench_webkcv(n)
+        bench_kcvproto(n)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,335 @@
+"""
+Benchmarks every KeyColumnValueStore operation, and webkcv's request
+handling, over a sweep of store shapes, and writes the results as JSON so
+that runs from different commits can be compared.
+
+For each combination of the swept parameters (number of keys, columns per
+key, value size, slice width and durability), a store of that shape is built,
+and then each operation is timed call by call, on random keys and columns
+(from a fixed seed, so that runs are reproducible).  Each result records the
+throughput and the latency percentiles of one operation on one shape.  Load
+time is timed by reopening the store, persistence by checkpointing it.
+
+So that it can be copied into a checkout of an older commit and run there,
+it only uses what that commit's store has: without batches, the store is
+built with one set() per triple (which, before the mutation log, re-pickles
+the whole store every time, so keep the shapes small); without the
+durability setting, --durability is ignored and recorded as None (and
+--compare matches such results with those at any durability); and
+operations the store doesn't have yet (set_many, checkpoint) are left out
+of the results, which --compare then skips.
+
+Usage:
+    python benchmark.py [--keys 100,1000] [--columns 10,100] ... [-o FILE]
+    python benchmark.py --compare BASELINE.json RESULTS.json [--threshold N]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from kcvstore import KeyColumnValueStore
+from timeit import default_timer as clock
+
+
+try:
+    from kcvstore import OS_BUFFERED
+except ImportError:  # a store from before the durability setting
+    OS_BUFFERED = None
+
+PERCENTILES = (50, 90, 99)
+
+
+def _ints(s):
+    return [int(n) for n in s.split(',')]
+
+
+def _strings(s):
+    return s.split(',')
+
+
+def summarize(op, latencies, elapsed=None):
+    """Returns the result for an operation, given the latency of each call
+    (in seconds), and the total time taken if it wasn't just their sum."""
+    latencies = sorted(latencies)
+    n = len(latencies)
+    if elapsed is None:
+        elapsed = sum(latencies)
+    result = {
+        'op': op,
+        'calls': n,
+        'seconds': elapsed,
+        'ops_per_second': n / elapsed if elapsed else None,
+        'mean_us': 1e6 * sum(latencies) / n,
+        'max_us': 1e6 * latencies[-1],
+    }
+    for p in PERCENTILES:
+        result['p%d_us' % p] = 1e6 * latencies[min(n - 1, n * p // 100)]
+    return result
+
+
+def timed_calls(fn, args):
+    """Calls fn(*a) for each a in args, returning the latency of each
+    call."""
+    latencies = []
+    for a in args:
+        start = clock()
+        fn(*a)
+        latencies.append(clock() - start)
+    return latencies
+
+
+def column(i):
+    return 'col%08d' % i
+
+
+def build(shape, path):
+    """Returns a store of the given shape at path, filled in a single batch
+    if the store has batches."""
+    if OS_BUFFERED is None:
+        store = KeyColumnValueStore(path=path)
+    else:
+        store = KeyColumnValueStore(path=path, durability=shape['durability'])
+    if hasattr(store, 'batch'):
+        with store.batch():
+            fill(store, shape)
+    else:
+        fill(store, shape)
+    return store
+
+
+def fill(store, shape):
+    value = 'v' * shape['value_size']
+    for k in xrange(shape['keys']):
+        for c in xrange(shape['columns']):
+            store.set('key%08d' % k, column(c), value)
+
+
+def close(store):
+    # Stores from before the mutation log have nothing to close.
+    if hasattr(store, 'close'):
+        store.close()
+
+
+def bench_store(shape, ops, rng, directory):
+    """Yields the results for every store operation on a store of the given
+    shape."""
+    path = os.path.join(directory, 'store')
+    start = clock()
+    store = build(shape, path)
+    yield summarize('build', [clock() - start])
+    keys, columns = shape['keys'], shape['columns']
+    value = 'v' * shape['value_size']
+    width = min(shape['slice_width'], columns)
+
+    def key():
+        return 'key%08d' % rng.randrange(keys)
+
+    def slice_bounds():
+        first = rng.randrange(columns - width + 1)
+        return column(first), column(first + width - 1)
+
+    calls = [(key(), column(rng.randrange(columns)), value)
+             for i in xrange(ops)]
+    yield summarize('set', timed_calls(store.set, calls))
+    calls = [(key(), column(rng.randrange(columns))) for i in xrange(ops)]
+    yield summarize('get', timed_calls(store.get, calls))
+    calls = [(key(), 'missing') for i in xrange(ops)]
+    yield summarize('get_missing', timed_calls(store.get, calls))
+    calls = [(key(),) for i in xrange(ops)]
+    yield summarize('get_key', timed_calls(store.get_key, calls))
+    calls = [(key(),) + slice_bounds() for i in xrange(ops)]
+    yield summarize('get_slice', timed_calls(store.get_slice, calls))
+    calls = [()] * max(1, ops // 100)
+    yield summarize('get_keys', timed_calls(store.get_keys, calls))
+    calls = [[(key(), column(rng.randrange(columns)), value)
+              for j in xrange(100)] for i in xrange(max(1, ops // 100))]
+    if hasattr(store, 'set_many'):
+        yield summarize('set_many_100', timed_calls(store.set_many,
+                                                    [(c,) for c in calls]))
+    if hasattr(store, 'checkpoint'):
+        yield summarize('checkpoint', timed_calls(store.checkpoint, [()] * 3))
+    close(store)
+    size = os.path.getsize(path)
+
+    def load():
+        close(KeyColumnValueStore(path=path))
+
+    result = summarize('load', timed_calls(load, [()] * 3))
+    result['file_bytes'] = size
+    yield result
+    os.remove(path)
+
+
+def bench_http(shape, ops, rng, directory):
+    """Yields the results for webkcv's request handling (through Flask's
+    test client, so without the network) on a store of the given shape."""
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import webkcv  # opens kcvstore.pickle in the current directory
+    finally:
+        os.chdir(cwd)
+    path = os.path.join(directory, 'http-store')
+    previous, webkcv.store = webkcv.store, build(shape, path)
+    if hasattr(webkcv, 'writer'):
+        # Writes go through webkcv.writer, which must be the store itself,
+        # or webkcv would take the store for a reader to catch up.
+        previous_writer, webkcv.writer = webkcv.writer, webkcv.store
+    client = webkcv.app.test_client()
+    keys, columns = shape['keys'], shape['columns']
+    value = 'v' * shape['value_size']
+    width = min(shape['slice_width'], columns)
+    try:
+        def request(method, path, data=None):
+            response = client.open(path, method=method, data=data)
+            assert response.status_code < 400, response.status_code
+
+        def key():
+            return 'key%08d' % rng.randrange(keys)
+
+        calls = [('PUT', '/%s/%s' % (key(), column(rng.randrange(columns))),
+                  {'val': value}) for i in xrange(ops)]
+        yield summarize('http_set', timed_calls(request, calls))
+        calls = [('GET', '/%s/%s' % (key(), column(rng.randrange(columns))))
+                 for i in xrange(ops)]
+        yield summarize('http_get', timed_calls(request, calls))
+        calls = [('GET', '/' + key()) for i in xrange(ops)]
+        yield summarize('http_get_key', timed_calls(request, calls))
+        calls = []
+        for i in xrange(ops):
+            first = rng.randrange(columns - width + 1)
+            calls.append(('GET', '/%s?start=%s&stop=%s' % (
+                key(), column(first), column(first + width - 1))))
+        yield summarize('http_get_slice', timed_calls(request, calls))
+    finally:
+        close(webkcv.store)
+        webkcv.store = previous
+        if hasattr(webkcv, 'writer'):
+            webkcv.writer = previous_writer
+        os.remove(path)
+
+
+def shapes(args):
+    for keys, columns, value_size, slice_width, durability in \
+            itertools.product(args.keys, args.columns, args.value_size,
+                              args.slice_width, args.durability):
+        yield {'keys': keys, 'columns': columns, 'value_size': value_size,
+               'slice_width': slice_width,
+               'durability': None if OS_BUFFERED is None else durability}
+
+
+def metadata():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=open(os.devnull, 'w'),
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform()}
+
+
+def run(args):
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for shape in shapes(args):
+            rng = random.Random(args.seed)
+            benches = [bench_store]
+            if not args.no_http:
+                benches.append(bench_http)
+            for bench in benches:
+                for result in bench(shape, args.ops, rng, directory):
+                    result.update(shape)
+                    results.append(result)
+                    print >> sys.stderr, describe(result)
+    finally:
+        shutil.rmtree(directory)
+    return {'meta': metadata(), 'results': results}
+
+
+def describe(result):
+    return ('%(keys)6d keys %(columns)5d cols %(value_size)5d B '
+            '%(slice_width)4d wide %(durability)-15s %(op)-14s '
+            '%(ops_per_second)10.0f ops/s  p50 %(p50_us)8.1f us  '
+            'p99 %(p99_us)8.1f us' % result)
+
+
+def result_key(result):
+    return (result['op'], result['keys'], result['columns'],
+            result['value_size'], result['slice_width'],
+            result['durability'])
+
+
+def compare(baseline, results, threshold):
+    """Prints how each result's median latency compares to the baseline's,
+    and returns the number that got slower by more than threshold (as a
+    fraction)."""
+    base = dict((result_key(r), r) for r in baseline['results'])
+    regressions = 0
+    for result in results['results']:
+        key = result_key(result)
+        # A baseline from before the durability setting has a None there,
+        # and is compared with results at every durability.
+        old = base.get(key) or base.get(key[:-1] + (None,))
+        if old is None or not old['p50_us']:
+            continue
+        change = result['p50_us'] / old['p50_us'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print '%s  p50 %+6.1f%%%s' % (describe(result), 100 * change, flag)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--keys', type=_ints, default=[100, 1000])
+    parser.add_argument('--columns', type=_ints, default=[10, 100])
+    parser.add_argument('--value-size', type=_ints, default=[16, 256])
+    parser.add_argument('--slice-width', type=_ints, default=[10])
+    parser.add_argument('--durability', type=_strings,
+                        default=[OS_BUFFERED],
+                        help='ignored by a store without the setting')
+    parser.add_argument('--ops', type=int, default=2000,
+                        help='calls to time per operation')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-http', action='store_true',
+                        help="don't benchmark webkcv")
+    parser.add_argument('-o', '--output', help='file to write results to '
+                        '(default: standard output)')
+    parser.add_argument('--compare', nargs=2,
+                        metavar=('BASELINE', 'RESULTS'),
+                        help='compare two result files instead')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown in median latency counted as a '
+                        'regression by --compare (default: 0.1)')
+    args = parser.parse_args(argv)
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            results = json.load(f)
+        return 1 if compare(baseline, results, args.threshold) else 0
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Imports key/column/value triples into a store, or exports them from it, as
+JSON lines or CSV, streaming them through bulk_load and export.
+
+In JSON lines, each triple is either an array, ["key", "col", "val"], or an
+object, {"key": ..., "col": ..., "val": ...}; exports use objects.  In CSV,
+each triple is a row of three fields, after a key,col,val header row (which
+is optional on import).  Text is UTF-8 either way.
+
+Usage:
+    python kcvcli.py import STORE [FILE] [--format jsonl|csv] [--lazy]
+                                         [--sorted]
+    python kcvcli.py export STORE [FILE] [--format jsonl|csv]
+
+FILE defaults to standard input or output.  STORE is the path of the store's
+file (or directory, with --lsm).
+"""
+
+import argparse
+import csv
+import json
+import sys
+from kcvlsm import LSMKeyColumnValueStore
+from kcvstore import KeyColumnValueStore
+
+
+FORMATS = ('jsonl', 'csv')
+HEADER = ['key', 'col', 'val']
+
+
+def _utf8(s):
+    return s.encode('utf-8') if isinstance(s, unicode) else s
+
+
+def read_jsonl(f):
+    """Yields the triples in a file of JSON lines."""
+    for line in f:
+        if not line.strip():
+            continue
+        triple = json.loads(line)
+        if isinstance(triple, dict):
+            triple = [triple['key'], triple['col'], triple['val']]
+        key, col, val = triple
+        yield key, col, val
+
+
+def write_jsonl(f, triples):
+    for key, col, val in triples:
+        f.write(json.dumps({'key': key, 'col': col, 'val': val}))
+        f.write('\n')
+
+
+def read_csv(f):
+    """Yields the triples in a CSV file, skipping its header, if any."""
+    rows = csv.reader(f)
+    for i, row in enumerate(rows):
+        if i == 0 and row == HEADER:
+            continue
+        key, col, val = row
+        yield key, col, val
+
+
+def write_csv(f, triples):
+    writer = csv.writer(f)
+    writer.writerow(HEADER)
+    for triple in triples:
+        writer.writerow([_utf8(datum) for datum in triple])
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+WRITERS = {'jsonl': write_jsonl, 'csv': write_csv}
+
+
+def open_store(args):
+    if args.lsm:
+        return LSMKeyColumnValueStore(args.store)
+    return KeyColumnValueStore(args.store, lazy=args.lazy)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('store', help='path of the store')
+    parser.add_argument('file', nargs='?', help='file to import from or '
+                        'export to (default: standard input or output)')
+    parser.add_argument('--format', choices=FORMATS, default='jsonl')
+    parser.add_argument('--lazy', action='store_true', help='write the '
+                        'store as a table, to be loaded lazily')
+    parser.add_argument('--sorted', action='store_true', help='the triples '
+                        'to import are grouped by key, in key order, so '
+                        'load them one row at a time')
+    parser.add_argument('--lsm', action='store_true', help='the store is an '
+                        'LSM store (a directory)')
+    args = parser.parse_args(argv)
+    store = open_store(args)
+    try:
+        if args.command == 'import':
+            f = sys.stdin if args.file is None else open(args.file, 'rb')
+            try:
+                store.bulk_load(READERS[args.format](f),
+                                presorted=args.sorted)
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+        else:
+            f = sys.stdout if args.file is None else open(args.file, 'wb')
+            try:
+                WRITERS[args.format](f, store.export())
+            finally:
+                if f is not sys.stdout:
+                    f.close()
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+A client for the HTTP service (webkcv or asynckcv), with the same methods as
+a KeyColumnValueStore, so that code can switch between an embedded store and
+a remote one without being rewritten.
+"""
+
+import Queue
+import httplib
+import json
+import socket
+import threading
+import urllib
+from contextlib import contextmanager
+
+
+class ClientError(Exception):
+    """Raised when the service answers a request with an error status."""
+
+    def __init__(self, status, body):
+        Exception.__init__(self, 'HTTP %d: %s' % (status, body))
+        self.status = status
+        self.body = body
+
+
+def _encode(s):
+    return s.encode('utf-8') if isinstance(s, unicode) else s
+
+
+def _quote(s):
+    return urllib.quote(_encode(s), safe='')
+
+
+class _Coalescer(object):
+    """Combines calls made concurrently from different threads into batches,
+    each sent as a single request by send, which takes a list of the calls'
+    arguments and returns a list of their results.
+
+    There's at most one batch in flight at a time.  Whoever calls while one
+    is in flight waits for it to finish, and then the first of them sends
+    everything that has piled up in the meantime as the next batch.  So a
+    lone caller never waits, while busy callers share requests."""
+
+    def __init__(self, send):
+        self._send = send
+        self._lock = threading.Lock()
+        self._pending = []
+        self._sending = False
+
+    def call(self, args):
+        call = _Call(args)
+        with self._lock:
+            self._pending.append(call)
+            if self._sending:
+                leader = False
+            else:
+                self._sending = leader = True
+        if not leader:
+            call.done.wait()
+            if not call.leader:
+                return call.result()
+        with self._lock:
+            batch, self._pending = self._pending, []
+        try:
+            results = self._send([c.args for c in batch])
+        except Exception as e:
+            for c in batch:
+                c.error = e
+        else:
+            for c, result in zip(batch, results):
+                c.value = result
+        with self._lock:
+            if self._pending:
+                # Hand over to the first caller to have piled up.
+                self._pending[0].leader = True
+                self._pending[0].done.set()
+            else:
+                self._sending = False
+        for c in batch:
+            c.done.set()
+        return call.result()
+
+
+class _Call(object):
+    def __init__(self, args):
+        self.args = args
+        self.value = None
+        self.error = None
+        self.leader = False
+        self.done = threading.Event()
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class HTTPClient(object):
+    """A client for the HTTP service at host:port.
+
+    Up to pool_size connections are kept alive and reused between calls, from
+    any number of threads.  Concurrent calls to get and set are coalesced into
+    /_mget and /_bulk requests (see _Coalescer), so that busy threads share
+    round trips; a failed set_many fails all the sets it was made of.  Reads
+    are retried up to retries times, on a fresh connection, if the connection
+    fails.  Long polls of the change feed each get a connection of their own,
+    outside the pool, so that however many are waiting, they never hold up
+    the other calls (least of all the write that would end them)."""
+
+    def __init__(self, host='127.0.0.1', port=5000, pool_size=8, retries=2,
+                 timeout=30):
+        self.host = host
+        self.port = port
+        self.retries = retries
+        self.timeout = timeout
+        self._pool = Queue.Queue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._gets = _Coalescer(self.multi_get)
+        self._sets = _Coalescer(self._set_many)
+
+    @contextmanager
+    def _connection(self, pooled=True):
+        if not pooled:
+            conn = httplib.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+        with self._slots:
+            try:
+                conn = self._pool.get_nowait()
+            except Queue.Empty:
+                conn = httplib.HTTPConnection(self.host, self.port,
+                                              timeout=self.timeout)
+            try:
+                yield conn
+            except Exception:
+                conn.close()
+                raise
+            self._pool.put(conn)
+
+    def _request(self, method, path, body=None, read=False, pooled=True):
+        """Makes a request and returns its decoded JSON response.  If read is
+        true, the request is idempotent and retried if the connection fails.
+        If pooled is false, it's made on a connection of its own, which is
+        closed afterwards."""
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        attempts = 1 + self.retries if read else 1
+        for attempt in xrange(attempts):
+            try:
+                with self._connection(pooled) as conn:
+                    conn.request(method, path, body, headers)
+                    response = conn.getresponse()
+                    data = response.read()
+            except (socket.error, httplib.HTTPException):
+                if attempt + 1 == attempts:
+                    raise
+                continue
+            if response.status >= 400:
+                raise ClientError(response.status, data)
+            return json.loads(data)
+
+    def close(self):
+        """Closes the pooled connections."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except Queue.Empty:
+                return
+
+    def set(self, key, col, val):
+        assert all(isinstance(datum, basestring) for datum in (key, col, val))
+        self._sets.call((key, col, val))
+
+    def _set_many(self, triples):
+        self.set_many(triples)
+        return [None] * len(triples)
+
+    def set_many(self, triples):
+        self._request('POST', '/_bulk', list(triples))
+
+    def get(self, key, col):
+        return self._gets.call((key, col))
+
+    def multi_get(self, pairs):
+        return self._request('POST', '/_mget', {'pairs': list(pairs)},
+                             read=True)['values']
+
+    def multi_get_slice(self, keys, start, stop):
+        slices = self._request('POST', '/_mget', {
+            'keys': list(keys), 'start': start, 'stop': stop},
+            read=True)['slices']
+        return [[tuple(column) for column in s] for s in slices]
+
+    def get_key(self, key):
+        return self.get_slice(key, None, None)
+
+    def get_keys(self):
+        return set(self._request('GET', '/', read=True)['keys'])
+
+    def iter_keys(self, start=None, stop=None, limit=None, after=None,
+                  page_size=1000):
+        """Yields the keys between start and stop in sorted order, like
+        KeyColumnValueStore.iter_keys, fetching them page_size at a time."""
+        while limit is None or limit > 0:
+            size = page_size if limit is None else min(page_size, limit)
+            query = dict((name, _encode(value)) for name, value in
+                         [('start', start), ('stop', stop), ('after', after)]
+                         if value is not None)
+            query['limit'] = size
+            page = self._request('GET', '/?' + urllib.urlencode(query),
+                                 read=True)
+            for key in page['keys']:
+                yield key
+            if page['next'] is None:
+                return
+            after = page['next']
+            if limit is not None:
+                limit -= len(page['keys'])
+
+    def count_keys(self):
+        return self._request('GET', '/?count=true', read=True)['count']
+
+    def changes_since(self, seq=None, limit=None, timeout=None):
+        """Polls the service's change feed, like
+        KeyColumnValueStore.changes_since, except that the changes are lists
+        rather than tuples, and lost changes raise a ClientError with status
+        410.  The service caps timeout, well within the client's own."""
+        query = dict((name, value) for name, value in
+                     [('seq', seq), ('limit', limit), ('timeout', timeout)]
+                     if value is not None)
+        result = self._request('GET', '/_changes?' + urllib.urlencode(query),
+                               read=True, pooled=False)
+        return result['seq'], result['changes']
+
+    def _get_columns(self, key, **query):
+        """Makes a GET request for key's columns, with the given query
+        (leaving out any Nones), and returns the decoded response."""
+        query = dict((name, _encode(value)) for name, value in
+                     query.iteritems() if value is not None)
+        path = '/' + _quote(key)
+        if query:
+            path += '?' + urllib.urlencode(query)
+        return self._request('GET', path, read=True)
+
+    def get_slice(self, key, start, stop):
+        columns = self._get_columns(key, start=start, stop=stop)['columns']
+        return [tuple(column) for column in columns]
+
+    def get_prefix(self, key, prefix):
+        columns = self._get_columns(key, prefix=prefix)['columns']
+        return [tuple(column) for column in columns]
+
+    def count_slice(self, key, start, stop):
+        return self._get_columns(key, start=start, stop=stop,
+                                 count='true')['count']
+
+    def count_prefix(self, key, prefix):
+        return self._get_columns(key, prefix=prefix, count='true')['count']
+
+    def count_columns(self, key):
+        return self._get_columns(key, count='true')['count']
+
+    def _update(self, key, col, query):
+        return self._request('POST', '/%s/%s' % (_quote(key), _quote(col)),
+                             query)['result']
+
+    def compare_and_set(self, key, col, expected, new):
+        return self._update(key, col, {'op': 'compare_and_set',
+                                       'expected': expected, 'val': new})
+
+    def increment(self, key, col, delta=1):
+        return self._update(key, col, {'op': 'increment', 'delta': delta})
+
+    def append(self, key, col, suffix):
+        self._update(key, col, {'op': 'append', 'suffix': suffix})
+
+    def delete(self, key, col):
+        self._request('DELETE', '/%s/%s' % (_quote(key), _quote(col)))
+
+    def delete_key(self, key):
+        self._request('DELETE', '/' + _quote(key))
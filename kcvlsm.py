@@ -0,0 +1,511 @@
+"""
+A log-structured merge (LSM) storage engine for the key/column/value store.
+
+Rather than keeping every row in memory, LSMKeyColumnValueStore only keeps the
+recent writes there, in a memtable: the same dict of sorteddicts that the
+KeyColumnValueStore uses, except that a deleted column is recorded as a
+tombstone (a None value) and a deleted key as a "cleared" row.  When the
+memtable's log grows past memtable_bytes, the memtable is frozen and written
+out in the background as an immutable segment file (see kcvtable), and the
+log is truncated.  Reads merge the memtable with the segments, newest first.
+Once there are more than max_segments segments, some of them are merged in
+the background: a run of adjacent segments of similar size (see
+_pick_merge), so that the data is rewritten O(log(n)) times over as it grows
+rather than all at once every few flushes.  A merge that takes in the oldest
+segment drops the tombstones it no longer needs.
+
+So writes stay as cheap as appending to the log, while the data on disk can
+be much larger than memory: segments are mmapped, and only the rows being
+read are ever decoded.
+"""
+
+import heapq
+import itertools
+import kcvtable
+import os
+import re
+from blist import sorteddict
+from kcvstore import KeyColumnValueStore, OS_BUFFERED
+from kcvstore import _MISSING, _in_range, _key_groups, _row_from_sorted
+from tempfile import mkdtemp
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+# Segment files are named after the range of flushes they hold, so that a
+# merged segment can be told apart from (and supersedes) the segments it was
+# merged from, even if a crash left some of those behind.
+SEGMENT_NAME = 'segment-%08d-%08d.kcv'
+SEGMENT_PATTERN = re.compile(r'^segment-(\d{8})-(\d{8})\.kcv$')
+
+
+def _encode_entry(cleared, pairs):
+    return pickle.dumps((cleared, list(pairs)), pickle.HIGHEST_PROTOCOL)
+
+
+def _cleared_item(key):
+    """Returns the Bloom filter item marking a key as cleared in a segment.
+    Without it, a lookup for a column that the filter rules out would still
+    have to read the entry to find out whether it hides older segments."""
+    return 'x' + kcvtable.key_item(key)
+
+
+def _exists(entry):
+    """Returns whether the newest entry for a key means the key exists."""
+    cleared, cols = entry
+    return not (cleared and not cols)
+
+
+def _without_tombstones(entry):
+    """Returns an entry equivalent to the given one, if there were nothing
+    older for it to hide."""
+    cleared, cols = entry
+    return False, dict((col, val) for col, val in cols.iteritems()
+                       if val is not None)
+
+
+def _tagged_entries(segment):
+    """Yields (key, age, entry) tuples for every key in the segment, in
+    sorted order.  The age makes heapq.merge put the entries for a key from
+    several segments in oldest-to-newest order."""
+    for key, entry in segment.iterentries():
+        yield key, segment.last, entry
+
+
+def _pick_merge(segments):
+    """Returns the run of adjacent segments to merge, newest first, out of
+    the given ones (newest first), or None if there's none worth merging.
+
+    The run starts from the newest segment it can, and takes in each older
+    segment no bigger than the run so far; it's only worth merging if its
+    first segment is no bigger than the rest of it either.  So every segment
+    a merge rewrites ends up in one at least twice its size, and each byte is
+    rewritten at most O(log(n)) times as the segments grow to n bytes (the
+    number of flushes they took, say), rather than every few flushes.  Where
+    there's no such run, there can be more than max_segments segments for a
+    while."""
+    for i in xrange(len(segments) - 1):
+        total = segments[i].size
+        j = i + 1
+        while j < len(segments) and segments[j].size <= total:
+            total += segments[j].size
+            j += 1
+        if j - i > 1 and total >= 2 * segments[i].size:
+            return segments[i:j]
+    return None
+
+
+class _Memtable(object):
+    """A layer of recent writes: a dict from keys to sorteddicts of columns to
+    values (or None, for deleted columns), plus the set of keys that were
+    deleted before those columns were written."""
+
+    def __init__(self, rows=None, cleared=None):
+        self.rows = {} if rows is None else rows
+        self.cleared = set() if cleared is None else cleared
+
+    def entry(self, key, col=None):
+        """Returns a (cleared, cols) tuple for key, or None if this layer has
+        nothing to say about it (or, if col is given, about key/col)."""
+        cols = self.rows.get(key)
+        cleared = key in self.cleared
+        if cols is None and not cleared:
+            return None
+        return cleared, {} if cols is None else cols
+
+    def iterkeys(self):
+        return iter(self.rows.viewkeys() | self.cleared)
+
+    def iter_range(self, start, stop):
+        """Returns the keys between start and stop, inclusive, in sorted
+        order."""
+        return sorted(key for key in self.iterkeys()
+                      if _in_range(key, start, stop))
+
+    def iterentries(self):
+        """Yields a key/entry tuple for every key, in sorted order."""
+        for key in sorted(self.iterkeys()):
+            yield key, self.entry(key)
+
+
+class _Segment(object):
+    """A layer of writes flushed to disk, as a kcvtable.Table whose blocks are
+    (cleared, column/value tuples) entries."""
+
+    def __init__(self, path, first, last, stats=None):
+        self.path = path
+        self.first = first
+        self.last = last
+        self.table = kcvtable.Table(path, stats)
+        self.size = os.path.getsize(path)
+
+    def entry(self, key, col=None):
+        if col is not None:
+            table = self.table
+            if (not table.may_contain(kcvtable.column_item(key, col)) and
+                    not table.may_contain(_cleared_item(key))):
+                return None
+        block = self.table.get_block(key)
+        if block is None:
+            return None
+        cleared, pairs = pickle.loads(block)
+        cols = dict(pairs)
+        if col is not None and col not in cols and not cleared:
+            self.table.stats['false_positives'] += 1
+        return cleared, cols
+
+    def iterkeys(self):
+        return self.table.iterkeys()
+
+    def iter_range(self, start, stop):
+        return self.table.iterkeys(start, stop)
+
+    def iterentries(self):
+        for key, block in self.table.iterblocks():
+            cleared, pairs = pickle.loads(block)
+            yield key, (cleared, dict(pairs))
+
+
+class LSMKeyColumnValueStore(KeyColumnValueStore):
+    """A key/column/value store (see KeyColumnValueStore) whose data lives in a
+    directory of immutable segment files, with only recent writes held in
+    memory.
+
+    path names the directory (a temporary one if none is given), which holds
+    the log of the memtable alongside the segments.  Snapshot persistence and
+    lazy loading don't apply: the segments are always read lazily, and their
+    Bloom filters count into filter_stats."""
+
+    def __init__(self, path=None, memtable_bytes=4 * 1024 * 1024,
+                 max_segments=8, durability=OS_BUFFERED,
+                 commit_interval_ms=10):
+        if path is None:
+            self.directory = mkdtemp()
+        else:
+            self.directory = os.path.expandvars(os.path.expanduser(path))
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+        self.max_segments = max_segments
+        self.cleared = set()
+        KeyColumnValueStore.__init__(self, os.path.join(self.directory, 'log'),
+                                     checkpoint_bytes=memtable_bytes,
+                                     durability=durability,
+                                     commit_interval_ms=commit_interval_ms)
+
+    def _create_log_file(self, path):
+        # Replaying the log needs the segments to be open already.
+        #
+        # Every layer but the memtable, newest first.  The tuple is replaced
+        # rather than modified, so readers can iterate over it without locks.
+        self.levels = tuple(self._open_segments())
+        self._next_segment = max([s.last for s in self.levels] or [0]) + 1
+        KeyColumnValueStore._create_log_file(self, path)
+
+    def _open_segments(self):
+        """Opens the segments in the directory, newest first, removing any
+        that have been superseded by a merge."""
+        ranges = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                ranges.append((int(match.group(1)), int(match.group(2))))
+            elif name.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, name))
+        segments = []
+        for first, last in sorted(ranges, key=lambda r: r[0] - r[1]):
+            path = os.path.join(self.directory, SEGMENT_NAME % (first, last))
+            if any(s.first <= first and last <= s.last for s in segments):
+                os.remove(path)
+            else:
+                segments.append(_Segment(path, first, last,
+                                         self.filter_stats))
+        segments.sort(key=lambda s: s.last, reverse=True)
+        return segments
+
+    def _layers(self):
+        """Returns every layer, newest first."""
+        return (_Memtable(self.kcv, self.cleared),) + self.levels
+
+    def _entries(self, key, col=None):
+        """Yields the (cleared, cols) entries for key from each layer that has
+        one, newest first, up to and including the first that cleared it.  If
+        col is given, layers whose filters rule out key/col (and clearing key)
+        are skipped."""
+        for layer in self._layers():
+            entry = layer.entry(key, col)
+            if entry is not None:
+                yield entry
+                if entry[0]:
+                    return
+
+    def _exists(self, key):
+        for entry in self._entries(key):
+            return _exists(entry)
+        return False
+
+    def _row(self, key):
+        """Returns a sorteddict merging the columns of key from every layer,
+        or None if there's no such key.
+
+        Requires O(c*log(c)) operations, where c is the number of columns
+        written to the key across all layers."""
+        entries = list(self._entries(key))
+        if not entries or not _exists(entries[0]):
+            return None
+        cols = {}
+        for cleared, layer_cols in reversed(entries):
+            for col, val in layer_cols.iteritems():
+                if val is None:
+                    cols.pop(col, None)
+                else:
+                    cols[col] = val
+        return _row_from_sorted(sorted(cols.iteritems()))
+
+    def get(self, key, col):
+        """Return the value at the specified key/column, or None if no such
+        value exists.
+
+        Requires one lookup per layer, at worst, but the segments' Bloom
+        filters rule most of them out without reading anything."""
+        for cleared, cols in self._entries(key, col):
+            if col in cols:
+                return cols[col]
+            if cleared:
+                break
+        return None
+
+    def get_keys(self):
+        """Returns a set containing all of the keys in the store.
+
+        Requires reading every key in every layer."""
+        keys = set()
+        for layer in self._layers():
+            keys.update(layer.iterkeys())
+        return set(key for key in keys if self._exists(key))
+
+    def _iter_keys(self, start, stop):
+        """Merges the keys between start and stop from every layer, in
+        sorted order, reading the newest entry for each to check that it
+        still exists."""
+        keys = heapq.merge(*[layer.iter_range(start, stop)
+                             for layer in self._layers()])
+        return (key for key, _ in itertools.groupby(keys)
+                if self._exists(key))
+
+    def count_keys(self):
+        """Returns the number of keys in the store.
+
+        Requires reading every key in every layer."""
+        return sum(1 for key in self.iter_keys())
+
+    def bulk_load(self, triples, chunk_triples=100000, presorted=False):
+        """Like KeyColumnValueStore.bulk_load, except that the triples are
+        written straight to a new segment, the newest, after flushing the
+        memtable, so that memory use doesn't grow with the input.
+
+        With presorted=True, the rows stream into the segment one at a time.
+        Otherwise the triples are sorted chunk_triples at a time, each chunk
+        into a segment of its own, and those are then merged into one (just
+        the once, rather than as they pile up), so that loading n triples
+        writes O(n) bytes twice over, on top of whatever merges it brings on
+        with older segments."""
+        self._check_writable()
+        self._check_outside_batch('bulk_load')
+        with self._no_checkpointer():
+            self._checkpoint()
+            if presorted:
+                groups = [_key_groups(triples, True)]
+            else:
+                triples = iter(triples)
+                groups = iter(lambda: list(itertools.islice(
+                    triples, chunk_triples)), [])
+                groups = (_key_groups(chunk, False) for chunk in groups)
+            segments = []
+            try:
+                for chunk in groups:
+                    first = next(chunk, None)
+                    if first is None:
+                        continue
+                    chunk = itertools.chain([first], chunk)
+                    number = self._next_segment
+                    self._next_segment += 1
+                    segment = self._write_segment(
+                        ((key, (False, dict(pairs))) for key, pairs in chunk),
+                        number, number)
+                    # Newest first, like the levels.
+                    segments.insert(0, segment)
+                    self.levels = (segment,) + self.levels
+            finally:
+                # Whatever was loaded before an exception stays loaded.
+                if len(segments) > 1:
+                    self._merge(segments, bottom=False)
+                self._lose_changes()
+                self._merge_segments()
+
+    def size_stats(self):
+        """Returns a dict of the number of 'keys' in the store and the total
+        number of 'columns' among them.
+
+        Requires merging every row in every layer."""
+        keys = self.get_keys()
+        return {'keys': len(keys),
+                'columns': sum(len(self._row(key)) for key in keys)}
+
+    def _put(self, key, col, val):
+        cv = self.kcv.get(key)
+        if cv is None:
+            self.kcv[key] = sorteddict({col: val})
+            return ('memtable', key, None, key in self.cleared)
+        undo = ('col', key, col, cv.get(col, _MISSING))
+        cv[col] = val
+        return undo
+
+    def _apply(self, record):
+        op = record[0]
+        if op == 'set':
+            return self._put(*record[1:])
+        if op == 'delete':
+            key, col = record[1:]
+            if self.get(key, col) is None:
+                return None
+            return self._put(key, col, None)
+        if op == 'delete_key':
+            key = record[1]
+            if not self._exists(key):
+                return None
+            undo = ('memtable', key, self.kcv.get(key), key in self.cleared)
+            self.kcv[key] = sorteddict()
+            self.cleared.add(key)
+            return undo
+        return KeyColumnValueStore._apply(self, record)
+
+    def _undo(self, undo):
+        if undo[0] != 'memtable':
+            return KeyColumnValueStore._undo(self, undo)
+        key, cv, cleared = undo[1:]
+        if cv is None:
+            del self.kcv[key]
+        else:
+            self.kcv[key] = cv
+        if cleared:
+            self.cleared.add(key)
+        else:
+            self.cleared.discard(key)
+
+    # Flushing the memtable takes the place of checkpointing, since that's
+    # what truncates the log.
+
+    def _checkpoint(self):
+        with self._lock:
+            self._start_checkpoint()()
+
+    def _start_checkpoint(self):
+        """Freezes the memtable and starts a new one, returning a function that
+        writes the frozen one to a new segment and truncates the log."""
+        if not self.kcv and not self.cleared:
+            return lambda: None
+        self._log.flush()
+        offset = os.path.getsize(self.path)
+        records = self._log_records
+        frozen = _Memtable(self.kcv, self.cleared)
+        number = self._next_segment
+        self._next_segment += 1
+        # Readers look at the memtable before the levels, so the frozen layer
+        # has to be in the levels before the memtable is replaced.
+        self.levels = (frozen,) + self.levels
+        self.cleared = set()
+        self.kcv = {}
+
+        def finish():
+            segment = self._write_segment(frozen.iterentries(), number, number)
+            with self._lock:
+                self.levels = tuple(segment if layer is frozen else layer
+                                    for layer in self.levels)
+                # The new log starts from an empty memtable, and the records
+                # written since the freeze are copied over to rebuild it.
+                tmp = self.path + '.tmp'
+                with open(tmp, 'wb') as log:
+                    pickle.dump({}, log, pickle.HIGHEST_PROTOCOL)
+                self._swap_log(tmp, offset, records)
+            self._merge_segments()
+        return finish
+
+    def _write_segment(self, entries, first, last):
+        """Writes the given key/entry tuples to a new segment."""
+        path = os.path.join(self.directory, SEGMENT_NAME % (first, last))
+        blocks = (self._segment_block(key, cleared, cols)
+                  for key, (cleared, cols) in entries)
+        with open(path + '.tmp', 'wb') as f:
+            kcvtable.write_table(f, blocks)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+        self._fsync_dir()
+        return _Segment(path, first, last, self.filter_stats)
+
+    def _segment_block(self, key, cleared, cols):
+        """Returns the (key, block, items) tuple that kcvtable.write_table
+        wants for an entry."""
+        items = [kcvtable.column_item(key, col) for col in cols]
+        if cleared:
+            items.append(_cleared_item(key))
+        return key, _encode_entry(cleared, sorted(cols.iteritems())), items
+
+    def _merge_segments(self):
+        """Merges runs of segments (see _pick_merge) for as long as there are
+        more than max_segments of them and a run to merge."""
+        while True:
+            segments = [l for l in self.levels if isinstance(l, _Segment)]
+            if len(segments) <= self.max_segments:
+                return
+            run = _pick_merge(segments)
+            if run is None:
+                return
+            self._merge(run, bottom=run[-1] is segments[-1])
+
+    def _merge(self, segments, bottom=True):
+        """Merges the given segments, which must be adjacent, newest first,
+        into a single segment in their place.  bottom says whether they
+        include the oldest segment, below which tombstones hide nothing."""
+        streams = [_tagged_entries(s) for s in segments]
+        entries = self._merge_entries(heapq.merge(*streams), bottom)
+        merged = self._write_segment(entries, segments[-1].first,
+                                     segments[0].last)
+        with self._lock:
+            levels = []
+            for layer in self.levels:
+                if layer is segments[0]:
+                    levels.append(merged)
+                elif layer not in segments:
+                    levels.append(layer)
+            self.levels = tuple(levels)
+        for segment in segments:
+            os.remove(segment.path)
+
+    def _merge_entries(self, tagged, bottom=True):
+        """Combines the entries for each key from an oldest-to-newest stream
+        of (key, age, entry) tuples.  If bottom is true, tombstones and
+        deleted keys are dropped, since there's nothing older for them to
+        hide."""
+        key = entry = None
+        for next_key, _, next_entry in tagged:
+            if entry is not None and next_key != key:
+                if not bottom:
+                    yield key, entry
+                elif _exists(entry):
+                    yield key, _without_tombstones(entry)
+                entry = None
+            key = next_key
+            if entry is None or next_entry[0]:
+                entry = (next_entry[0], dict(next_entry[1]))
+            else:
+                entry[1].update(next_entry[1])
+        if entry is None:
+            return
+        if not bottom:
+            yield key, entry
+        elif _exists(entry):
+            yield key, _without_tombstones(entry)
+
@@ -0,0 +1,169 @@
+"""
+Operation metrics for the key/column/value store, and their rendering in the
+Prometheus text exposition format.
+
+Recording a latency costs a bisect into a short list of bucket bounds and a
+few additions under a lock, so metrics are cheap enough to leave on.
+"""
+
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from timeit import default_timer as clock
+
+
+# Upper bounds of the latency histograms' buckets, in seconds.
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+           0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+           10.0)
+
+
+class Histogram(object):
+    """Counts of observed latencies in each of BUCKETS (plus one bucket for
+    anything slower), with their count and sum."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self):
+        """Yields (upper bound, count of observations at most that) tuples,
+        ending with ('+Inf', count), as Prometheus buckets are."""
+        total = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            total += count
+            yield repr(bound), total
+        yield '+Inf', self.count
+
+
+class Metrics(object):
+    """Latency histograms and counters, by name and label.
+
+    operations holds a Histogram for each store operation, errors counts
+    operations that raised, and persist and persist_bytes hold a Histogram
+    and a byte count for each kind of disk write ('log' appends, 'fsync' of
+    a group commit, 'snapshot' writes and 'checkpoint' log swaps).  requests
+    holds a Histogram for each HTTP endpoint, for servers that record them."""
+
+    def __init__(self):
+        self.operations = defaultdict(Histogram)
+        self.errors = defaultdict(int)
+        self.persist = defaultdict(Histogram)
+        self.persist_bytes = defaultdict(int)
+        self.requests = defaultdict(Histogram)
+        self._lock = threading.Lock()
+
+    def observe(self, histograms, name, seconds):
+        with self._lock:
+            histograms[name].observe(seconds)
+
+    def operation(self, name, seconds, failed=False):
+        with self._lock:
+            self.operations[name].observe(seconds)
+            if failed:
+                self.errors[name] += 1
+
+    def persisted(self, kind, seconds, nbytes):
+        with self._lock:
+            self.persist[kind].observe(seconds)
+            self.persist_bytes[kind] += nbytes
+
+
+# Whether the current thread is within a timed method.
+_timing = threading.local()
+
+
+def timed(method):
+    """Decorates a store method to record its latency in the store's
+    metrics, if it has any, under the method's name.  Calls made from within
+    another timed method (the sets of a set_many, say) aren't recorded, so
+    that each operation is counted once, as whatever it was called as."""
+    name = method.__name__
+
+    def timed_method(self, *args, **kwargs):
+        metrics = self.metrics
+        if metrics is None or getattr(_timing, 'active', False):
+            return method(self, *args, **kwargs)
+        start = clock()
+        failed = True
+        _timing.active = True
+        try:
+            result = method(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _timing.active = False
+            metrics.operation(name, clock() - start, failed)
+    timed_method.__name__ = name
+    timed_method.__doc__ = method.__doc__
+    return timed_method
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def _histograms(lines, name, help, label, histograms):
+    lines.append('# HELP %s %s' % (name, help))
+    lines.append('# TYPE %s histogram' % name)
+    for value, histogram in sorted(histograms.items()):
+        for bound, count in histogram.cumulative():
+            lines.append('%s_bucket%s %d' % (
+                name, _labels(**{label: value, 'le': bound}), count))
+        lines.append('%s_sum%s %r' % (name, _labels(**{label: value}),
+                                      histogram.sum))
+        lines.append('%s_count%s %d' % (name, _labels(**{label: value}),
+                                        histogram.count))
+
+
+def _samples(lines, name, help, kind, samples, label=None):
+    lines.append('# HELP %s %s' % (name, help))
+    lines.append('# TYPE %s %s' % (name, kind))
+    if label is None:
+        lines.append('%s %r' % (name, samples))
+        return
+    for value, sample in sorted(samples.items()):
+        lines.append('%s%s %r' % (name, _labels(**{label: value}), sample))
+
+
+def render(metrics, gauges=None, counters=None):
+    """Returns the metrics in the Prometheus text format, followed by the
+    given gauges and counters, which are dicts from names to values (or to
+    dicts from stat labels to values)."""
+    lines = []
+    with metrics._lock:
+        _histograms(lines, 'kcv_operation_seconds',
+                    'Latency of store operations.', 'op', metrics.operations)
+        _samples(lines, 'kcv_operation_errors_total',
+                 'Store operations that raised an exception.', 'counter',
+                 dict(metrics.errors), 'op')
+        _histograms(lines, 'kcv_persist_seconds',
+                    'Time spent writing the store to disk.', 'kind',
+                    metrics.persist)
+        _samples(lines, 'kcv_persist_bytes_total',
+                 'Bytes written to disk.', 'counter',
+                 dict(metrics.persist_bytes), 'kind')
+        if metrics.requests:
+            _histograms(lines, 'kcv_http_request_seconds',
+                        'Latency of HTTP requests, by endpoint.',
+                        'endpoint', metrics.requests)
+    for kind, suffix, samples in (('gauge', '', gauges or {}),
+                                  ('counter', '_total', counters or {})):
+        for name, value in sorted(samples.items()):
+            label = 'stat' if isinstance(value, dict) else None
+            _samples(lines, 'kcv_' + name + suffix,
+                     name.replace('_', ' ').capitalize() + '.', kind, value,
+                     label)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,331 @@
+"""
+A compact binary protocol for a KeyColumnValueStore over TCP, with a server
+and a matching client.
+
+Every request and reply is a frame: a 4-byte little-endian length, followed
+by that many bytes of payload.  A request's payload is a 1-byte opcode
+followed by its arguments, and a reply's is a 1-byte status (OK or ERROR)
+followed by its results.  Arguments and results are all strings (or None),
+each encoded as a 4-byte signed length (-1 for None) followed by its UTF-8
+bytes, so e.g. a slice is returned as its columns and values, interleaved.
+Fields are decoded into unicode strings at either end, so that the store
+holds the same strings whether they're written over this protocol or over
+HTTP (whose JSON bodies decode into unicode); a request with a field that
+isn't UTF-8 is refused.
+Clients may send any number of requests without waiting for replies
+(pipelining); the replies come back in the same order.
+
+The server runs on the same event loop machinery as asynckcv, so reads are
+answered straight away, while writes are handed to worker threads.  As with
+asynckcv, the store should be concurrent.
+"""
+
+import asynchat
+import asyncore
+import socket
+import struct
+from asynckcv import _Executor, _Waker
+from kcvstore import KeyColumnValueStore
+
+
+FRAME = struct.Struct('<I')
+FIELD = struct.Struct('<i')
+OP = struct.Struct('<B')
+
+OK = 0
+ERROR = 1
+
+# Opcodes.
+GET = 1
+SET = 2
+DELETE = 3
+DELETE_KEY = 4
+GET_KEY = 5
+GET_KEYS = 6
+GET_SLICE = 7
+SET_MANY = 8
+MULTI_GET = 9
+DELETE_MANY = 10
+
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+def _pairs(fields):
+    return zip(fields[::2], fields[1::2])
+
+
+def _triples(fields):
+    return zip(fields[::3], fields[1::3], fields[2::3])
+
+
+def _flatten(tuples):
+    return [field for t in tuples for field in t]
+
+
+# For each opcode: the name of the store method it calls, whether that
+# writes, how to make its arguments from the request's fields, and how to
+# make the reply's fields from its result.
+OPS = {
+    GET: ('get', False, tuple, lambda val: [val]),
+    SET: ('set', True, tuple, lambda result: []),
+    DELETE: ('delete', True, tuple, lambda result: []),
+    DELETE_KEY: ('delete_key', True, tuple, lambda result: []),
+    GET_KEY: ('get_key', False, tuple, _flatten),
+    GET_KEYS: ('get_keys', False, tuple, list),
+    GET_SLICE: ('get_slice', False, tuple, _flatten),
+    SET_MANY: ('set_many', True, lambda fields: (_triples(fields),),
+               lambda result: []),
+    MULTI_GET: ('multi_get', False, lambda fields: (_pairs(fields),), list),
+    DELETE_MANY: ('delete_many', True, lambda fields: (_pairs(fields),),
+                  lambda result: []),
+}
+
+
+def encode_fields(fields):
+    """Encodes a list of strings (or Nones) as a payload."""
+    out = []
+    for field in fields:
+        if field is None:
+            out.append(FIELD.pack(-1))
+        else:
+            if isinstance(field, unicode):
+                field = field.encode('utf-8')
+            out.append(FIELD.pack(len(field)))
+            out.append(field)
+    return ''.join(out)
+
+
+def decode_fields(payload, offset=0):
+    """Decodes a payload into a list of unicode strings (or Nones), starting
+    at the given offset.  Raises ValueError (UnicodeDecodeError, if a field
+    isn't UTF-8) for a malformed payload."""
+    fields = []
+    end = len(payload)
+    while offset < end:
+        length, = FIELD.unpack_from(payload, offset)
+        offset += FIELD.size
+        if length < 0:
+            fields.append(None)
+        else:
+            if offset + length > end:
+                raise ValueError('truncated field')
+            fields.append(payload[offset:offset + length].decode('utf-8'))
+            offset += length
+    return fields
+
+
+def frame(payload):
+    return FRAME.pack(len(payload)) + payload
+
+
+class _Connection(asynchat.async_chat):
+    """A client connection, answering its requests in order."""
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, server.map)
+        self.server = server
+        self._data = []
+        self._length = None  # of the payload being read, once known
+        self._requests = []
+        self._busy = False  # waiting on a worker to answer a request
+        self.set_terminator(FRAME.size)
+
+    def collect_incoming_data(self, data):
+        self._data.append(data)
+
+    def found_terminator(self):
+        data, self._data = ''.join(self._data), []
+        if self._length is None:
+            self._length, = FRAME.unpack(data)
+            if self._length > MAX_FRAME_BYTES:
+                self.close()
+                return
+            if self._length:
+                self.set_terminator(self._length)
+                return
+            data = ''  # an empty request, which is an error, in its turn
+        self._length = None
+        self.set_terminator(FRAME.size)
+        self._requests.append(data)
+        self._next()
+
+    def _next(self):
+        while self._requests and not self._busy:
+            self._handle(self._requests.pop(0))
+
+    def _handle(self, payload):
+        try:
+            op, = OP.unpack_from(payload)
+            name, writes, args, result = OPS[op]
+            args = args(decode_fields(payload, OP.size))
+        except (KeyError, ValueError, struct.error) as e:
+            self._reply(ERROR, ['bad request: %s' % (e,)])
+            return
+        method = getattr(self.server.store, name)
+        if not writes:
+            try:
+                self._reply(OK, result(method(*args)))
+            except Exception as e:
+                self._reply(ERROR, [repr(e)])
+            return
+        self._busy = True
+
+        def done(value, error):
+            self._busy = False
+            if error is None:
+                self._reply(OK, result(value))
+            else:
+                self._reply(ERROR, [repr(error)])
+            self._next()
+
+        self.server.executor.submit(method, args, done)
+
+    def _reply(self, status, fields):
+        self.push(frame(OP.pack(status) + encode_fields(fields)))
+
+    def readable(self):
+        # Stop reading while requests are queued behind a write, so that a
+        # client can't pile up an unbounded backlog of them.
+        return not self._requests and asynchat.async_chat.readable(self)
+
+
+class Server(asyncore.dispatcher):
+    """A binary protocol server for a KeyColumnValueStore.  serve_forever()
+    runs its event loop, until shutdown() is called (from any thread)."""
+
+    def __init__(self, store, host='127.0.0.1', port=5001, workers=8,
+                 backlog=1024):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.store = store
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(backlog)
+        self.address = self.socket.getsockname()
+        self.waker = _Waker(self.map)
+        self.executor = _Executor(self.waker, workers)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            pair[0].setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _Connection(pair[0], self)
+
+    def serve_forever(self):
+        asyncore.loop(timeout=30, use_poll=True, map=self.map)
+
+    def shutdown(self):
+        self.executor.shutdown()
+        self.waker.call(asyncore.close_all, self.map)
+
+
+class ProtocolError(Exception):
+    """Raised by the client when the server answers a request with an
+    error."""
+
+
+class _Calls(object):
+    """The store's methods, as requests.  Subclasses decide what _call
+    does with them."""
+
+    def get(self, key, col):
+        return self._call(GET, [key, col], lambda fields: fields[0])
+
+    def set(self, key, col, val):
+        return self._call(SET, [key, col, val], lambda fields: None)
+
+    def delete(self, key, col):
+        return self._call(DELETE, [key, col], lambda fields: None)
+
+    def delete_key(self, key):
+        return self._call(DELETE_KEY, [key], lambda fields: None)
+
+    def get_key(self, key):
+        return self._call(GET_KEY, [key], _pairs)
+
+    def get_keys(self):
+        return self._call(GET_KEYS, [], set)
+
+    def get_slice(self, key, start, stop):
+        return self._call(GET_SLICE, [key, start, stop], _pairs)
+
+    def set_many(self, triples):
+        return self._call(SET_MANY, _flatten(triples), lambda fields: None)
+
+    def multi_get(self, pairs):
+        return self._call(MULTI_GET, _flatten(pairs), list)
+
+    def delete_many(self, pairs):
+        return self._call(DELETE_MANY, _flatten(pairs), lambda fields: None)
+
+
+class Client(_Calls):
+    """A client for a binary protocol Server, with the same methods as the
+    store.  Each call waits for its reply; to send many requests before
+    waiting for any replies, use pipeline()."""
+
+    def __init__(self, host='127.0.0.1', port=5001):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self.sock.makefile('rb')
+
+    def _call(self, op, fields, decode):
+        self.sock.sendall(frame(OP.pack(op) + encode_fields(fields)))
+        return self._receive(decode)
+
+    def _receive(self, decode):
+        header = self._file.read(FRAME.size)
+        if len(header) < FRAME.size:
+            raise socket.error('connection closed')
+        payload = self._file.read(FRAME.unpack(header)[0])
+        status, = OP.unpack_from(payload)
+        fields = decode_fields(payload, OP.size)
+        if status != OK:
+            raise ProtocolError(fields[0] if fields else None)
+        return decode(fields)
+
+    def pipeline(self):
+        return Pipeline(self)
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+
+class Pipeline(_Calls):
+    """Queues up calls to a Client's server, to be sent all at once by
+    execute(), which returns their results in order.  If any of them failed,
+    execute() raises the ProtocolError of the first one to, once all the
+    replies have been read."""
+
+    def __init__(self, client):
+        self.client = client
+        self._requests = []
+        self._decoders = []
+
+    def _call(self, op, fields, decode):
+        self._requests.append(frame(OP.pack(op) + encode_fields(fields)))
+        self._decoders.append(decode)
+        return self
+
+    def execute(self):
+        requests, self._requests = self._requests, []
+        decoders, self._decoders = self._decoders, []
+        self.client.sock.sendall(''.join(requests))
+        results = []
+        error = None
+        for decode in decoders:
+            try:
+                results.append(self.client._receive(decode))
+            except ProtocolError as e:
+                results.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return results
+
+
+if __name__ == '__main__':
+    store = KeyColumnValueStore(path='kcvstore.pickle', concurrent=True)
+    Server(store).serve_forever()
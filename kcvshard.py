@@ -0,0 +1,294 @@
+"""
+A key/column/value store partitioned across several independent stores.
+
+ShardedKeyColumnValueStore hashes each key to one of its shards, each of
+which is a whole KeyColumnValueStore with its own file, log and lock.  So
+writes to keys in different shards don't wait for each other (fsyncs, in
+particular, happen in parallel), a write only ever appends to (or rewrites)
+its own shard's file, and the shards are loaded in parallel when the store
+is opened.
+"""
+
+import heapq
+import itertools
+import os
+import Queue
+import threading
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from kcvstore import KeyColumnValueStore
+from tempfile import mkdtemp
+
+
+SHARD_NAME = 'shard-%04d.kcv'
+SHARDS_FILE = 'shards'
+BULK_CHUNK = 1000  # triples handed to a shard's bulk_load at a time
+BULK_CHUNKS = 16  # chunks queued up for each shard, at most
+
+
+def _bytes(s):
+    return s.encode('utf-8') if isinstance(s, unicode) else s
+
+
+class ShardedKeyColumnValueStore(object):
+    """A key/column/value store (see KeyColumnValueStore) made of shards
+    separate stores, between which the keys are partitioned by hash.
+
+    path names the directory (a temporary one if none is given) holding the
+    shards' files.  The number of shards is fixed when the directory is
+    created: opening it again with a different number raises ValueError.
+    Any other keyword arguments are passed on to every shard.
+
+    The API is that of KeyColumnValueStore, with the same complexity for
+    each key, except that a batch (or set_many or delete_many) is only
+    atomic within each shard: a crash can leave it persisted in some shards
+    but not others.  get_keys, and the multi-key methods, require O(n)
+    operations for the n shards on top of their usual cost (iter_keys, a
+    merge of the shards' keys, O(log(n)) for each key)."""
+
+    def __init__(self, path=None, shards=8, **options):
+        if path is None:
+            self.directory = mkdtemp()
+        else:
+            self.directory = os.path.expandvars(os.path.expanduser(path))
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+        self.path = self.directory
+        shards_file = os.path.join(self.directory, SHARDS_FILE)
+        if os.path.exists(shards_file):
+            with open(shards_file) as f:
+                existing = int(f.read())
+            if existing != shards:
+                raise ValueError('%r has %d shards, not %d' %
+                                 (self.directory, existing, shards))
+        else:
+            with open(shards_file, 'w') as f:
+                f.write('%d\n' % shards)
+        self.shards = self._open_shards(shards, options)
+
+    def _open_shards(self, n, options):
+        """Opens the n shards, each in its own thread.
+
+        Unpickling holds the GIL, so this mostly overlaps the reading of the
+        shards' files (lazy shards, though, hardly read anything at all).
+        Loading them in other processes instead would only mean pickling
+        them all over again to hand them back."""
+        shards = [None] * n
+        errors = []
+
+        def open_shard(i):
+            try:
+                shards[i] = KeyColumnValueStore(
+                    path=os.path.join(self.directory, SHARD_NAME % i),
+                    **options)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=open_shard, args=(i,))
+                   for i in xrange(n)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            for shard in shards:
+                if shard is not None:
+                    shard.close()
+            raise errors[0]
+        return shards
+
+    def _shard(self, key):
+        """Returns the shard holding key.
+
+        crc32 rather than hash(), so that keys stay in the same shard from
+        one process (or platform) to the next."""
+        return self.shards[(zlib.crc32(_bytes(key)) & 0xffffffff) %
+                           len(self.shards)]
+
+    def _group(self, items, key_of):
+        """Returns a dict from shards to lists of (index, item) tuples, for
+        the items whose keys are in that shard."""
+        groups = {}
+        for i, item in enumerate(items):
+            groups.setdefault(self._shard(key_of(item)), []).append((i, item))
+        return groups
+
+    @property
+    def filter_stats(self):
+        return sum((shard.filter_stats for shard in self.shards), Counter())
+
+    @property
+    def cache_stats(self):
+        return sum((shard.cache_stats for shard in self.shards), Counter())
+
+    @contextmanager
+    def batch(self):
+        """Returns a context manager that batches the mutations made within
+        it in every shard.  See KeyColumnValueStore.batch, but note that the
+        batch is only atomic within each shard."""
+        # The shards' batches are always entered in the same order, so that
+        # two batches can't deadlock.
+        with self._batches(self.shards):
+            yield
+
+    @contextmanager
+    def _batches(self, shards):
+        if not shards:
+            yield
+            return
+        with shards[0].batch():
+            with self._batches(shards[1:]):
+                yield
+
+    def checkpoint(self, background=False):
+        """Checkpoints every shard.  Returns the shards' checkpoint threads,
+        if background is true."""
+        return [shard.checkpoint(background) for shard in self.shards]
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def set(self, key, col, val):
+        self._shard(key).set(key, col, val)
+
+    def compare_and_set(self, key, col, expected, new):
+        return self._shard(key).compare_and_set(key, col, expected, new)
+
+    def increment(self, key, col, delta=1):
+        return self._shard(key).increment(key, col, delta)
+
+    def append(self, key, col, suffix):
+        self._shard(key).append(key, col, suffix)
+
+    def set_many(self, triples):
+        for shard, group in self._group(list(triples),
+                                        lambda t: t[0]).iteritems():
+            shard.set_many(t for i, t in group)
+
+    def bulk_load(self, triples, presorted=False):
+        """Bulk loads the triples into every shard at once: see
+        KeyColumnValueStore.bulk_load.
+
+        Each shard loads its own triples in a thread of its own, as they're
+        handed over BULK_CHUNK at a time through a queue of at most
+        BULK_CHUNKS chunks, so that, with presorted=True, the triples in
+        flight take O(n*BULK_CHUNK*BULK_CHUNKS) memory for the n shards, on
+        top of a row per shard.  (The triples of each shard stay in key
+        order, if they all were.)  The first exception raised by a shard is
+        raised once they've all finished."""
+        queues = [Queue.Queue(BULK_CHUNKS) for shard in self.shards]
+        errors = []
+
+        def load(shard, queue):
+            chunks = iter(queue.get, None)
+            try:
+                shard.bulk_load(itertools.chain.from_iterable(chunks),
+                                presorted)
+            except Exception as e:
+                errors.append(e)
+                # Keep taking chunks, so that the loop below never blocks.
+                for chunk in chunks:
+                    pass
+
+        threads = [threading.Thread(target=load, args=(shard, queue))
+                   for shard, queue in zip(self.shards, queues)]
+        for thread in threads:
+            thread.start()
+        index = dict((shard, i) for i, shard in enumerate(self.shards))
+        chunks = [[] for shard in self.shards]
+        try:
+            for triple in triples:
+                i = index[self._shard(triple[0])]
+                chunks[i].append(triple)
+                if len(chunks[i]) == BULK_CHUNK:
+                    queues[i].put(chunks[i])
+                    chunks[i] = []
+            for queue, chunk in zip(queues, chunks):
+                if chunk:
+                    queue.put(chunk)
+        finally:
+            for queue in queues:
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+    def export(self):
+        """Yields every key/column/value triple in the store, sorted by key
+        and then by column, merging the shards' exports (see
+        KeyColumnValueStore.export) in O(log(n)) operations per triple for
+        the n shards."""
+        return heapq.merge(*[shard.export() for shard in self.shards])
+
+    def get(self, key, col):
+        return self._shard(key).get(key, col)
+
+    def multi_get(self, pairs):
+        pairs = list(pairs)
+        values = [None] * len(pairs)
+        for shard, group in self._group(pairs, lambda p: p[0]).iteritems():
+            for (i, pair), val in zip(group,
+                                      shard.multi_get(p for i, p in group)):
+                values[i] = val
+        return values
+
+    def get_key(self, key):
+        return self._shard(key).get_key(key)
+
+    def get_keys(self):
+        keys = set()
+        for shard in self.shards:
+            keys.update(shard.get_keys())
+        return keys
+
+    def iter_keys(self, start=None, stop=None, limit=None, after=None):
+        return itertools.islice(heapq.merge(*[
+            shard.iter_keys(start, stop, limit, after)
+            for shard in self.shards]), limit)
+
+    def count_keys(self):
+        return sum(shard.count_keys() for shard in self.shards)
+
+    def delete(self, key, col):
+        self._shard(key).delete(key, col)
+
+    def delete_many(self, pairs):
+        for shard, group in self._group(list(pairs),
+                                        lambda p: p[0]).iteritems():
+            shard.delete_many(p for i, p in group)
+
+    def delete_key(self, key):
+        self._shard(key).delete_key(key)
+
+    def get_slice(self, key, start, stop):
+        return self._shard(key).get_slice(key, start, stop)
+
+    def multi_get_slice(self, keys, start, stop):
+        keys = list(keys)
+        slices = [None] * len(keys)
+        for shard, group in self._group(keys, lambda k: k).iteritems():
+            for (i, key), s in zip(group, shard.multi_get_slice(
+                    [k for i, k in group], start, stop)):
+                slices[i] = s
+        return slices
+
+    def iter_slice(self, key, start, stop, **options):
+        return self._shard(key).iter_slice(key, start, stop, **options)
+
+    def get_prefix(self, key, prefix):
+        return self._shard(key).get_prefix(key, prefix)
+
+    def iter_prefix(self, key, prefix, **options):
+        return self._shard(key).iter_prefix(key, prefix, **options)
+
+    def count_slice(self, key, start, stop):
+        return self._shard(key).count_slice(key, start, stop)
+
+    def count_prefix(self, key, prefix):
+        return self._shard(key).count_prefix(key, prefix)
+
+    def count_columns(self, key):
+        return self._shard(key).count_columns(key)
@@ -1,7 +1,730 @@
+import heapq
+import itertools
+import kcvmetrics
+import kcvtable
 import os
-import pickle
-from blist import sorteddict
+import shutil
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from blist import sorteddict, sortedset
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
 from tempfile import NamedTemporaryFile
+from timeit import default_timer as clock
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+# Persistence strategies accepted by KeyColumnValueStore.
+LOG = 'log'
+SNAPSHOT = 'snapshot'
+
+# Durability settings accepted by KeyColumnValueStore, from fastest to safest.
+NONE = 'none'
+OS_BUFFERED = 'os-buffered'
+GROUP_COMMIT = 'group-commit'
+FSYNC = 'fsync-per-write'
+
+# Stands in for the previous value of a column that didn't exist, in undo
+# records.
+_MISSING = object()
+
+
+class ChangesLost(Exception):
+    """Raised by changes_since when some of the changes asked for are no
+    longer in the change feed (or never were, for a sequence number from
+    before the store was opened).  Whoever was following the feed has to
+    reread whatever it was keeping up to date."""
+
+    def __init__(self, seq, oldest):
+        Exception.__init__(self, 'changes since %d are no longer in the '
+                           'feed, which starts at %d' % (seq, oldest))
+        self.seq = seq
+        self.oldest = oldest
+
+
+def _row_from_sorted(pairs):
+    """Builds a sorteddict from a list of column/value tuples that's already
+    sorted by column.
+
+    Requires O(c) operations, rather than the O(c*log(c)**2) of inserting the
+    columns one by one."""
+    # This reaches into the sorteddict's internals, but they're simple enough:
+    # a plain dict, plus a sortedset of its keys backed by a blist.
+    cv = sorteddict()
+    cv._map.update(pairs)
+    cv._sortedkeys._blist.extend(col for col, val in pairs)
+    return cv
+
+
+class _Columns(tuple):
+    """A sorted tuple of columns, with the bisect methods of a sortedset."""
+
+    __slots__ = ()
+
+    def bisect_left(self, col):
+        return bisect_left(self, col)
+
+    def bisect_right(self, col):
+        return bisect_right(self, col)
+
+    def __contains__(self, col):
+        i = bisect_left(self, col)
+        return i < len(self) and self[i] == col
+
+
+class _FrozenRow(object):
+    """A read-only row, built from a list of column/value tuples sorted by
+    column, in far less memory than a sorteddict.
+
+    The columns are kept in a tuple, interned so that rows with the same
+    columns share them, and the values (if they're all byte strings) are
+    packed end to end into a single string, with an array of where each one
+    ends.  So a column costs a pointer and a value costs its own bytes plus
+    four, instead of a dict entry, a blist entry and a string object.  In
+    exchange, looking up a column requires O(log(c)) operations instead of
+    O(1), and each value is copied out of the packed string as it's read.
+
+    It supports the parts of the sorteddict interface used for reading rows;
+    thaw() returns a sorteddict to write to."""
+
+    __slots__ = ('_cols', '_data', '_ends')
+
+    def __init__(self, pairs):
+        self._cols = _Columns(intern(col) if type(col) is str else col
+                              for col, val in pairs)
+        vals = [val for col, val in pairs]
+        if all(type(val) is str for val in vals):
+            self._data = ''.join(vals)
+            self._ends = array('I' if len(self._data) < 2 ** 32 else 'L')
+            end = 0
+            for val in vals:
+                end += len(val)
+                self._ends.append(end)
+        else:
+            self._data = tuple(vals)
+            self._ends = None
+
+    def __reduce__(self):
+        return _FrozenRow, (self.items(),)
+
+    def __len__(self):
+        return len(self._cols)
+
+    def __contains__(self, col):
+        return col in self._cols
+
+    def __iter__(self):
+        return iter(self._cols)
+
+    def value(self, i):
+        """Returns the value of the i-th column."""
+        if self._ends is None:
+            return self._data[i]
+        return self._data[self._ends[i - 1] if i else 0:self._ends[i]]
+
+    def get(self, col, default=None):
+        i = bisect_left(self._cols, col)
+        if i < len(self._cols) and self._cols[i] == col:
+            return self.value(i)
+        return default
+
+    def __getitem__(self, col):
+        val = self.get(col)
+        if val is None:
+            raise KeyError(col)
+        return val
+
+    def keys(self):
+        return self._cols
+
+    def iteritems(self):
+        for i, col in enumerate(self._cols):
+            yield col, self.value(i)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def thaw(self):
+        """Returns the row as a sorteddict, in O(c) operations."""
+        return _row_from_sorted(self.items())
+
+
+@contextmanager
+def _unlocked():
+    """A context manager that stands in for a lock when none is needed."""
+    yield
+
+
+def _copy_row(cv):
+    """Returns a copy of a sorteddict (or a sorteddict copy of a frozen row).
+
+    Requires O(c) operations, for copying its dict: the blist of its sorted
+    keys is copied lazily, a node at a time, as either copy is modified."""
+    if isinstance(cv, _FrozenRow):
+        return cv.thaw()
+    copy = sorteddict()
+    copy._map.update(cv._map)
+    copy._sortedkeys._blist = cv._sortedkeys._blist[:]
+    return copy
+
+
+def _sorted_pairs(pairs):
+    """Sorts a list of column/value tuples by column, in place, keeping only
+    the last value given for each column.  Returns the list.
+
+    Requires O(c) operations if the list is already sorted, and O(c*log(c))
+    otherwise."""
+    if any(pairs[i][0] > pairs[i + 1][0] for i in xrange(len(pairs) - 1)):
+        pairs.sort(key=lambda pair: pair[0])  # stable, so the last one wins
+    if any(pairs[i][0] == pairs[i + 1][0] for i in xrange(len(pairs) - 1)):
+        pairs[:] = [pair for i, pair in enumerate(pairs)
+                    if i + 1 == len(pairs) or pair[0] != pairs[i + 1][0]]
+    return pairs
+
+
+def _merge_pairs(old, new):
+    """Merges two lists of column/value tuples sorted by column, with the new
+    values winning, in O(len(old) + len(new)) operations."""
+    merged = []
+    i = j = 0
+    while i < len(old) and j < len(new):
+        if old[i][0] < new[j][0]:
+            merged.append(old[i])
+            i += 1
+        else:
+            if old[i][0] == new[j][0]:
+                i += 1
+            merged.append(new[j])
+            j += 1
+    merged.extend(old[i:])
+    merged.extend(new[j:])
+    return merged
+
+
+def _key_groups(triples, presorted):
+    """Yields a (key, pairs) tuple for each key among the given
+    key/column/value triples, in key order, where pairs is a list of the
+    key's column/value tuples, sorted by column, keeping only the last value
+    given for each column.
+
+    If presorted is true, the triples must be grouped by key, in key order,
+    and only one key's pairs are held in memory at a time; ValueError is
+    raised at the first key out of order.  Otherwise every triple is held
+    until they've all been read."""
+    if presorted:
+        previous = None
+        for key, group in itertools.groupby(triples, lambda t: t[0]):
+            if previous is not None and key <= previous:
+                raise ValueError('bulk_load triples out of order at key %r'
+                                 % (key,))
+            previous = key
+            yield key, _sorted_pairs([_pair(t) for t in group])
+        return
+    loaded = {}
+    for triple in triples:
+        loaded.setdefault(triple[0], []).append(_pair(triple))
+    for key in sorted(loaded):
+        # Popping the lists frees them as the rows are built.
+        yield key, _sorted_pairs(loaded.pop(key))
+
+
+def _pair(triple):
+    key, col, val = triple
+    assert all(isinstance(datum, basestring) for datum in (key, col, val))
+    return col, val
+
+
+def _merge_blocks(blocks, groups):
+    """Merges a table's (key, block, items) tuples (see
+    kcvtable.write_table) with (key, pairs) tuples of columns to set, both in
+    key order, yielding (key, block, items) tuples with the new values
+    winning.  Blocks of keys without new columns are passed on as they
+    are."""
+    block = next(blocks, None)
+    group = next(groups, None)
+    while block is not None or group is not None:
+        if group is None or (block is not None and block[0] < group[0]):
+            yield block
+            block = next(blocks, None)
+        elif block is None or group[0] < block[0]:
+            yield _table_entry(*group)
+            group = next(groups, None)
+        else:
+            key, pairs = group
+            yield _table_entry(key, _merge_pairs(
+                kcvtable.decode_block(block[1]), pairs))
+            block = next(blocks, None)
+            group = next(groups, None)
+
+
+def _key_range(keys, start, stop):
+    """Returns the keys in a sortedset between start and stop, inclusive
+    (either of which may be None), as a sortedset of their own.
+
+    Requires O(log(k)**2) operations: the slice is copied lazily."""
+    i = 0 if start is None else keys.bisect_left(start)
+    j = len(keys) if stop is None else keys.bisect_right(stop)
+    return keys[i:j]
+
+
+def _in_range(key, start, stop):
+    return (start is None or key >= start) and (stop is None or key <= stop)
+
+
+def _slice_indices(cols, start, stop, start_exclusive=False,
+                   stop_exclusive=False):
+    """Returns the (start, stop) indices bounding get_slice's slice of a
+    row, given the row's sorted columns (a sortedset, or a frozen row's
+    _Columns), with the stop index at most the start index if the slice is
+    empty.
+
+    Requires O(log(c)**2) operations (O(log(c)) for a frozen row)."""
+    # x not in sortedset - O(log(c)**2)
+    # len(sortedset)     - O(1)
+    # sortedset.bisect_* - O(log(c)**2)
+    start_missing = start not in cols
+    stop_missing = stop not in cols
+    if start_missing and stop_missing and not (start is stop is None):
+        return 0, 0
+    if start_missing:
+        start_index = 0
+    elif start_exclusive:
+        start_index = cols.bisect_right(start)
+    else:
+        start_index = cols.bisect_left(start)
+    if stop_missing:
+        stop_index = len(cols)
+    elif stop_exclusive:
+        stop_index = cols.bisect_left(stop)
+    else:
+        stop_index = cols.bisect_right(stop)
+    return start_index, stop_index
+
+
+def _prefix_stop(prefix):
+    """Returns the least string greater than every string that starts with
+    prefix, or None if there's no such string (when prefix is empty, or
+    nothing but the greatest character)."""
+    character = unichr if isinstance(prefix, unicode) else chr
+    top = sys.maxunicode if isinstance(prefix, unicode) else 0xff
+    prefix = prefix.rstrip(character(top))
+    if not prefix:
+        return None
+    return prefix[:-1] + character(ord(prefix[-1]) + 1)
+
+
+def _prefix_indices(cols, prefix):
+    """Returns the (start, stop) indices bounding the columns that start
+    with prefix, given a row's sorted columns.
+
+    Requires O(log(c)**2) operations (O(log(c)) for a frozen row)."""
+    stop = _prefix_stop(prefix)
+    return (cols.bisect_left(prefix),
+            len(cols) if stop is None else cols.bisect_left(stop))
+
+
+def _table_entry(key, pairs, block=None):
+    """Returns the (key, block, items) tuple that kcvtable.write_table wants
+    for a row, given its sorted column/value tuples (and, if it's at hand,
+    the row already encoded as a block)."""
+    if block is None:
+        block = kcvtable.encode_block(pairs)
+    items = [kcvtable.column_item(key, col) for col, val in pairs]
+    return key, block, items
+
+
+class _IndexedRows(dict):
+    """A dict from keys to rows that keeps a sortedset of its keys, for
+    iterating over ranges of them in order.  Only the parts of the dict
+    interface used by the KeyColumnValueStore keep it up to date.
+
+    Adding or removing a key requires O(log(k)**2) operations, for the
+    sortedset, but looking one up is just as fast as in any dict."""
+
+    def __init__(self, rows=()):
+        dict.__init__(self, rows)
+        self.index = sortedset(dict.iterkeys(self))
+
+    def __reduce__(self):
+        # Snapshots hold a plain dict, as they always have.
+        return dict, (dict(self),)
+
+    def __setitem__(self, key, cv):
+        if not dict.__contains__(self, key):
+            self.index.add(key)
+        dict.__setitem__(self, key, cv)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.index.remove(key)
+
+    def pop(self, key, *default):
+        if dict.__contains__(self, key):
+            self.index.remove(key)
+        return dict.pop(self, key, *default)
+
+    def iter_keys(self, start=None, stop=None):
+        """Returns an iterator over the keys between start and stop,
+        inclusive, in sorted order, unaffected by later changes."""
+        return iter(_key_range(self.index, start, stop))
+
+
+class _LazyRows(dict):
+    """A dict from keys to rows that only reads each row from a kcvtable.Table
+    when it's first accessed.
+
+    The dict itself holds the rows that have been read (and possibly modified
+    since), while keys deleted since the table was written are remembered so
+    that the table can't resurrect them, and keys added since are indexed
+    in a sortedset, for iterating over the keys in order.  Only the parts of
+    the dict interface used by the KeyColumnValueStore are supported.
+
+    Rows are built from the table's sorted column/value tuples by make_row.
+    Since reading a row modifies the dict, reads and writes of rows that
+    aren't in it yet are serialized by a lock, so that concurrent readers
+    can't read the same row twice (or clobber a newer version of it)."""
+
+    def __init__(self, table, make_row=_row_from_sorted):
+        dict.__init__(self)
+        self.table = table
+        self.make_row = make_row
+        self.deleted = set()
+        self.added = sortedset()  # keys that aren't in the table
+        self.unread = len(table)  # rows in the table not yet read or deleted
+        self.lock = threading.RLock()
+
+    def _read(self, key):
+        with self.lock:
+            cv = dict.get(self, key)
+            if cv is not None:
+                return cv
+            if key in self.deleted:
+                return None
+            pairs = self.table.get(key)
+            if pairs is None:
+                return None
+            cv = self.make_row(pairs)
+            dict.__setitem__(self, key, cv)
+            self.unread -= 1
+            return cv
+
+    def get(self, key, default=None):
+        cv = dict.get(self, key)
+        if cv is None:
+            cv = self._read(key)
+        return default if cv is None else cv
+
+    def get_column(self, key, col):
+        """Returns the value at key/col, or None, without reading the row if
+        the table's Bloom filter rules the column out."""
+        cv = dict.get(self, key)
+        if cv is None:
+            if key in self.deleted:
+                return None
+            if not self.table.may_contain(kcvtable.column_item(key, col)):
+                return None
+            cv = self._read(key)
+            if cv is None or col not in cv:
+                self.table.stats['false_positives'] += 1
+                return None
+        return cv.get(col)
+
+    def __missing__(self, key):
+        cv = self._read(key)
+        if cv is None:
+            raise KeyError(key)
+        return cv
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        return key not in self.deleted and key in self.table
+
+    def __setitem__(self, key, cv):
+        with self.lock:
+            if not dict.__contains__(self, key):
+                if key in self.deleted:
+                    self.deleted.remove(key)
+                elif key in self.table:
+                    self.unread -= 1
+                else:
+                    self.added.add(key)
+            dict.__setitem__(self, key, cv)
+
+    def __delitem__(self, key):
+        with self.lock:
+            if dict.__contains__(self, key):
+                dict.__delitem__(self, key)
+            elif key not in self.deleted and key in self.table:
+                self.unread -= 1
+            else:
+                raise KeyError(key)
+            if key in self.table:
+                self.deleted.add(key)
+            else:
+                self.added.discard(key)
+
+    def pop(self, key, *default):
+        cv = self.get(key)
+        if cv is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        del self[key]
+        return cv
+
+    def __len__(self):
+        return dict.__len__(self) + self.unread
+
+    def iterkeys(self):
+        # Reading rows adds to the dict, so iterate over a copy of its keys.
+        for key in dict.keys(self):
+            yield key
+        for key in self.table.iterkeys():
+            if key not in self.deleted and not dict.__contains__(self, key):
+                yield key
+
+    __iter__ = iterkeys
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def iter_keys(self, start=None, stop=None):
+        """Returns an iterator over the keys between start and stop,
+        inclusive, in sorted order, merging the table's with the ones added
+        since.  Requires reading one key from the table per key yielded."""
+        with self.lock:
+            added = _key_range(self.added, start, stop)
+        deleted = self.deleted
+        return heapq.merge((key for key in self.table.iterkeys(start, stop)
+                            if key not in deleted), added)
+
+    def iteritems(self):
+        for key in self.iterkeys():
+            yield key, self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def peek(self, key):
+        """Returns the sorted column/value tuples of key, or None, without
+        keeping the row in memory if it has to be read from the table."""
+        cv = dict.get(self, key)
+        if cv is not None:
+            return cv.items()
+        if key in self.deleted:
+            return None
+        return self.table.get(key)
+
+    def table_column_count(self):
+        """Returns the total number of columns in the table's rows, as it
+        was written, decoding every row without keeping them."""
+        return sum(len(kcvtable.decode_block(block))
+                   for key, block in self.table.iterblocks())
+
+    def iterblocks(self):
+        """Yields a (key, block, items) tuple (see kcvtable.write_table) for
+        every row, in sorted order.  Rows that haven't been read are copied
+        from the table as they are, without being encoded again."""
+        read = sorted(dict.iterkeys(self))
+        i = 0
+        for key, block in self.table.iterblocks():
+            while i < len(read) and read[i] < key:
+                yield _table_entry(read[i], self[read[i]].items())
+                i += 1
+            if i < len(read) and read[i] == key:
+                continue
+            if key not in self.deleted:
+                yield _table_entry(key, kcvtable.decode_block(block), block)
+        for key in read[i:]:
+            yield _table_entry(key, self[key].items())
+
+
+class _StagedRows(object):
+    """The rows a writer is changing in a concurrent store: a private copy of
+    each row is made the first time it's touched, so that readers of the
+    rows never see it change.  publish() then puts the copies in place, all
+    at once.  Only the parts of the dict interface used by
+    KeyColumnValueStore._apply and _undo are supported."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.changed = {}  # keys to their new rows, or None if deleted
+        self.writer = threading.current_thread()
+
+    def get(self, key, default=None):
+        if key in self.changed:
+            cv = self.changed[key]
+        else:
+            cv = self.rows.get(key)
+            if cv is not None:
+                cv = self.changed[key] = _copy_row(cv)
+        return default if cv is None else cv
+
+    def __getitem__(self, key):
+        cv = self.get(key)
+        if cv is None:
+            raise KeyError(key)
+        return cv
+
+    def __setitem__(self, key, cv):
+        self.changed[key] = cv
+
+    def __delitem__(self, key):
+        self[key]
+        self.changed[key] = None
+
+    def pop(self, key, *default):
+        cv = self.get(key)
+        if cv is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        self.changed[key] = None
+        return cv
+
+    def publish(self):
+        for key, cv in self.changed.iteritems():
+            if cv is None:
+                self.rows.pop(key, None)
+            else:
+                self.rows[key] = cv
+
+
+class _ResultCache(object):
+    """A least recently used cache of slices, by key, start and stop.
+
+    It's bounded by max_entries and/or max_bytes, where the size of a slice
+    is estimated as the total length of its columns and values, plus
+    ENTRY_OVERHEAD bytes for each column and for the slice itself.  stats is
+    a Counter of 'hits', 'misses', 'evictions' and 'invalidations', along
+    with the current number of 'entries' and their total 'bytes'.
+
+    Every invalidation bumps generation, and put() ignores slices read
+    before the latest one, so that a slice read from a row just before it
+    changed can't be cached just after."""
+
+    ENTRY_OVERHEAD = 64
+
+    def __init__(self, max_entries=None, max_bytes=None, stats=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = Counter() if stats is None else stats
+        self.generation = 0
+        self._entries = OrderedDict()  # (key, start, stop) -> (slice, size)
+        self._by_key = {}  # key -> set of its (key, start, stop) entries
+        self._lock = threading.Lock()
+
+    def get(self, entry):
+        """Returns the cached slice for a (key, start, stop) tuple, or None.
+
+        Requires O(1) operations."""
+        with self._lock:
+            item = self._entries.pop(entry, None)
+            if item is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries[entry] = item
+            self.stats['hits'] += 1
+            return item[0]
+
+    def put(self, entry, columns, generation):
+        """Caches a slice (a tuple of column/value tuples) for a (key, start,
+        stop) tuple, if nothing has been invalidated since generation, evicting
+        the least recently used slices to make room.
+
+        Requires O(s) operations to size the slice, plus O(1) per eviction."""
+        size = self.ENTRY_OVERHEAD * (len(columns) + 1) + sum(
+            len(col) + len(val) for col, val in columns)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self.generation or entry in self._entries:
+                return
+            self._entries[entry] = (columns, size)
+            self._by_key.setdefault(entry[0], set()).add(entry)
+            self.stats['entries'] += 1
+            self.stats['bytes'] += size
+            while ((self.max_entries is not None and
+                    self.stats['entries'] > self.max_entries) or
+                   (self.max_bytes is not None and
+                    self.stats['bytes'] > self.max_bytes)):
+                oldest, (columns, size) = self._entries.popitem(last=False)
+                self._forget(oldest, size)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, key):
+        """Drops every cached slice of key.
+
+        Requires O(1) operations per slice dropped."""
+        with self._lock:
+            self.generation += 1
+            for entry in self._by_key.pop(key, ()):
+                columns, size = self._entries.pop(entry)
+                self.stats['entries'] -= 1
+                self.stats['bytes'] -= size
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        """Drops every cached slice."""
+        with self._lock:
+            self.generation += 1
+            self.stats['invalidations'] += self.stats['entries']
+            self.stats['entries'] = self.stats['bytes'] = 0
+            self._entries.clear()
+            self._by_key.clear()
+
+    def _forget(self, entry, size):
+        entries = self._by_key[entry[0]]
+        entries.remove(entry)
+        if not entries:
+            del self._by_key[entry[0]]
+        self.stats['entries'] -= 1
+        self.stats['bytes'] -= size
+
+
+class _ReadWriteLock(object):
+    """A lock that can be held by any number of readers at once, or by a
+    single writer.  Writers take priority: once one is waiting, new readers
+    wait for it."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writers = 0  # waiting or writing
+
+    @contextmanager
+    def reading(self):
+        with self._cond:
+            while self._writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._cond:
+            self._writers += 1
+            while self._readers:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writers -= 1
+                self._cond.notify_all()
 
 
 # I've made the executive decision that the 3rd party blist module is within
@@ -67,16 +790,193 @@ class KeyColumnValueStore(object):
 
     The implementation is designed with the assumption that reads will be much
     more frequent than writes.
+
+    The store is persisted to the file at path (a temporary file if none is
+    given).  With the default LOG persistence, the file holds a snapshot of
+    the store followed by one small record per mutation, so a write costs
+    O(1) regardless of how much data is stored; the records are replayed on
+    top of the snapshot when the store is loaded.  With SNAPSHOT persistence,
+    the whole store is rewritten on every mutation instead.
+
+    To keep the log (and the time it takes to replay it) from growing without
+    bound, checkpoint() replaces it with a fresh snapshot.  This happens
+    automatically in the background once the log holds more than
+    checkpoint_records records or checkpoint_bytes bytes, if either is given.
+
+    How hard a write tries to reach the disk before returning depends on the
+    durability setting:
+    * NONE leaves log records in the process's own buffers, to be written out
+      whenever they fill up (or the store is closed), and never fsyncs
+    * OS_BUFFERED (the default) hands every write to the OS, so it survives
+      the process crashing, but never fsyncs
+    * GROUP_COMMIT makes every write wait for an fsync, but a single fsync is
+      shared by all the writes made within commit_interval_ms milliseconds of
+      each other, so concurrent writers (e.g. threads serving requests) don't
+      each pay for their own
+    * FSYNC fsyncs after every write
+    With SNAPSHOT persistence, GROUP_COMMIT is the same as FSYNC.
+
+    If lazy is true, snapshots are written in the kcvtable format instead of
+    being pickled.  Loading a store whose snapshot is a table is then almost
+    instant: rows are only read into memory when they're first accessed, so
+    memory use scales with the rows actually in use.  Once a store is lazy, it
+    stays that way.  Each table carries a Bloom filter of its keys and
+    key/column pairs, which lets most lookups for missing keys and columns
+    skip reading the table altogether.  filter_stats counts how often the
+    filters were consulted: see kcvtable.Table.stats.
+
+    Writes are always serialized, but reads normally aren't synchronized with
+    them at all, so with a threaded server, a read can see a row halfway
+    through a write (or a batch halfway through).  If concurrent is true,
+    rows are copied on write instead: a write (or batch) changes private
+    copies of the rows it touches and only puts them in place once it's
+    done, so any number of readers can run alongside a writer, each seeing
+    every row either before or after a write.  Reads that span several keys
+    (multi_get, multi_get_slice and get_keys) briefly hold a read lock, so
+    they see all of a batch or none of it.  The price is that a write to a
+    row requires O(c) operations instead of O(log(c)**2), for the copy.
+
+    If cache_entries and/or cache_bytes is given, the results of get_key and
+    get_slice are cached, in a least recently used cache holding at most
+    that many slices and/or roughly that many bytes of them, so that asking
+    for the same slice again only costs copying the list.  Writing to a key
+    invalidates all of its cached slices.  cache_stats counts hits, misses,
+    evictions and invalidations, and the entries and bytes in the cache: see
+    _ResultCache.
+
+    If metrics is true, self.metrics is a kcvmetrics.Metrics recording the
+    latency of every operation, and the time taken and bytes written by
+    every write to disk.  size_stats() counts the keys and columns stored.
+
+    If hot_rows is given, only the hot_rows most recently written rows are
+    kept as sorteddicts.  Every other row is frozen into a compact, read-only
+    form (see _FrozenRow) that takes around half the memory, and is only
+    turned back into a sorteddict when it's next written to, at a cost of
+    O(c) operations.  Reading a column of a frozen row requires O(log(c))
+    operations rather than O(1), but slices are just as fast.
+
+    If replica is true, the store is a read-only replica of the store whose
+    file is at path, which is being written by another store (typically in
+    another process).  Instead of writing to the file, the replica follows
+    the writer's log: catch_up() applies whatever records were appended
+    since it last did, in O(1) operations per record, and follow() does so
+    periodically in the background.  Only when the writer checkpoints (which,
+    with SNAPSHOT persistence, is on every write) does the replica have to
+    load the file from scratch, which takes no time at all if the store is
+    lazy.  A replica sees a write once it reaches the
+    file, which (unless durability is NONE) is before the writer returns;
+    replica_lag() tells how far behind it is.  Writing to a replica raises
+    ValueError.
+
+    If change_feed is given, the store keeps a feed of the last change_feed
+    changes made to it (each a set, delete or delete_key that changed
+    something), numbered in sequence, so that whoever keeps a copy of some of
+    the store can ask changes_since for just what changed, and wait for it.
+    Sequence numbers start from the time the store was opened, in
+    microseconds, so that they keep increasing across restarts.
     """
 
-    def __init__(self, path=None):
-        self.kcv = {}
+    def __init__(self, path=None, persistence=LOG, checkpoint_records=None,
+                 checkpoint_bytes=None, durability=OS_BUFFERED,
+                 commit_interval_ms=10, lazy=False, concurrent=False,
+                 cache_entries=None, cache_bytes=None, metrics=False,
+                 hot_rows=None, replica=False, change_feed=None):
+        if persistence not in (LOG, SNAPSHOT):
+            raise ValueError('unknown persistence: %r' % (persistence,))
+        if durability not in (NONE, OS_BUFFERED, GROUP_COMMIT, FSYNC):
+            raise ValueError('unknown durability: %r' % (durability,))
+        self.kcv = _IndexedRows()
+        # The number of columns stored is kept as the number there were when
+        # the store was loaded (None, for a lazy store, until they've been
+        # counted), plus the number added since.
+        self._loaded_columns = 0
+        self._added_columns = 0
+        self._staged_columns = 0  # _added_columns when staging started
+        self.persistence = persistence
+        self.checkpoint_records = checkpoint_records
+        self.checkpoint_bytes = checkpoint_bytes
+        self.durability = durability
+        self.commit_interval_ms = commit_interval_ms
+        self.lazy = lazy
+        self.concurrent = concurrent
+        self.filter_stats = Counter()
+        self.cache_stats = Counter()
+        self.metrics = kcvmetrics.Metrics() if metrics else None
+        self.hot_rows = hot_rows
+        self._hot = OrderedDict()  # recently written keys, oldest first
+        self._cache = None
+        if cache_entries is not None or cache_bytes is not None:
+            self._cache = _ResultCache(cache_entries, cache_bytes,
+                                       self.cache_stats)
+        self._lock = threading.RLock()
+        self._rwlock = _ReadWriteLock() if concurrent else None
+        self._staged = None
+        self._log = None
+        self._log_records = 0
+        self._log_bytes = 0
+        self._written = 0  # sequence number of the last record appended
+        self._synced = 0  # sequence number of the last record fsynced
+        self._syncing = False
+        self._sync_cond = threading.Condition()
+        self._checkpointer = None
+        self._batch = None
+        self.replica = replica
+        self._offset = 0  # where the next record starts, in a replica
+        self._followed = None  # the open file a replica is following
+        self._caught_up = clock()  # when a replica last reached the end
+        self._follower = None
+        self._closed = threading.Event()
+        self.change_feed = change_feed
+        self._changes = None if not change_feed else deque(maxlen=change_feed)
+        self._change_seq = int(time.time() * 1e6)
+        self._change_cond = threading.Condition(threading.Lock())
+        self._change_watchers = []
         self._create_log_file(path)
 
     # XXX Loads of issues with this naive persistence strategy.  I won't be
     # fixing them.
+    #
+    # Well, one of them.  Pickling the whole store on every write made each
+    # write O(n) in the size of the store.  The log file is now a stream of
+    # pickles: the first is the snapshot that _persist has always written,
+    # and every one after that is a mutation record like ('set', key, col,
+    # val).  A file written by the old code is just a log with no records in
+    # it, so existing stores load as before.
+    #
+    # Checkpointing writes a new snapshot next to the log and renames it into
+    # place.  In the background, that's done by a forked child, which gets a
+    # copy-on-write image of self.kcv for free: the parent carries on serving
+    # reads and appending writes to the old log, and when the child is done,
+    # whatever was appended in the meantime is copied onto the end of the new
+    # snapshot before the rename.
+    #
+    # Group commit works by leader election among the writers waiting for an
+    # fsync: the first one to find nobody else syncing waits out the commit
+    # interval, then fsyncs everything appended so far on behalf of everyone.
+    # Writers that come in while it's syncing wait for the next round.  The
+    # fsync itself happens outside of self._lock, so writers can keep
+    # appending in the meantime.
+    #
+    # In a concurrent store, the rows in self.kcv are never modified in
+    # place once published, so a reader that has got hold of one can take as
+    # long as it likes over it without holding any lock.  Writers stage their
+    # changes in a _StagedRows, which is published (under the write side of
+    # self._rwlock, which takes O(r) for the r rows changed) before it's
+    # persisted, so that snapshots include it.
+    #
+    # With hot_rows, _apply thaws a frozen row into a sorteddict before
+    # changing it, and remembers the key as recently written.  Rows are only
+    # frozen again by _cool, once a write (or batch) is over, so that a row
+    # that's being undone, or staged, is never frozen in the meantime.
+    # Frozen rows are pickled as frozen rows, so a snapshot loads compact.
 
     def _create_log_file(self, path):
+        if self.replica:
+            if path is None:
+                raise ValueError('a replica needs the path of a store')
+            self.path = os.path.expandvars(os.path.expanduser(path))
+            self._load()
+            return
         if path is None:
             with NamedTemporaryFile(delete=False) as tmp:
                 self.path = tmp.name
@@ -86,41 +986,828 @@ class KeyColumnValueStore(object):
             self._load()
         else:
             self._persist()  # will create the file if it doesn't exist
+        if self.persistence == LOG:
+            self._log = open(self.path, 'ab')
+            if self._checkpoint_due():
+                self.checkpoint(background=True)
 
     def _load(self):
-        """Reads the existing key/column/value structure from disk."""
-        with open(self.path, 'r') as log:
-            self.kcv = pickle.load(log)
+        """Reads the existing key/column/value structure from disk, replaying
+        any mutation records logged after the snapshot."""
+        log = open(self.path, 'rb')
+        try:
+            if kcvtable.is_table(log):
+                table = kcvtable.Table(self.path, self.filter_stats)
+                self.kcv = _LazyRows(table, self._make_row)
+                self.lazy = True
+                self._loaded_columns = None
+                log.seek(self.kcv.table.end)
+            else:
+                self.kcv = _IndexedRows(pickle.load(log))
+                self._loaded_columns = sum(len(cv)
+                                           for cv in self.kcv.itervalues())
+            start = end = log.tell()
+            while True:
+                try:
+                    record = pickle.load(log)
+                except EOFError:
+                    break
+                except Exception:
+                    # A torn record at the tail (e.g. from a crash halfway
+                    # through an append) can fail to unpickle in any number
+                    # of ways.  Everything before it is intact, though.
+                    break
+                self._apply(record)
+                self._log_records += 1
+                end = log.tell()
+        except Exception:
+            log.close()
+            raise
+        if self.replica:
+            # Holding the file open keeps its inode from being reused for
+            # another file, so the replica can tell when it's been replaced.
+            self._followed = log
+        else:
+            log.close()
+        self._log_bytes = end - start
+        self._offset = end
+        self._cool(everything=True)
+        if self.replica:
+            # A torn record at the tail of a log that's still being written
+            # is most likely just still being written.
+            return
+        if end < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as log:
+                log.truncate(end)
+
+    def _persist(self, sync=None):
+        """Persists the current key/column/value structure to disk.  By
+        default, it's only fsynced if the durability setting calls for it."""
+        if sync is None:
+            sync = self.durability in (GROUP_COMMIT, FSYNC)
+        start = clock()
+        tmp = self.path + '.tmp'
+        self._dump(tmp, sync)
+        os.rename(tmp, self.path)
+        if sync:
+            self._fsync_dir()
+        if self.metrics is not None:
+            self.metrics.persisted('snapshot', clock() - start,
+                                   os.path.getsize(self.path))
+
+    def _dump(self, path, sync=True):
+        """Writes a snapshot of the key/column/value structure to the given
+        path."""
+        with open(path, 'wb') as snapshot:
+            if self.lazy:
+                kcvtable.write_table(snapshot, self._iterblocks())
+            else:
+                pickle.dump(self.kcv, snapshot, pickle.HIGHEST_PROTOCOL)
+            if sync:
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+
+    def _iterblocks(self):
+        """Yields a (key, block, items) tuple for every row, in sorted order,
+        for writing to a table."""
+        if isinstance(self.kcv, _LazyRows):
+            return self.kcv.iterblocks()
+        return (_table_entry(key, self.kcv[key].items())
+                for key in self.kcv.iter_keys())
+
+    def _fsync_dir(self):
+        """Makes a rename of the store's file durable."""
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _append(self, record):
+        """Appends a single mutation record to the log on disk, returning its
+        sequence number."""
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        start = clock()
+        self._log.write(data)
+        if self.durability != NONE:
+            self._log.flush()
+        if self.durability == FSYNC:
+            os.fsync(self._log.fileno())
+        if self.metrics is not None:
+            self.metrics.persisted('log', clock() - start, len(data))
+        self._written += 1
+        self._log_records += 1
+        self._log_bytes += len(data)
+        if self._checkpoint_due():
+            self.checkpoint(background=True)
+        return self._written
+
+    def _wait_for_sync(self, seq):
+        """Blocks until the log record with the given sequence number has
+        been fsynced, as part of a group commit."""
+        with self._sync_cond:
+            while self._synced < seq:
+                if self._syncing:
+                    self._sync_cond.wait()
+                    continue
+                self._syncing = True
+                self._sync_cond.release()
+                try:
+                    time.sleep(self.commit_interval_ms / 1000.0)
+                    with self._lock:
+                        target = self._written
+                        # The log may be swapped out by a checkpoint while
+                        # we're syncing; our own descriptor stays valid.
+                        fd = os.dup(self._log.fileno())
+                    start = clock()
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                    if self.metrics is not None:
+                        self.metrics.persisted('fsync', clock() - start, 0)
+                finally:
+                    self._sync_cond.acquire()
+                    self._syncing = False
+                    self._sync_cond.notify_all()
+                self._synced = max(self._synced, target)
+
+    def _checkpoint_due(self):
+        if self.checkpoint_records is not None:
+            if self._log_records >= self.checkpoint_records:
+                return True
+        if self.checkpoint_bytes is not None:
+            if self._log_bytes >= self.checkpoint_bytes:
+                return True
+        return False
+
+    @kcvmetrics.timed
+    def checkpoint(self, background=False):
+        """Replaces the log with a consolidated snapshot of the store, so that
+        loading it no longer has to replay the log's records.
+
+        If background is true, the snapshot is written by a forked process (or,
+        where fork isn't available, by a thread that blocks writers but not
+        readers) and the thread waiting on it is returned so it can be joined.
+        Otherwise, the snapshot is written before returning None.
+
+        It can't be called within a batch, whose mutations would end up in
+        the snapshot before the batch is over, even if it's then undone."""
+        self._check_writable()
+        self._check_outside_batch('checkpoint')
+        if self.persistence != LOG:
+            return None
+        if not background:
+            with self._no_checkpointer():
+                self._checkpoint()
+            return None
+        with self._lock:
+            running = self._checkpointer
+            if running is not None and running.is_alive():
+                return running
+            target = self._start_checkpoint()
+            self._checkpointer = threading.Thread(target=target)
+            self._checkpointer.daemon = True
+            self._checkpointer.start()
+            return self._checkpointer
+
+    @contextmanager
+    def _no_checkpointer(self):
+        """Returns a context manager that holds self._lock, once no
+        background checkpoint is in progress.
 
-    def _persist(self):
-        """Persists the current key/column/value structure to disk."""
-        with open(self.path, 'w') as log:
-            pickle.dump(self.kcv, log)
+        A background checkpoint swaps its snapshot in for the file when it
+        finishes, so it mustn't still be running when the file is rewritten
+        in the meantime, or the rewrite would be lost.  Since finishing takes
+        the lock, the checkpoint has to be joined without it; and since
+        another one may start before the lock is taken, that's rechecked."""
+        while True:
+            running = self._checkpointer
+            if running is not None and running.is_alive():
+                running.join()
+            self._lock.acquire()
+            running = self._checkpointer
+            if running is None or not running.is_alive():
+                break
+            self._lock.release()
+        try:
+            yield
+        finally:
+            self._lock.release()
 
+    def _checkpoint(self):
+        with self._lock:
+            self._persist(sync=True)
+            self._reopen_log()
+            self._log_records = self._log_bytes = 0
+
+    def _start_checkpoint(self):
+        """Starts a checkpoint of the store as it stands now, returning a
+        function to finish it in the background.  Called with self._lock
+        held."""
+        if hasattr(os, 'fork'):
+            return self._fork_checkpoint()
+        return self._checkpoint
+
+    def _fork_checkpoint(self):
+        """Forks a child to write a snapshot of the store as it stands now,
+        returning a function that waits for the child and then swaps the
+        snapshot in for the log."""
+        self._log.flush()
+        offset = os.path.getsize(self.path)
+        records = self._log_records
+        tmp = self.path + '.checkpoint'
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self._dump(tmp)
+                status = 0
+            finally:
+                os._exit(status)
+
+        def finish():
+            _, status = os.waitpid(pid, 0)
+            if status != 0:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return
+            self._swap_log(tmp, offset, records)
+        return finish
+
+    def _swap_log(self, tmp, offset, records):
+        """Replaces the log with the snapshot at tmp, after copying onto the
+        end of it whatever was appended to the log past offset.  records is
+        the number of records that were in the log before offset."""
+        with self._lock:
+            start = clock()
+            self._log.flush()
+            tail = os.path.getsize(self.path) - offset
+            with open(self.path, 'rb') as log:
+                with open(tmp, 'ab') as snapshot:
+                    log.seek(offset)
+                    shutil.copyfileobj(log, snapshot)
+                    snapshot.flush()
+                    os.fsync(snapshot.fileno())
+            os.rename(tmp, self.path)
+            self._fsync_dir()
+            self._reopen_log()
+            self._log_records -= records
+            self._log_bytes = tail
+            if self.metrics is not None:
+                self.metrics.persisted('checkpoint', clock() - start, tail)
+
+    def _reopen_log(self):
+        self._log.close()
+        self._log = open(self.path, 'ab')
+
+    def _apply(self, record):
+        """Applies a mutation record to the in-memory structure.  Returns a
+        record of how to undo it, or None if it didn't change anything."""
+        op = record[0]
+        if op == 'batch':
+            undos = [self._apply(r) for r in record[1]]
+            return ('batch', [u for u in reversed(undos) if u is not None])
+        key = record[1]
+        rows = self.kcv if self._staged is None else self._staged
+        self._changing(key)
+        if op == 'set':
+            col, val = record[2:]
+            cv = rows.get(key)
+            self._touch(key)
+            if cv is None:
+                rows[key] = sorteddict({col: val})
+                self._added_columns += 1
+                return ('row', key, None)
+            undo = ('col', key, col, cv.get(col, _MISSING))
+            self._thawed(rows, key, cv)[col] = val
+            if undo[3] is _MISSING:
+                self._added_columns += 1
+            return undo
+        if op == 'delete':
+            col = record[2]
+            cv = rows.get(key)
+            if cv is None or col not in cv:
+                return None
+            self._touch(key)
+            undo = ('col', key, col, cv[col])
+            del self._thawed(rows, key, cv)[col]
+            self._added_columns -= 1
+            return undo
+        if op == 'delete_key':
+            cv = rows.pop(key, None)
+            self._hot.pop(key, None)
+            if cv is None:
+                return None
+            self._added_columns -= len(cv)
+            return ('row', key, cv)
+        raise ValueError('unknown mutation record: %r' % (record,))
+
+    def _make_row(self, pairs):
+        """Returns a row (frozen, if the store freezes rows) built from a list
+        of column/value tuples sorted by column."""
+        if self.hot_rows is None:
+            return _row_from_sorted(pairs)
+        return _FrozenRow(pairs)
+
+    def _thawed(self, rows, key, cv):
+        """Returns key's row cv, thawed into a sorteddict in rows if it's
+        frozen, for _apply to change."""
+        if isinstance(cv, _FrozenRow):
+            cv = rows[key] = cv.thaw()
+        return cv
+
+    def _touch(self, key):
+        """Remembers key as the most recently written, if rows are frozen."""
+        if self.hot_rows is not None:
+            self._hot.pop(key, None)
+            self._hot[key] = True
+
+    def _cool(self, everything=False):
+        """Freezes the rows that are no longer among the hot_rows most
+        recently written (or, if everything is true, every row not among
+        them), if rows are frozen.  Requires O(c) operations per row frozen,
+        and O(k) more for everything."""
+        if self.hot_rows is None:
+            return
+        cold = []
+        while len(self._hot) > self.hot_rows:
+            cold.append(self._hot.popitem(last=False)[0])
+        if everything and not isinstance(self.kcv, _LazyRows):
+            # (The rows of a lazy store are frozen as they're read.)
+            cold.extend(key for key, cv in self.kcv.iteritems()
+                        if key not in self._hot and
+                        not isinstance(cv, _FrozenRow))
+        with self._writing():
+            for key in cold:
+                cv = self.kcv.get(key)
+                if cv is not None and not isinstance(cv, _FrozenRow):
+                    self.kcv[key] = _FrozenRow(cv.items())
+
+    def _undo(self, undo):
+        """Reverts a mutation, given the undo record returned by _apply."""
+        op, key = undo[:2]
+        rows = self.kcv if self._staged is None else self._staged
+        if op == 'batch':
+            for u in key:
+                self._undo(u)
+            return
+        self._changing(key)
+        if op == 'row':
+            cv = undo[2]
+            if cv is None:
+                self._added_columns -= len(rows[key])
+                del rows[key]
+            else:
+                rows[key] = cv
+                self._added_columns += len(cv)
+                self._touch(key)
+        elif op == 'col':
+            col, val = undo[2:]
+            if val is _MISSING:
+                del rows[key][col]
+                self._added_columns -= 1
+            else:
+                if col not in rows[key]:
+                    self._added_columns += 1
+                rows[key][col] = val
+
+    def _feed(self, records):
+        """Adds the given (applied and published) mutation records to the
+        change feed, if there is one, and wakes whoever's waiting for them."""
+        if self._changes is None:
+            return
+        with self._change_cond:
+            for record in records:
+                self._change_seq += 1
+                self._changes.append((self._change_seq,) + record)
+            self._change_cond.notify_all()
+        self._notify_watchers()
+
+    def _lose_changes(self):
+        """Empties the change feed, so that everyone following it finds that
+        they've lost changes, for changes too many to feed one by one."""
+        if self._changes is None:
+            return
+        with self._change_cond:
+            self._change_seq += 1
+            self._changes.clear()
+            self._change_cond.notify_all()
+        self._notify_watchers()
+
+    def _notify_watchers(self):
+        for callback in list(self._change_watchers):
+            callback()
+
+    def watch_changes(self, callback):
+        """Arranges for callback() to be called whenever changes are added
+        to the change feed (or lost from it), for waiting on them without
+        tying up a thread in changes_since.  It's called from the writing
+        thread, so it should return quickly."""
+        self._change_watchers.append(callback)
+
+    def unwatch_changes(self, callback):
+        """Stops calling a callback passed to watch_changes."""
+        self._change_watchers.remove(callback)
+
+    def changes_since(self, seq=None, limit=None, timeout=None):
+        """Returns a (seq, changes) tuple of the changes made since the change
+        with sequence number seq, oldest first (at most limit of them, if
+        limit is given), and the sequence number to pass in next time.  Each
+        change is a tuple of its sequence number and a mutation record:
+        (seq, 'set', key, col, val), (seq, 'delete', key, col) or (seq,
+        'delete_key', key).  If seq is None, there are no changes, just the
+        current sequence number to start from.
+
+        If there are no changes yet, waits for some for up to timeout seconds
+        (by default, doesn't wait).  Raises ChangesLost if any of the changes
+        have been dropped from the feed, and ValueError if the store has no
+        feed.  Requires O(n) operations, for the n changes in the feed."""
+        if self._changes is None:
+            raise ValueError('the store has no change feed')
+        if timeout:
+            deadline = clock() + timeout
+        with self._change_cond:
+            if seq is None:
+                return self._change_seq, []
+            while True:
+                changes = self._changes
+                oldest = changes[0][0] if changes else self._change_seq + 1
+                if not oldest - 1 <= seq <= self._change_seq:
+                    raise ChangesLost(seq, oldest)
+                if seq < self._change_seq or not timeout:
+                    break
+                remaining = deadline - clock()
+                if remaining <= 0:
+                    break
+                self._change_cond.wait(remaining)
+            start = seq - oldest + 1
+            stop = None if limit is None else start + limit
+            changes = list(itertools.islice(changes, start, stop))
+        return (changes[-1][0] if changes else seq), changes
+
+    def _check_writable(self):
+        if self.replica:
+            raise ValueError("a replica can't be written to")
+
+    def _check_outside_batch(self, method):
+        # Taking the lock waits out another thread's batch, so that only a
+        # batch of this thread's own is refused.
+        with self._lock:
+            if self._batch is not None:
+                raise ValueError("%s can't be called within a batch"
+                                 % method)
+
+    def _mutate(self, record):
+        """Applies a mutation record and persists it, if it changed
+        anything.  Within a batch, persisting is left until the batch ends."""
+        self._check_writable()
+        with self._lock:
+            if self._batch is None:
+                self._stage()
+            try:
+                undo = self._apply(record)
+            except BaseException:
+                if self._batch is None:
+                    self._discard()
+                raise
+            if undo is None:
+                if self._batch is None:
+                    self._discard()
+                return
+            if self._batch is not None:
+                self._batch.append((record, undo))
+                return
+            self._publish()
+            self._cool()
+            self._feed([record])
+            seq = self._commit([record])
+        self._await_commit(seq)
+
+    def _stage(self):
+        """Starts staging writes, if the store is concurrent."""
+        if self.concurrent:
+            self._staged = _StagedRows(self.kcv)
+            self._staged_columns = self._added_columns
+
+    def _discard(self):
+        """Throws staged writes away, if there are any, instead of
+        publishing them."""
+        if self._staged is not None:
+            self._staged = None
+            self._added_columns = self._staged_columns
+
+    def _publish(self):
+        """Puts staged writes in place, if there are any."""
+        staged, self._staged = self._staged, None
+        if staged is not None and staged.changed:
+            with self._writing():
+                staged.publish()
+                if self._cache is not None:
+                    for key in staged.changed:
+                        self._cache.invalidate(key)
+
+    def _changing(self, key):
+        """Invalidates the cached slices of a key that's about to change.
+        Staged changes only invalidate once they're published."""
+        if self._cache is not None and self._staged is None:
+            self._cache.invalidate(key)
+
+    def _reading(self):
+        """Returns a context manager to hold while reading several rows."""
+        if self._rwlock is None:
+            return _unlocked()
+        return self._rwlock.reading()
+
+    def _writing(self):
+        """Returns a context manager to hold while changing rows in place,
+        outside of _apply."""
+        if self._rwlock is None:
+            return _unlocked()
+        return self._rwlock.writing()
+
+    def _own_staged(self):
+        """Returns the changed rows staged by the current thread, if any, so
+        that a batch can read its own writes."""
+        staged = self._staged
+        if staged is not None and staged.writer is threading.current_thread():
+            return staged.changed
+        return None
+
+    def _commit(self, records):
+        """Persists the given (already applied) mutation records.  Returns
+        the sequence number of the log record they were appended as, if
+        any, for _await_commit."""
+        if self.persistence == LOG:
+            if len(records) == 1:
+                return self._append(records[0])
+            return self._append(('batch', records))
+        self._persist()
+        return None
+
+    def _await_commit(self, seq):
+        """Blocks until a log record is as durable as the durability setting
+        calls for.  Must be called without holding self._lock."""
+        if seq is not None and self.durability == GROUP_COMMIT:
+            self._wait_for_sync(seq)
+
+    @contextmanager
+    def batch(self):
+        """Returns a context manager that groups the mutations made within it.
+
+        The mutations take effect in memory as they're made, but are only
+        persisted once the context exits, and then all at once: a crash
+        midway through can't leave half of them on disk.  If the context
+        exits with an exception, none of them are persisted and they are all
+        undone in memory.  Other threads can't write to the store until the
+        batch is over.  Batches may be nested, in which case the outermost
+        one decides."""
+        self._check_writable()
+        with self._lock:
+            if self._batch is not None:
+                yield
+                return
+            self._batch = []
+            self._stage()
+            try:
+                yield
+            except BaseException:
+                if self._staged is not None:
+                    self._discard()
+                else:
+                    for record, undo in reversed(self._batch):
+                        self._undo(undo)
+                raise
+            finally:
+                batch, self._batch = self._batch, None
+            self._publish()
+            self._cool()
+            records = [record for record, undo in batch]
+            self._feed(records)
+            seq = None
+            if batch:
+                seq = self._commit(records)
+        self._await_commit(seq)
+
+    def close(self):
+        """Closes the log file, waiting for any checkpoint in progress (or,
+        in a replica, stops following the log).  The store must not be
+        mutated afterwards."""
+        self._closed.set()
+        if self._follower is not None:
+            self._follower.join()
+        if self._followed is not None:
+            self._followed.close()
+            self._followed = None
+        if self._checkpointer is not None:
+            self._checkpointer.join()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def catch_up(self):
+        """Applies the records the writer has logged since the replica last
+        caught up, returning how many there were.  If the writer has
+        checkpointed since, the whole file is loaded again instead (into a
+        separate store, so that reads carry on in the meantime), and None is
+        returned.
+
+        Requires O(1) operations per record, on top of the cost of applying
+        it, or that of loading the store."""
+        with self._lock:
+            if self._replaced(os.stat(self.path)):
+                self._reload()
+                return None
+            log = self._followed
+            log.seek(self._offset)
+            applied = 0
+            while True:
+                try:
+                    record = pickle.load(log)
+                except Exception:
+                    # The end of the log, or a record still being appended,
+                    # which will be complete next time.
+                    break
+                self._stage()
+                self._apply(record)
+                self._publish()
+                self._cool()
+                applied += 1
+                self._log_records += 1
+                self._log_bytes += log.tell() - self._offset
+                self._offset = log.tell()
+            if self._offset == os.fstat(log.fileno()).st_size:
+                self._caught_up = clock()
+            return applied
+
+    def _replaced(self, stat):
+        """Returns whether the file at a replica's path, whose os.stat is
+        given, is no longer the one it's following."""
+        followed = os.fstat(self._followed.fileno())
+        return ((stat.st_dev, stat.st_ino) !=
+                (followed.st_dev, followed.st_ino))
+
+    def _reload(self):
+        """Replaces a replica's rows with the ones in the file, freshly
+        loaded."""
+        fresh = KeyColumnValueStore(self.path, lazy=self.lazy,
+                                    hot_rows=self.hot_rows, replica=True)
+        if isinstance(fresh.kcv, _LazyRows):
+            fresh.kcv.table.stats = self.filter_stats
+        with self._writing():
+            self.kcv = fresh.kcv
+            self.lazy = fresh.lazy
+            self._hot = fresh._hot
+            self._followed.close()
+            self._followed = fresh._followed
+            self._offset = fresh._offset
+            self._loaded_columns = fresh._loaded_columns
+            self._added_columns = fresh._added_columns
+            self._log_records = fresh._log_records
+            self._log_bytes = fresh._log_bytes
+            self._caught_up = fresh._caught_up
+            if self._cache is not None:
+                self._cache.clear()
+
+    def follow(self, interval=0.1):
+        """Starts a daemon thread that calls catch_up every interval seconds,
+        until the replica is closed."""
+        def run():
+            while not self._closed.wait(interval):
+                try:
+                    self.catch_up()
+                except EnvironmentError:
+                    pass  # e.g. the file was briefly missing; try again
+
+        self._follower = threading.Thread(target=run)
+        self._follower.daemon = True
+        self._follower.start()
+
+    def replica_lag(self):
+        """Returns a dict of how many 'bytes' of the writer's log a replica
+        has yet to apply, and how many 'seconds' ago it last applied all of
+        it (0 if it has), which bounds how stale its reads are."""
+        stat = os.stat(self.path)
+        if self._replaced(stat):
+            behind = stat.st_size
+        else:
+            behind = max(0, stat.st_size - self._offset)
+        return {'bytes': behind,
+                'seconds': clock() - self._caught_up if behind else 0.0}
+
+    @kcvmetrics.timed
     def set(self, key, col, val):
         """Sets the value at the given key/column.
 
         In the average case, requires O(log(c)**2) operations, where c is the
         number of columns associated with the key."""
         assert all(isinstance(datum, basestring) for datum in (key, col, val))
-        self.kcv.setdefault(key, sorteddict())[col] = val
-        self._persist()
+        self._mutate(('set', key, col, val))
+
+    @kcvmetrics.timed
+    def set_many(self, triples):
+        """Sets the value at each of the given key/column/value triples, as a
+        single batch (see batch()).
 
+        Requires O(log(c)**2) operations per triple, just like set, but the
+        batch is only persisted once."""
+        with self.batch():
+            for key, col, val in triples:
+                self.set(key, col, val)
+
+    # The read-modify-write operations below each read the column and write
+    # its new value within a batch, which holds self._lock throughout, so no
+    # other write can come in between.  What's logged is just the resulting
+    # set (or delete), so replaying the log, replicas and the change feed
+    # don't need to know about them.
+
+    @kcvmetrics.timed
+    def compare_and_set(self, key, col, expected, new):
+        """Sets the value at the given key/column to new, but only if it's
+        currently expected, atomically.  Either may be None, meaning that the
+        column doesn't exist: it has to be missing to be set, or it's deleted.
+        Returns whether the value was set.
+
+        Requires O(1) operations, on top of those of set or delete."""
+        assert all(isinstance(datum, basestring) for datum in (key, col))
+        with self.batch():
+            if self.get(key, col) != expected:
+                return False
+            if new is None:
+                self.delete(key, col)
+            else:
+                self.set(key, col, new)
+            return True
+
+    @kcvmetrics.timed
+    def increment(self, key, col, delta=1):
+        """Adds delta to the integer at the given key/column (or to 0, if the
+        column doesn't exist), atomically, and returns the result.  Raises
+        ValueError if the value, or delta, isn't an integer.
+
+        Requires O(1) operations, on top of those of set."""
+        assert isinstance(key, basestring) and isinstance(col, basestring)
+        if not isinstance(delta, (int, long)) or isinstance(delta, bool):
+            raise ValueError('delta must be an integer: %r' % (delta,))
+        with self.batch():
+            current = self.get(key, col)
+            val = (0 if current is None else int(current)) + delta
+            self.set(key, col, str(val))
+            return val
+
+    @kcvmetrics.timed
+    def append(self, key, col, suffix):
+        """Appends suffix to the value at the given key/column (or sets it to
+        suffix, if the column doesn't exist), atomically.
+
+        Requires O(n) operations, for a value of length n, on top of those of
+        set."""
+        assert all(isinstance(datum, basestring)
+                   for datum in (key, col, suffix))
+        with self.batch():
+            self.set(key, col, (self.get(key, col) or '') + suffix)
+
+    def _row(self, key):
+        """Returns the sorteddict of columns to values for key, or None if
+        there's no such key.  The result must not be modified."""
+        changed = self._own_staged()
+        if changed and key in changed:
+            return changed[key]
+        return self.kcv.get(key)
+
+    @kcvmetrics.timed
     def get(self, key, col):
         """Return the value at the specified key/column, or None if no such
         value exists.
 
         In the average case, requires O(1) operations."""
-        cv = self.kcv.get(key)
+        if isinstance(self.kcv, _LazyRows) and not self._own_staged():
+            return self.kcv.get_column(key, col)
+        cv = self._row(key)
         return None if cv is None else cv.get(col)
 
+    @kcvmetrics.timed
+    def multi_get(self, pairs):
+        """Returns a list of the values at each of the given key/column pairs,
+        in order, with None wherever no such value exists.
+
+        In the average case, requires O(1) operations per pair, just like
+        get."""
+        with self._reading():
+            return [self.get(key, col) for key, col in pairs]
+
+    @kcvmetrics.timed
     def get_key(self, key):
         """Returns a sorted list of column/value tuples.
 
         Requires O(c) operations, where c is the number of columns associated
         with the key."""
-        return list(self.kcv.get(key, sorteddict()).items())
+        if self._cache is not None:
+            return self._cached_slice(key, None, None)
+        cv = self._row(key)
+        return [] if cv is None else list(cv.items())
 
+    @kcvmetrics.timed
     def get_keys(self):
         """Returns a set containing all of the keys in the store.
 
@@ -131,25 +1818,208 @@ class KeyColumnValueStore(object):
         # mutable structure to the outside, which is asking for trouble, and
         # copying the value would be O(k) anyway (I think).  So, this
         # implementation does just as well.
-        return set(self.kcv.iterkeys())
+        with self._reading():
+            keys = set(self.kcv.iterkeys())
+        changed = self._own_staged()
+        if changed:
+            for key, cv in changed.iteritems():
+                if cv is None:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+        return keys
+
+    def iter_keys(self, start=None, stop=None, limit=None, after=None):
+        """Yields the keys in the store between start and stop, inclusive, in
+        sorted order.  Start and/or stop can be None values, leaving the range
+        open ended in that direction.
+
+        If limit is given, at most that many keys are yielded.  If after is
+        given, only the keys after it are yielded, whether or not after is
+        itself a key; passing the last key yielded as after is how to page
+        through the keys, limit at a time.  Keys added or removed while the
+        keys are being iterated over may or may not be seen.
+
+        Requires O(log(k)**2) operations to find the first key, and O(1) for
+        each key yielded, where k is the number of keys stored (in a lazy
+        store, each key is read from the table, in O(1) reads)."""
+        if after is not None and (start is None or after >= start):
+            start = after
+        keys = self._iter_keys(start, stop)
+        if after is not None:
+            keys = (key for key in keys if key != after)
+        return itertools.islice(keys, limit)
+
+    def _iter_keys(self, start, stop):
+        """Returns an iterator over the keys between start and stop,
+        inclusive, in sorted order."""
+        with self._reading():
+            keys = self.kcv.iter_keys(start, stop)
+        changed = self._own_staged()
+        if not changed:
+            return keys
+        added = sorted(key for key, cv in changed.iteritems()
+                       if cv is not None and _in_range(key, start, stop) and
+                       key not in self.kcv)
+        deleted = set(key for key, cv in changed.iteritems() if cv is None)
+        return (key for key in heapq.merge(keys, added)
+                if key not in deleted)
 
+    @kcvmetrics.timed
+    def count_keys(self):
+        """Returns the number of keys in the store.
+
+        Requires O(1) operations."""
+        count = len(self.kcv)
+        changed = self._own_staged()
+        if changed:
+            for key, cv in changed.iteritems():
+                if cv is None and key in self.kcv:
+                    count -= 1
+                elif cv is not None and key not in self.kcv:
+                    count += 1
+        return count
+
+    @kcvmetrics.timed
+    def bulk_load(self, triples, presorted=False):
+        """Sets the value at each of the given key/column/value triples, which
+        may come in any order, then persists the whole store as a snapshot.
+
+        Each key's row is built in one pass over its columns, rather than by
+        inserting them one by one, and nothing is logged, so loading n
+        triples requires O(n) operations (O(n*log(c)) if the columns of a key
+        arrive out of order), on top of writing the snapshot.  Unlike
+        set_many, it isn't undone if the triples raise an exception midway,
+        and it can't be called within a batch.  Nor does it feed the triples
+        to the change feed: it empties the feed instead.
+
+        Every triple is held in memory until they've all been read, so
+        loading them requires O(n) memory on top of the store's own.  If
+        the triples are already grouped by key, in key order (the columns of
+        a key may come in any order), pass presorted=True to build and store
+        the rows one at a time instead, in extra memory for only one row (and
+        kcvtable.write_table's index, for a lazy store); ValueError is raised
+        at the first key out of order.  A lazy store streams its rows, old
+        and new, straight into a new table, so they're never all in memory
+        at once, and reads see the old rows until the new ones are in
+        place."""
+        self._check_writable()
+        self._check_outside_batch('bulk_load')
+        with self._no_checkpointer():
+            groups = _key_groups(triples, presorted)
+            if self.lazy:
+                self._bulk_load_table(groups)
+                self._lose_changes()
+                return
+            try:
+                for key, pairs in groups:
+                    cv = self.kcv.get(key)
+                    if cv is not None:
+                        pairs = _merge_pairs(cv.items(), pairs)
+                    row = self._make_row(pairs)
+                    with self._writing():
+                        self._changing(key)
+                        self._added_columns += len(row) - (
+                            0 if cv is None else len(cv))
+                        self.kcv[key] = row
+            finally:
+                # Whatever was loaded before an exception is in memory, so it
+                # had better be on disk too.
+                self._lose_changes()
+                if self.persistence == LOG:
+                    self._checkpoint()
+                else:
+                    self._persist()
+
+    def _bulk_load_table(self, groups):
+        """Does the work of bulk_load for a lazy store, given the (key,
+        pairs) tuples of _key_groups: writes a table merging them into the
+        store's rows, swaps it in for the store's file (and its log), and
+        reads the rows from it from then on."""
+        start = clock()
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                kcvtable.write_table(f, _merge_blocks(self._iterblocks(),
+                                                      groups))
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        os.rename(tmp, self.path)
+        self._fsync_dir()
+        table = kcvtable.Table(self.path, self.filter_stats)
+        with self._writing():
+            self.kcv = _LazyRows(table, self._make_row)
+            self._hot.clear()
+            self._loaded_columns = None
+            self._added_columns = 0
+            if self._cache is not None:
+                self._cache.clear()
+        if self.persistence == LOG:
+            self._reopen_log()
+            self._log_records = self._log_bytes = 0
+        if self.metrics is not None:
+            self.metrics.persisted('snapshot', clock() - start,
+                                   os.path.getsize(self.path))
+
+    def export(self):
+        """Yields every key/column/value triple in the store, sorted by key
+        and then by column.
+
+        Requires O(k*log(k)) operations to sort the keys, then O(1) per
+        triple; the rows of a lazy store are read one at a time, without
+        keeping them in memory.  Unless the store is concurrent, it mustn't
+        be written to until the export is done."""
+        for key in sorted(self.get_keys()):
+            if isinstance(self.kcv, _LazyRows):
+                pairs = self.kcv.peek(key)
+            else:
+                cv = self._row(key)
+                pairs = None if cv is None else cv.iteritems()
+            for col, val in pairs or ():
+                yield key, col, val
+
+    def size_stats(self):
+        """Returns a dict of the number of 'keys' in the store and the total
+        number of 'columns' among them.
+
+        Requires O(1) operations, since the columns are counted as they're
+        written, except the first time for a lazy store, which has to decode
+        every row in its table once to count the columns it started with."""
+        kcv = self.kcv
+        if self._loaded_columns is None:
+            # Concurrent calls may count them twice, but not wrongly.
+            self._loaded_columns = kcv.table_column_count()
+        return {'keys': len(kcv),
+                'columns': self._loaded_columns + self._added_columns}
+
+    @kcvmetrics.timed
     def delete(self, key, col):
         """Removes a column/value from the given key.
 
         In the average case, requires O(log(c)) operations, where c is the
         number of columns associated with the key."""
-        if key in self.kcv and col in self.kcv[key]:
-            del self.kcv[key][col]
-            self._persist()
+        self._mutate(('delete', key, col))
 
+    @kcvmetrics.timed
+    def delete_many(self, pairs):
+        """Removes each of the given key/column pairs, as a single batch (see
+        batch())."""
+        with self.batch():
+            for key, col in pairs:
+                self.delete(key, col)
+
+    @kcvmetrics.timed
     def delete_key(self, key):
         """Removes all data associated with the given key.
 
         In the average case, requires O(1) operations."""
-        if key in self.kcv:
-            del self.kcv[key]
-            self._persist()
+        self._mutate(('delete_key', key))
 
+    @kcvmetrics.timed
     def get_slice(self, key, start, stop):
         """Returns a sorted list of column/value tuples where the column values
         are between the start and stop values, inclusive of the start and stop
@@ -159,18 +2029,158 @@ class KeyColumnValueStore(object):
         In the average case, requires O(log(c)**2 + s) operations, where c is
         the number of columns associated with the key and s is the length of
         the slice.  Thus, for large slices, this approaches O(c)."""
+        if self._cache is not None:
+            return self._cached_slice(key, start, stop)
+        return list(self.iter_slice(key, start, stop))
+
+    def _cached_slice(self, key, start, stop):
+        """Returns get_slice(key, start, stop), from the cache if possible.
+        A batch's reads of its own writes bypass the cache."""
+        if self._own_staged():
+            return list(self.iter_slice(key, start, stop))
+        entry = (key, start, stop)
+        columns = self._cache.get(entry)
+        if columns is None:
+            generation = self._cache.generation
+            columns = tuple(self.iter_slice(key, start, stop))
+            self._cache.put(entry, columns, generation)
+        return list(columns)
+
+    @kcvmetrics.timed
+    def multi_get_slice(self, keys, start, stop):
+        """Returns a list of get_slice(key, start, stop) for each of the given
+        keys, in order.
+
+        Requires O(log(c)**2 + s) operations per key, just like get_slice."""
+        with self._reading():
+            rows = [self._row(key) for key in keys]
+        return [list(self._iter_row_slice(cv, start, stop)) for cv in rows]
+
+    def iter_slice(self, key, start, stop, limit=None, reverse=False,
+                   start_exclusive=False, stop_exclusive=False, after=None):
+        """Yields the column/value tuples that get_slice(key, start, stop)
+        would return, without building a list of them.
+
+        If reverse is true, the tuples are yielded in reverse order.  If
+        start_exclusive or stop_exclusive is true, the start or stop column
+        itself is left out of the slice.  If limit is given, at most that many
+        tuples are yielded.  If after is given, only the columns after it (or
+        before it, if reverse is true) are yielded, whether or not after is
+        itself a column; passing the last column yielded as after is how to
+        page through a slice, limit columns at a time.
+
+        In the average case, requires O(log(c)**2) operations to find the
+        slice and O(1) for each tuple yielded, where c is the number of columns
+        associated with the key."""
+        return self._iter_row_slice(self._row(key), start, stop, limit,
+                                    reverse, start_exclusive, stop_exclusive,
+                                    after)
+
+    @kcvmetrics.timed
+    def get_prefix(self, key, prefix):
+        """Returns a sorted list of the column/value tuples of key whose
+        columns start with prefix.
+
+        In the average case, requires O(log(c)**2 + s) operations, just like
+        get_slice."""
+        return list(self.iter_prefix(key, prefix))
+
+    def iter_prefix(self, key, prefix, limit=None, reverse=False,
+                    after=None):
+        """Yields the column/value tuples that get_prefix(key, prefix) would
+        return, without building a list of them.  limit, reverse and after
+        work just as they do for iter_slice.
+
+        In the average case, requires O(log(c)**2) operations to find the
+        columns and O(1) for each tuple yielded."""
+        cv = self._row(key)
+        if cv is None:
+            return iter(())
+        cols = cv.keys()
+        start_index, stop_index = _prefix_indices(cols, prefix)
+        return self._iter_window(cv, cols, start_index, stop_index, limit,
+                                 reverse, after)
+
+    @kcvmetrics.timed
+    def count_slice(self, key, start, stop):
+        """Returns the number of columns get_slice(key, start, stop) would
+        return, without building the slice: the difference of its bounds'
+        positions in the row.
+
+        In the average case, requires O(log(c)**2) operations (O(log(c)) for
+        a frozen row), however long the slice."""
+        cv = self._row(key)
+        if cv is None:
+            return 0
+        start_index, stop_index = _slice_indices(cv.keys(), start, stop)
+        return max(0, stop_index - start_index)
+
+    @kcvmetrics.timed
+    def count_prefix(self, key, prefix):
+        """Returns the number of columns of key that start with prefix,
+        without building a list of them.
+
+        Requires O(log(c)**2) operations, just like count_slice."""
+        cv = self._row(key)
+        if cv is None:
+            return 0
+        start_index, stop_index = _prefix_indices(cv.keys(), prefix)
+        return stop_index - start_index
+
+    @kcvmetrics.timed
+    def count_columns(self, key):
+        """Returns the number of columns associated with key.
+
+        In the average case, requires O(1) operations."""
+        cv = self._row(key)
+        return 0 if cv is None else len(cv)
+
+    def _iter_row_slice(self, cv, start, stop, limit=None, reverse=False,
+                        start_exclusive=False, stop_exclusive=False,
+                        after=None):
+        """Does the work of iter_slice, given the row."""
         # sorteddict.keys()  - O(1), returns sortedset in Python 2
-        # x not in sortedset - O(log(c)**2)
-        # len(sortedset)     - O(1)
+        # (see _slice_indices for finding the slice's bounds)
+        if cv is None:
+            return
+        cols = cv.keys()
+        start_index, stop_index = _slice_indices(
+            cols, start, stop, start_exclusive, stop_exclusive)
+        for item in self._iter_window(cv, cols, start_index, stop_index,
+                                      limit, reverse, after):
+            yield item
+
+    def _iter_window(self, cv, cols, start_index, stop_index, limit=None,
+                     reverse=False, after=None):
+        """Yields the column/value tuples of the row cv (whose sorted
+        columns are cols) from start_index up to stop_index, narrowed down by
+        limit and after just as iter_slice's are."""
         # sortedset.bisect_* - O(log(c)**2)
         # sortedset[i:j]     - O(log(c))
-        # self.get           - O(1)
-        # list comprehension - O(s), since O(1) self.get for each slice item
-        cols = self.kcv.get(key, sorteddict()).keys()
-        start_missing = start not in cols
-        stop_missing = stop not in cols
-        if start_missing and stop_missing and not (start is stop is None):
-            return []
-        start_index = 0 if start_missing else cols.bisect_left(start)
-        stop_index = len(cols) if stop_missing else cols.bisect_right(stop)
-        return [(c, self.get(key, c)) for c in cols[start_index:stop_index]]
+        # cv.get(c)          - O(1), for each column yielded
+        # (For a frozen row, the bisects require O(log(c)) operations, and
+        # each column yielded O(1).)
+        if after is not None:
+            if reverse:
+                stop_index = min(stop_index, cols.bisect_left(after))
+            else:
+                start_index = max(start_index, cols.bisect_right(after))
+        if limit is not None:
+            if reverse:
+                start_index = max(start_index, stop_index - limit)
+            else:
+                stop_index = min(stop_index, start_index + limit)
+        if start_index >= stop_index:
+            return
+        if isinstance(cv, _FrozenRow):
+            # Frozen rows never change, and can be read by index.
+            indices = xrange(start_index, stop_index)
+            for i in (reversed(indices) if reverse else indices):
+                yield cols[i], cv.value(i)
+            return
+        window = cols[start_index:stop_index]
+        for c in (reversed(window) if reverse else window):
+            # cols is a snapshot, so c may have been deleted since
+            val = cv.get(c)
+            if val is not None:
+                yield c, val
@@ -0,0 +1,264 @@
+"""
+A read-optimized, immutable file format for key/column/value data.
+
+A table file holds every key's row as a separate block, in sorted key order,
+followed by an index of fixed-width entries pointing at each key and block.
+Tables are opened with mmap, and the index is binary searched in place, so
+opening one costs O(1) no matter how big it is, and a row is only decoded when
+somebody asks for it.  The layout is:
+
+    MAGIC
+    HEADER: number of keys, offsets of the index, sparse index and filter,
+        and of the end of the table
+    for each key, in sorted order: the pickled key, then its block (the
+        pickled list of its column/value tuples, sorted by column)
+    INDEX: for each key, the offsets of its pickled key and of its block
+    SPARSE INDEX: the pickled list of every SPARSE_INTERVAL-th key
+    FILTER: the size of a Bloom filter and its number of hash functions,
+        then its bits
+
+Whatever follows the table (e.g. a log of later mutations) is ignored.
+
+The sparse index is small enough to keep in memory, and narrows a lookup down
+to SPARSE_INTERVAL entries of the index before it ever touches the file.  The
+Bloom filter holds every key, plus whatever other items the writer chose to
+add (typically the key/column pairs, see column_item), so that most lookups
+for things that aren't in the table never touch the index or the data.
+"""
+
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from hashlib import md5
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+MAGIC = 'KCVTBL02'
+HEADER = struct.Struct('<QQQQQ')
+ENTRY = struct.Struct('<QQ')
+FILTER_HEADER = struct.Struct('<QQ')
+HASHES = struct.Struct('<II')
+SPARSE_INTERVAL = 64
+BITS_PER_ITEM = 10  # about a 1% false positive rate
+
+
+def is_table(f):
+    """Returns whether the given file object is positioned at the start of a
+    table, leaving its position unchanged."""
+    pos = f.tell()
+    magic = f.read(len(MAGIC))
+    f.seek(pos)
+    return magic == MAGIC
+
+
+def encode_block(pairs):
+    """Encodes an iterable of column/value tuples, sorted by column, as a
+    block."""
+    return pickle.dumps(list(pairs), pickle.HIGHEST_PROTOCOL)
+
+
+def decode_block(block):
+    """Decodes a block into a sorted list of column/value tuples."""
+    return pickle.loads(block)
+
+
+def _bytes(s):
+    return s.encode('utf-8') if isinstance(s, unicode) else s
+
+
+def key_item(key):
+    """Returns the Bloom filter item for a key."""
+    return 'k' + _bytes(key)
+
+
+def column_item(key, col):
+    """Returns the Bloom filter item for a key/column pair."""
+    key = _bytes(key)
+    return 'c%d:%s%s' % (len(key), key, _bytes(col))
+
+
+def _hash(item):
+    """Returns the pair of hashes from which a Bloom filter derives the bits
+    for an item."""
+    return HASHES.unpack_from(md5(item).digest())
+
+
+def write_table(f, blocks, bits_per_item=BITS_PER_ITEM):
+    """Writes a table to the given file object, which must be positioned at the
+    start of the file.  blocks is an iterable of (key, block, items) tuples,
+    sorted by key, where each block is an encoded list of column/value tuples
+    and items is an iterable of extra Bloom filter items for the key (e.g. a
+    column_item for each column).
+
+    Requires O(k + i) memory, where k is the number of keys and i the number
+    of filter items, on top of whatever a single block needs."""
+    f.write(MAGIC)
+    f.write(HEADER.pack(0, 0, 0, 0, 0))
+    offsets = array('L')
+    sparse = []
+    hashes = array('I')
+    for key, block, items in blocks:
+        if len(offsets) // 2 % SPARSE_INTERVAL == 0:
+            sparse.append(key)
+        offsets.append(f.tell())
+        f.write(pickle.dumps(key, pickle.HIGHEST_PROTOCOL))
+        offsets.append(f.tell())
+        f.write(block)
+        hashes.extend(_hash(key_item(key)))
+        for item in items:
+            hashes.extend(_hash(item))
+    index = f.tell()
+    for i in xrange(0, len(offsets), 2):
+        f.write(ENTRY.pack(offsets[i], offsets[i + 1]))
+    sparse_index = f.tell()
+    pickle.dump(sparse, f, pickle.HIGHEST_PROTOCOL)
+    bloom = f.tell()
+    nitems = len(hashes) // 2
+    nbits = max(8, nitems * bits_per_item)
+    nhashes = max(1, int(round(0.693 * nbits / max(1, nitems))))
+    bits = bytearray((nbits + 7) // 8)
+    for i in xrange(0, len(hashes), 2):
+        h1, h2 = hashes[i], hashes[i + 1]
+        for j in xrange(nhashes):
+            bit = (h1 + j * h2) % nbits
+            bits[bit // 8] |= 1 << (bit % 8)
+    f.write(FILTER_HEADER.pack(nbits, nhashes))
+    f.write(bits)
+    end = f.tell()
+    f.seek(len(MAGIC))
+    f.write(HEADER.pack(len(offsets) // 2, index, sparse_index, bloom, end))
+    f.seek(end)
+
+
+class Table(object):
+    """A read-only view of the table at the start of the file at path.
+
+    Lookups binary search the index, requiring O(log(k)) key comparisons,
+    where k is the number of keys in the table, but only O(1) of them read
+    the file, thanks to the sparse index.  Lookups for keys the Bloom filter
+    rules out don't read the file at all.
+
+    stats is a Counter of the filter's 'hits' (items it may contain),
+    'misses' (items it definitely doesn't) and 'false_positives' (hits for
+    keys that turned out to be missing).  Tables can share a Counter, and
+    whoever reads a row after a hit for a column_item should count a false
+    positive if the column turns out to be missing."""
+
+    def __init__(self, path, stats=None):
+        self.stats = Counter() if stats is None else stats
+        with open(path, 'rb') as f:
+            if not is_table(f):
+                raise ValueError('not a table: %r' % (path,))
+            f.seek(len(MAGIC))
+            (self.count, self.index, sparse_index, self.filter,
+             self.end) = HEADER.unpack(f.read(HEADER.size))
+            self.map = mmap.mmap(f.fileno(), self.end,
+                                 access=mmap.ACCESS_READ)
+        self.sparse = pickle.loads(self.map[sparse_index:self.filter])
+        self.nbits, self.nhashes = FILTER_HEADER.unpack_from(self.map,
+                                                             self.filter)
+        self.filter += FILTER_HEADER.size
+
+    def __len__(self):
+        return self.count
+
+    def may_contain(self, item):
+        """Returns False if the table definitely doesn't contain the given
+        Bloom filter item, or True if it may."""
+        h1, h2 = _hash(item)
+        for j in xrange(self.nhashes):
+            bit = (h1 + j * h2) % self.nbits
+            if not ord(self.map[self.filter + bit // 8]) & (1 << (bit % 8)):
+                self.stats['misses'] += 1
+                return False
+        self.stats['hits'] += 1
+        return True
+
+    def _entry(self, i):
+        """Returns the offsets of the i-th key, its block, and the end of its
+        block."""
+        key_offset, block_offset = ENTRY.unpack_from(
+            self.map, self.index + i * ENTRY.size)
+        if i + 1 < self.count:
+            block_end = ENTRY.unpack_from(
+                self.map, self.index + (i + 1) * ENTRY.size)[0]
+        else:
+            block_end = self.index
+        return key_offset, block_offset, block_end
+
+    def _key(self, i):
+        key_offset, block_offset, _ = self._entry(i)
+        return pickle.loads(self.map[key_offset:block_offset])
+
+    def _block(self, i):
+        _, block_offset, block_end = self._entry(i)
+        return self.map[block_offset:block_end]
+
+    def _bisect_left(self, key):
+        """Returns the position in the index of the first key that isn't less
+        than key (or the number of keys, if there's none)."""
+        i = bisect_left(self.sparse, key)
+        lo = max(0, (i - 1) * SPARSE_INTERVAL)
+        hi = min(self.count, i * SPARSE_INTERVAL)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, key):
+        """Returns the position of key in the index, or None if the table
+        doesn't contain it."""
+        if not self.may_contain(key_item(key)):
+            return None
+        i = self._bisect_left(key)
+        if i < self.count and self._key(i) == key:
+            return i
+        self.stats['false_positives'] += 1
+        return None
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def get(self, key):
+        """Returns the sorted list of column/value tuples for key, or None if
+        the table doesn't contain it."""
+        block = self.get_block(key)
+        return None if block is None else decode_block(block)
+
+    def get_block(self, key):
+        """Returns the encoded block for key, or None if the table doesn't
+        contain it."""
+        i = self._find(key)
+        return None if i is None else self._block(i)
+
+    def iterkeys(self, start=None, stop=None):
+        """Yields every key in the table, in sorted order, or only those
+        between start and stop, inclusive, if either is given.  Finding start
+        requires O(log(k)) key comparisons, like a lookup."""
+        first = 0 if start is None else self._bisect_left(start)
+        for i in xrange(first, self.count):
+            key = self._key(i)
+            if stop is not None and key > stop:
+                return
+            yield key
+
+    __iter__ = iterkeys
+
+    def iterblocks(self):
+        """Yields a key/block tuple for every key in the table, in sorted
+        order."""
+        for i in xrange(self.count):
+            key_offset, block_offset, block_end = self._entry(i)
+            yield (pickle.loads(self.map[key_offset:block_offset]),
+                   self.map[block_offset:block_end])
+
+    def close(self):
+        self.map.close()
@@ -0,0 +1,217 @@
+import httplib
+import json
+import os
+import threading
+import time
+import unittest
+import urllib
+from asynckcv import Server
+from kcvstore import KeyColumnValueStore
+
+
+class AsyncServerTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore(concurrent=True, change_feed=10)
+        self.server = Server(self.store, port=0, workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.conn = self.connect()
+
+    def tearDown(self):
+        self.conn.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.store.close()
+        os.remove(self.store.path)
+
+    def connect(self):
+        return httplib.HTTPConnection(*self.server.address)
+
+    def request(self, method, path, body=None, form=None, conn=None):
+        conn = conn or self.conn
+        headers = {}
+        if form is not None:
+            body = urllib.urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_routes(self):
+        self.assertEqual(self.request('POST', '/', form={
+            'key': 'a', 'col': 'x', 'val': '1'}), (201, {'result': None}))
+        self.assertEqual(self.request('PUT', '/a/y', form={'val': '2'}),
+                         (301, {'result': None}))
+        self.assertEqual(self.request('POST', '/_bulk', json.dumps(
+            [['b', 'x', '3'], ['a', 'z', '4']]))[0], 201)
+        self.assertEqual(self.request('GET', '/a/y'), (200, {'value': '2'}))
+        self.assertEqual(self.request('GET', '/a/q'), (200, {'value': None}))
+        status, keys = self.request('GET', '/')
+        self.assertEqual(sorted(keys['keys']), ['a', 'b'])
+        self.assertEqual(self.request('GET', '/a'), (200, {'columns': [
+            ['x', '1'], ['y', '2'], ['z', '4']]}))
+        self.assertEqual(self.request('GET', '/a?start=y'), (200, {
+            'columns': [['y', '2'], ['z', '4']]}))
+        self.assertEqual(self.request('GET', '/a?limit=2'), (200, {
+            'columns': [['x', '1'], ['y', '2']], 'next': 'y'}))
+        self.assertEqual(self.request('GET', '/a?limit=0')[0], 400)
+        self.assertEqual(self.request('GET', '/a?limit=-1')[0], 400)
+        self.assertEqual(self.request('POST', '/_mget', json.dumps({
+            'pairs': [['a', 'x'], ['b', 'y']], 'keys': ['b']})), (200, {
+                'values': ['1', None], 'slices': [[['x', '3']]]}))
+        for body in ([1, 2], {'pairs': [['a']]}, {'pairs': [['a', 1]]},
+                     {'pairs': 'ab'}, {'keys': 'abc'}, {'keys': [1]},
+                     {'keys': ['a'], 'start': 1}):
+            self.assertEqual(self.request('POST', '/_mget',
+                                          json.dumps(body))[0], 400)
+        self.assertEqual(self.request('DELETE', '/a/x')[0], 200)
+        self.assertEqual(self.request('DELETE', '/b')[0], 200)
+        self.assertEqual(self.store.get_key('a'), [('y', '2'), ('z', '4')])
+        self.assertEqual(self.store.get_keys(), set(['a']))
+        self.assertEqual(self.request('GET', '/a/b/c')[0], 404)
+        self.assertEqual(self.request('PUT', '/a')[0], 405)
+        self.assertEqual(self.request('POST', '/_bulk', 'nonsense')[0], 400)
+        for body in ({'a': 'b'}, [['a', 'b']], [['a', 'b', 1]], ['abc'],
+                     [['a', 'b', 'c', 'd']]):
+            self.assertEqual(self.request('POST', '/_bulk',
+                                          json.dumps(body))[0], 400)
+        self.assertEqual(self.store.get_keys(), set(['a']))
+
+    def test_key_listing(self):
+        self.store.set_many((key, 'x', '1') for key in 'abcde')
+        self.assertEqual(self.request('GET', '/'),
+                         (200, {'keys': list('abcde')}))
+        self.assertEqual(self.request('GET', '/?start=b&stop=d'),
+                         (200, {'keys': list('bcd')}))
+        self.assertEqual(self.request('GET', '/?limit=2&after=a'),
+                         (200, {'keys': list('bc'), 'next': 'c'}))
+        self.assertEqual(self.request('GET', '/?limit=2&after=c'),
+                         (200, {'keys': list('de'), 'next': None}))
+        self.assertEqual(self.request('GET', '/?count=true'),
+                         (200, {'count': 5}))
+        self.assertEqual(self.request('GET', '/?limit=0')[0], 400)
+        self.assertEqual(self.request('GET', '/?limit=-1')[0], 400)
+
+    def test_changes(self):
+        status, body = self.request('GET', '/_changes')
+        seq = body['seq']
+        self.assertEqual(body['changes'], [])
+        threading.Timer(0.05, self.store.set, ('a', 'x', '1')).start()
+        self.assertEqual(self.request('GET', '/_changes?seq=%d' % seq), (
+            200, {'seq': seq + 1, 'changes': [[seq + 1, 'set', 'a', 'x',
+                                               '1']]}))
+        self.assertEqual(self.request('GET', '/_changes?seq=%d&timeout=0' %
+                                      (seq + 1)),
+                         (200, {'seq': seq + 1, 'changes': []}))
+        status, body = self.request('GET', '/_changes?seq=%d' % (seq - 1))
+        self.assertEqual(status, 410)
+        self.assertEqual(self.request('GET', '/_changes?seq=x')[0], 400)
+        for query in ('limit=0', 'limit=-1', 'limit=x', 'timeout=abc',
+                      'timeout=-1', 'timeout=nan'):
+            self.assertEqual(self.request('GET', '/_changes?seq=%d&%s' %
+                                          (seq, query))[0], 400)
+        self.assertEqual(self.request('GET', '/_changes?seq=%d&limit=1' %
+                                      seq)[1]['seq'], seq + 1)
+
+    def test_non_ascii(self):
+        self.assertEqual(self.request('POST', '/_bulk', json.dumps(
+            [[u'caf\xe9', u'\xe7ol', u'v']]))[0], 201)
+        self.assertEqual(self.request('GET', '/caf%C3%A9/%C3%A7ol'),
+                         (200, {'value': 'v'}))
+        self.assertEqual(self.request('GET', '/caf%C3%A9?start=%C3%A7ol'),
+                         (200, {'columns': [[u'\xe7ol', 'v']]}))
+        self.assertEqual(self.request('PUT', '/caf%C3%A9/d', form={
+            'val': u'\xfc'.encode('utf-8')})[0], 301)
+        self.assertEqual(self.store.get(u'caf\xe9', 'd'), u'\xfc')
+        self.assertEqual(self.request('GET', '/?start=caf%C3%A9'),
+                         (200, {'keys': [u'caf\xe9']}))
+        self.assertEqual(self.request('GET', '/caf%E9/d')[0], 400)
+
+    def test_polls_dont_hold_up_writes(self):
+        # There are as many polls as workers, and the write that ends them
+        # still has a worker to run on.
+        seq = self.request('GET', '/_changes')[1]['seq']
+        results = []
+
+        def poll():
+            results.append(self.request('GET', '/_changes?seq=%d' % seq,
+                                        conn=self.connect()))
+
+        polls = [threading.Thread(target=poll) for i in xrange(3)]
+        for thread in polls:
+            thread.start()
+        deadline = time.time() + 5
+        while len(self.server._polls) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        start = time.time()
+        self.assertEqual(self.request('PUT', '/a/x', form={'val': '1'}),
+                         (301, {'result': None}))
+        self.assertTrue(time.time() - start < 1)
+        for thread in polls:
+            thread.join()
+        self.assertEqual(results, [(200, {'seq': seq + 1, 'changes': [
+            [seq + 1, 'set', 'a', 'x', '1']]})] * 3)
+        self.assertEqual(self.request('GET', '/_changes?seq=%d&timeout=0.05'
+                                      % (seq + 1)),
+                         (200, {'seq': seq + 1, 'changes': []}))
+
+    def test_updates(self):
+        def update(**query):
+            return self.request('POST', '/a/n', json.dumps(query))
+
+        self.assertEqual(update(op='increment', delta=5),
+                         (200, {'result': 5}))
+        self.assertEqual(update(op='compare_and_set', expected='5', val='7'),
+                         (200, {'result': True}))
+        self.assertEqual(update(op='compare_and_set', expected=None,
+                                val='1'), (200, {'result': False}))
+        self.assertEqual(update(op='append', suffix='0'),
+                         (200, {'result': None}))
+        self.assertEqual(self.store.get('a', 'n'), '70')
+        self.assertEqual(update(op='increment', delta='x')[0], 400)
+        self.assertEqual(update(op='append')[0], 400)
+        self.assertEqual(update(op='nonsense')[0], 400)
+        self.assertEqual(update(op='compare_and_set', val=5)[0], 400)
+        self.assertEqual(update(op='compare_and_set', expected=[])[0], 400)
+        self.assertEqual(update(op='append', suffix=5)[0], 400)
+        self.assertEqual(update(op='append', suffix=None)[0], 400)
+        self.assertEqual(self.request('POST', '/a/n', '[1]')[0], 400)
+        self.assertEqual(self.store.get('a', 'n'), '70')
+
+    def test_prefixes_and_counts(self):
+        self.store.set_many(('a', col, '1') for col in ['p:1', 'p:2', 'p:3',
+                                                       'q:1'])
+        self.assertEqual(self.request('GET', '/a?prefix=p:'), (200, {
+            'columns': [['p:1', '1'], ['p:2', '1'], ['p:3', '1']]}))
+        self.assertEqual(self.request('GET', '/a?prefix=p:&limit=2'), (200, {
+            'columns': [['p:1', '1'], ['p:2', '1']], 'next': 'p:2'}))
+        self.assertEqual(self.request('GET', '/a?prefix=p:&count=true'),
+                         (200, {'count': 3}))
+        self.assertEqual(self.request('GET', '/a?start=p:2&count=true'),
+                         (200, {'count': 3}))
+        self.assertEqual(self.request('GET', '/a?count=true'),
+                         (200, {'count': 4}))
+        self.assertEqual(self.request('GET', '/b?count=true'),
+                         (200, {'count': 0}))
+
+    def test_streams_large_slices(self):
+        cols = ['%05d' % i for i in xrange(5000)]
+        self.store.set_many(('row', col, col) for col in cols)
+        self.conn.request('GET', '/row')
+        response = self.conn.getresponse()
+        self.assertEqual(response.getheader('transfer-encoding'), 'chunked')
+        self.assertEqual(json.loads(response.read()),
+                         {'columns': [[col, col] for col in cols]})
+        # ...and the connection is still good for another request.
+        self.assertEqual(self.request('GET', '/row/00042'),
+                         (200, {'value': '00042'}))
+
+    def test_many_connections(self):
+        conns = [self.connect() for i in xrange(50)]
+        for i, conn in enumerate(conns):
+            self.request('PUT', '/key/%02d' % i, form={'val': 'v'},
+                         conn=conn)
+        for conn in conns:
+            self.assertEqual(len(self.request('GET', '/key',
+                                              conn=conn)[1]['columns']), 50)
+            conn.close()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import threading
+import unittest
+from kcvlsm import LSMKeyColumnValueStore
+from kcvstore import KeyColumnValueStore
+
+
+class AtomicTests(unittest.TestCase):
+    def setUp(self):
+        self.store = self.open_store()
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def open_store(self, path=None):
+        return KeyColumnValueStore(path=path)
+
+    def reopen(self):
+        self.store.close()
+        self.store = self.open_store(self.store.path)
+
+    def test_compare_and_set(self):
+        store = self.store
+        self.assertTrue(store.compare_and_set('a', 'x', None, '1'))
+        self.assertFalse(store.compare_and_set('a', 'x', None, '2'))
+        self.assertFalse(store.compare_and_set('a', 'x', '2', '3'))
+        self.assertEqual(store.get('a', 'x'), '1')
+        self.assertTrue(store.compare_and_set('a', 'x', '1', '2'))
+        self.assertEqual(store.get('a', 'x'), '2')
+        self.assertTrue(store.compare_and_set('a', 'x', '2', None))
+        self.assertEqual(store.get_key('a'), [])
+        self.reopen()
+        self.assertEqual(self.store.get('a', 'x'), None)
+
+    def test_increment(self):
+        self.assertEqual(self.store.increment('a', 'n'), 1)
+        self.assertEqual(self.store.increment('a', 'n', 10), 11)
+        self.assertEqual(self.store.increment('a', 'n', -20), -9)
+        self.reopen()
+        self.assertEqual(self.store.get('a', 'n'), '-9')
+        self.store.set('a', 's', 'text')
+        self.assertRaises(ValueError, self.store.increment, 'a', 's')
+        self.assertRaises(ValueError, self.store.increment, 'a', 'n', 1.5)
+        self.assertEqual(self.store.get('a', 's'), 'text')
+
+    def test_append(self):
+        self.store.append('a', 'log', 'x')
+        self.store.append('a', 'log', 'yz')
+        self.reopen()
+        self.assertEqual(self.store.get('a', 'log'), 'xyz')
+
+    def test_within_batch(self):
+        try:
+            with self.store.batch():
+                self.store.increment('a', 'n')
+                self.assertEqual(self.store.increment('a', 'n'), 2)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.store.get('a', 'n'), None)
+
+    def test_concurrent_increments(self):
+        def work():
+            for i in xrange(200):
+                self.store.increment('a', 'n')
+
+        threads = [threading.Thread(target=work) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.store.get('a', 'n'), '800')
+        self.reopen()
+        self.assertEqual(self.store.get('a', 'n'), '800')
+
+
+class ConcurrentAtomicTests(AtomicTests):
+    def open_store(self, path=None):
+        return KeyColumnValueStore(path=path, concurrent=True)
+
+
+class LSMAtomicTests(AtomicTests):
+    def open_store(self, path=None):
+        return LSMKeyColumnValueStore(path=path)
+
+    def reopen(self):
+        self.store.close()
+        self.store = self.open_store(self.store.directory)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
@@ -0,0 +1,108 @@
+import os
+import string
+import unittest
+from kcvstore import KeyColumnValueStore, SNAPSHOT
+
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore()
+        self.store.set('key', 'a', 'val')
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def reloaded(self):
+        return KeyColumnValueStore(path=self.store.path,
+                                   persistence=self.store.persistence)
+
+    def test_set_many(self):
+        self.store.set_many(('key', c, 'val') for c in string.ascii_lowercase)
+        expected = [(c, 'val') for c in string.ascii_lowercase]
+        self.assertEqual(self.store.get_key('key'), expected)
+        self.assertEqual(self.reloaded().get_key('key'), expected)
+
+    def test_delete_many(self):
+        self.store.set('key', 'b', 'val')
+        self.store.set('key', 'c', 'val')
+        self.store.delete_many([('key', 'a'), ('key', 'c'), ('nokey', 'a')])
+        self.assertEqual(self.store.get_key('key'), [('b', 'val')])
+        self.assertEqual(self.reloaded().get_key('key'), [('b', 'val')])
+
+    def test_batch_persists_once(self):
+        with self.store.batch():
+            self.store.set('key', 'b', 'val')
+            size = os.path.getsize(self.store.path)
+            self.store.delete('key', 'a')
+            self.store.delete_key('other')
+            self.store.set('other', 'col', 'val')
+            self.assertEqual(os.path.getsize(self.store.path), size)
+            self.assertEqual(self.reloaded().get_key('key'), [('a', 'val')])
+        new_store = self.reloaded()
+        self.assertEqual(new_store.get_key('key'), [('b', 'val')])
+        self.assertEqual(new_store.get_key('other'), [('col', 'val')])
+
+    def test_nested_batches(self):
+        with self.store.batch():
+            with self.store.batch():
+                self.store.set('key', 'b', 'val')
+            self.assertEqual(self.reloaded().get_key('key'), [('a', 'val')])
+        self.assertEqual(self.reloaded().get_key('key'),
+                         [('a', 'val'), ('b', 'val')])
+
+    def test_no_checkpoint_within_batch(self):
+        # The checkpoint would persist the batch's mutations, which are then
+        # undone.
+        try:
+            with self.store.batch():
+                self.store.set('key', 'b', 'val')
+                self.assertRaises(ValueError, self.store.checkpoint)
+                self.assertRaises(ValueError, self.store.checkpoint,
+                                  background=True)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.reloaded().get_key('key'), [('a', 'val')])
+        self.store.checkpoint()
+        self.assertEqual(self.reloaded().get_key('key'), [('a', 'val')])
+
+    def test_failed_batch_is_rolled_back(self):
+        self.store.set('other', 'col', 'val')
+        try:
+            with self.store.batch():
+                self.store.set('key', 'a', 'new_val')
+                self.store.set('key', 'b', 'val')
+                self.store.set('new', 'col', 'val')
+                self.store.delete('other', 'col')
+                self.store.delete_key('key')
+                self.store.set('key', 'c', 'val')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        for store in (self.store, self.reloaded()):
+            self.assertEqual(store.get_keys(), {'key', 'other'})
+            self.assertEqual(store.get_key('key'), [('a', 'val')])
+            self.assertEqual(store.get_key('other'), [('col', 'val')])
+
+    def test_invalid_triple_rolls_back_set_many(self):
+        with self.assertRaises(AssertionError):
+            self.store.set_many([('key', 'b', 'val'), ('key', 'c', None)])
+        self.assertEqual(self.store.get_key('key'), [('a', 'val')])
+        self.assertEqual(self.reloaded().get_key('key'), [('a', 'val')])
+
+    def test_torn_batch_is_discarded(self):
+        self.store.set_many(('key', c, 'val') for c in string.ascii_lowercase)
+        self.store.close()
+        with open(self.store.path, 'r+b') as log:
+            log.truncate(os.path.getsize(self.store.path) - 10)
+        self.assertEqual(self.reloaded().get_key('key'), [('a', 'val')])
+
+
+class SnapshotBatchTests(BatchTests):
+    def setUp(self):
+        self.store = KeyColumnValueStore(persistence=SNAPSHOT)
+        self.store.set('key', 'a', 'val')
+
+    def test_torn_batch_is_discarded(self):
+        pass  # snapshots are replaced atomically, so there's nothing to tear
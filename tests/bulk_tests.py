@@ -0,0 +1,246 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from kcvcli import main, read_csv, read_jsonl, write_csv, write_jsonl
+from kcvlsm import LSMKeyColumnValueStore
+from kcvshard import ShardedKeyColumnValueStore
+from kcvstore import KeyColumnValueStore, SNAPSHOT
+
+
+def triples(keys=20, columns=30):
+    return [('key%02d' % k, 'col%02d' % c, '%d.%d' % (k, c))
+            for k in xrange(keys) for c in xrange(columns)]
+
+
+class BulkLoadTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore()
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def reloaded(self):
+        return KeyColumnValueStore(path=self.store.path)
+
+    def test_sorted(self):
+        self.store.bulk_load(iter(triples()))
+        self.assertEqual(list(self.store.export()), triples())
+        self.assertEqual(self.store.get_slice('key03', 'col10', 'col11'),
+                         [('col10', '3.10'), ('col11', '3.11')])
+
+    def test_unsorted(self):
+        shuffled = triples()
+        random.Random(0).shuffle(shuffled)
+        self.store.bulk_load(shuffled)
+        self.assertEqual(list(self.store.export()), triples())
+
+    def test_later_values_win(self):
+        self.store.bulk_load([('a', 'x', '1'), ('a', 'y', '2'),
+                              ('a', 'x', '3'), ('a', 'x', '4')])
+        self.assertEqual(self.store.get_key('a'), [('x', '4'), ('y', '2')])
+
+    def test_merges_with_existing_rows(self):
+        self.store.set('a', 'w', '0')
+        self.store.set('a', 'x', '0')
+        self.store.bulk_load([('a', 'x', '1'), ('a', 'z', '2'),
+                              ('b', 'x', '3')])
+        self.assertEqual(self.store.get_key('a'),
+                         [('w', '0'), ('x', '1'), ('z', '2')])
+        store = self.reloaded()
+        self.assertEqual(list(store.export()), list(self.store.export()))
+        self.assertEqual(store._log_records, 0)
+        store.close()
+
+    def test_snapshot_persistence(self):
+        store = KeyColumnValueStore(persistence=SNAPSHOT)
+        store.bulk_load(triples())
+        self.assertEqual(list(KeyColumnValueStore(path=store.path).export()),
+                         triples())
+        os.remove(store.path)
+
+    def test_not_within_batch(self):
+        with self.store.batch():
+            self.assertRaises(ValueError, self.store.bulk_load, triples())
+
+    def test_lazy_export(self):
+        self.store.lazy = True
+        self.store.bulk_load(triples())
+        self.store.close()
+        store = self.reloaded()
+        store.set('key05', 'col99', 'new')
+        store.delete_key('key06')
+        expected = [t for t in triples() if t[0] != 'key06']
+        expected.insert(expected.index(('key05', 'col29', '5.29')) + 1,
+                        ('key05', 'col99', 'new'))
+        self.assertEqual(list(store.export()), expected)
+        self.assertEqual(dict.__len__(store.kcv), 1)
+        store.close()
+
+    def test_presorted(self):
+        self.store.set('key03', 'col99', 'old')
+        self.store.bulk_load(iter(triples()), presorted=True)
+        expected = triples()
+        expected.insert(expected.index(('key03', 'col29', '3.29')) + 1,
+                        ('key03', 'col99', 'old'))
+        self.assertEqual(list(self.store.export()), expected)
+        self.assertEqual(list(self.reloaded().export()), expected)
+
+    def test_presorted_out_of_order(self):
+        self.assertRaises(ValueError, self.store.bulk_load,
+                          [('b', 'x', '1'), ('a', 'x', '2')], presorted=True)
+        self.assertRaises(ValueError, self.store.bulk_load,
+                          [('a', 'x', '1'), ('b', 'x', '2'), ('a', 'y', '3')],
+                          presorted=True)
+
+    def test_lazy_streams_into_table(self):
+        self.store.lazy = True
+        self.store.bulk_load(triples())
+        self.store.set('key05', 'col99', 'new')
+        self.store.bulk_load(iter(triples(25, 2)), presorted=True)
+        # The rows went straight into the table, without being read.
+        self.assertEqual(dict.__len__(self.store.kcv), 0)
+        expected = sorted(set(triples()) - set(triples(20, 2)) |
+                          set(triples(25, 2)) | set([('key05', 'col99',
+                                                      'new')]))
+        self.assertEqual(list(self.store.export()), expected)
+        self.assertEqual(self.store.size_stats(),
+                         {'keys': 25, 'columns': len(expected)})
+        self.store.close()
+        self.assertEqual(list(self.reloaded().export()), expected)
+
+    def test_waits_for_background_checkpoint(self):
+        # The checkpoint's snapshot, of the store before the second load,
+        # mustn't be swapped in over the file the second load wrote.
+        self.store.bulk_load(triples(200, 300))
+        self.store.set('a', 'x', '1')
+        self.store.checkpoint(background=True)
+        self.store.bulk_load([('new', 'col', 'val')])
+        self.store.close()
+        store = self.reloaded()
+        self.assertEqual(store.get('new', 'col'), 'val')
+        self.assertEqual(store.get('a', 'x'), '1')
+        store.close()
+
+    def test_lsm_waits_for_background_checkpoint(self):
+        store = LSMKeyColumnValueStore()
+        store.bulk_load(triples(200, 300))
+        store.set('a', 'x', '1')
+        store.checkpoint(background=True)
+        store.bulk_load([('new', 'col', 'val')])
+        store.close()
+        store = LSMKeyColumnValueStore(path=store.directory)
+        self.assertEqual(store.get('new', 'col'), 'val')
+        self.assertEqual(store.get('a', 'x'), '1')
+        store.close()
+        shutil.rmtree(store.directory)
+
+    def test_lsm(self):
+        store = LSMKeyColumnValueStore()
+        store.set('key00', 'col00', 'old')
+        store.bulk_load(triples(), chunk_triples=100)
+        self.assertEqual(list(store.export()), triples())
+        # The memtable's segment, and one for the whole load.
+        self.assertEqual([(level.first, level.last) for level in store.levels],
+                         [(2, 7), (1, 1)])
+        store.close()
+        shutil.rmtree(store.directory)
+
+    def test_lsm_presorted(self):
+        store = LSMKeyColumnValueStore()
+        store.set('key05', 'col99', 'new')
+        store.delete_key('key06')
+        store.bulk_load(iter(triples()), presorted=True)
+        store.bulk_load([], presorted=True)
+        self.assertEqual(len(store.levels), 2)
+        self.assertEqual(store.get('key05', 'col99'), 'new')
+        store.close()
+        store = LSMKeyColumnValueStore(store.directory)
+        self.assertEqual(list(store.export()), sorted(
+            triples() + [('key05', 'col99', 'new')]))
+        store.close()
+        shutil.rmtree(store.directory)
+
+
+class ShardedBulkLoadTests(unittest.TestCase):
+    def setUp(self):
+        self.store = ShardedKeyColumnValueStore(shards=4)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+    def test_round_trip(self):
+        self.store.set('key00', 'col99', 'old')
+        self.store.bulk_load(iter(triples()), presorted=True)
+        expected = sorted(triples() + [('key00', 'col99', 'old')])
+        self.assertEqual(list(self.store.export()), expected)
+        shuffled = triples(30, 3)
+        random.Random(0).shuffle(shuffled)
+        self.store.bulk_load(shuffled)
+        self.assertEqual(list(self.store.export()),
+                         sorted(set(expected) - set(triples(20, 3)) |
+                                set(shuffled)))
+
+    def test_error(self):
+        self.assertRaises(ValueError, self.store.bulk_load,
+                          reversed(triples()), presorted=True)
+
+
+class FormatTests(unittest.TestCase):
+    def round_trip(self, write, read):
+        data = [('a', 'b', 'c'), (u'\xe9', 'x,y', 'line\nbreak "quoted"')]
+        f = StringIO()
+        write(f, data)
+        f.seek(0)
+        return list(read(f))
+
+    def test_jsonl(self):
+        self.assertEqual(self.round_trip(write_jsonl, read_jsonl),
+                         [('a', 'b', 'c'),
+                          (u'\xe9', 'x,y', 'line\nbreak "quoted"')])
+        self.assertEqual(list(read_jsonl(StringIO('["a", "b", "c"]\n\n'))),
+                         [('a', 'b', 'c')])
+
+    def test_csv(self):
+        self.assertEqual(self.round_trip(write_csv, read_csv),
+                         [('a', 'b', 'c'),
+                          ('\xc3\xa9', 'x,y', 'line\nbreak "quoted"')])
+        self.assertEqual(list(read_csv(StringIO('a,b,c\r\n'))),
+                         [('a', 'b', 'c')])
+
+
+class CLITests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_import_then_export(self):
+        with open(self.path('in.csv'), 'wb') as f:
+            write_csv(f, triples())
+        for fmt in ('csv', 'jsonl'):
+            self.assertEqual(main(['import', self.path('store'),
+                                   self.path('in.csv'), '--format', 'csv']),
+                             0)
+            main(['export', self.path('store'), self.path('out.' + fmt),
+                  '--format', fmt])
+            with open(self.path('out.' + fmt), 'rb') as f:
+                read = read_csv if fmt == 'csv' else read_jsonl
+                self.assertEqual(list(read(f)), triples())
+
+    def test_import_sorted(self):
+        with open(self.path('in.jsonl'), 'wb') as f:
+            write_jsonl(f, triples())
+        self.assertEqual(main(['import', self.path('store'),
+                               self.path('in.jsonl'), '--sorted']), 0)
+        store = KeyColumnValueStore(self.path('store'))
+        self.assertEqual(list(store.export()), triples())
+        store.close()
@@ -0,0 +1,112 @@
+import os
+import slice_tests
+import spec_tests
+import unittest
+from kcvstore import KeyColumnValueStore
+
+
+class CachedLevelOneSpecTests(spec_tests.LevelOneSpecTests):
+    def setUp(self):
+        spec_tests.LevelOneSpecTests.setUp(self)
+        self.store.close()
+        self.store = KeyColumnValueStore(path=self.store.path,
+                                         cache_entries=100)
+
+
+class CachedSliceTests(slice_tests.SliceTests):
+    def setUp(self):
+        slice_tests.SliceTests.setUp(self)
+        self.store.close()
+        self.store = KeyColumnValueStore(path=self.store.path,
+                                         cache_entries=100)
+
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore(cache_entries=3)
+        for key in 'abcd':
+            for col in 'xyz':
+                self.store.set(key, col, key + col)
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def test_hits_and_misses(self):
+        stats = self.store.cache_stats
+        self.assertEqual(self.store.get_key('a'),
+                         [('x', 'ax'), ('y', 'ay'), ('z', 'az')])
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(self.store.get_slice('a', None, None),
+                         [('x', 'ax'), ('y', 'ay'), ('z', 'az')])
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['entries'], 1)
+        self.assertTrue(stats['bytes'] > 0)
+
+    def test_results_are_copies(self):
+        self.store.get_key('a').append(('q', 'aq'))
+        self.assertEqual(len(self.store.get_key('a')), 3)
+
+    def test_invalidation_is_per_key(self):
+        stats = self.store.cache_stats
+        self.store.get_key('a')
+        self.store.get_slice('a', 'y', None)
+        self.store.get_key('b')
+        self.store.set('a', 'w', 'aw')
+        self.assertEqual(stats['invalidations'], 2)
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(self.store.get_slice('a', None, 'x'),
+                         [('w', 'aw'), ('x', 'ax')])
+        self.store.delete('a', 'w')
+        self.assertEqual(self.store.get_slice('a', None, 'x'), [('x', 'ax')])
+        self.store.delete_key('a')
+        self.assertEqual(self.store.get_key('a'), [])
+        self.store.get_key('b')
+        self.assertEqual(stats['hits'], 1)
+
+    def test_failed_batch_invalidates(self):
+        self.store.get_key('a')
+        with self.assertRaises(RuntimeError):
+            with self.store.batch():
+                self.store.set('a', 'x', 'new')
+                self.assertEqual(self.store.get('a', 'x'), 'new')
+                self.assertEqual(self.store.get_key('a')[0], ('x', 'new'))
+                raise RuntimeError
+        self.assertEqual(self.store.get_key('a')[0], ('x', 'ax'))
+
+    def test_evicts_least_recently_used(self):
+        stats = self.store.cache_stats
+        for key in 'abc':
+            self.store.get_key(key)
+        self.store.get_key('a')
+        self.store.get_key('d')  # evicts b
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['entries'], 3)
+        hits = stats['hits']
+        self.store.get_key('a')
+        self.store.get_key('b')
+        self.assertEqual(stats['hits'], hits + 1)
+
+    def test_byte_bound(self):
+        store = KeyColumnValueStore(path=self.store.path, cache_bytes=1000)
+        for key in 'abcd':
+            store.get_key(key)
+        self.assertTrue(store.cache_stats['bytes'] <= 1000)
+        self.assertTrue(store.cache_stats['evictions'] > 0)
+        store.close()
+
+
+class ConcurrentResultCacheTests(ResultCacheTests):
+    def setUp(self):
+        ResultCacheTests.setUp(self)
+        self.store.close()
+        self.store = KeyColumnValueStore(path=self.store.path,
+                                         cache_entries=3, concurrent=True)
+
+    def test_batch_invalidates_when_published(self):
+        self.store.get_key('a')
+        with self.store.batch():
+            self.store.set('a', 'x', 'new')
+            self.assertEqual(self.store.get_key('a')[0], ('x', 'new'))
+            self.assertEqual(self.store.cache_stats['invalidations'], 0)
+        self.assertEqual(self.store.get_key('a')[0], ('x', 'new'))
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+import unittest
+from kcvstore import ChangesLost, KeyColumnValueStore
+
+
+class ChangeFeedTests(unittest.TestCase):
+    options = {}
+
+    def setUp(self):
+        self.store = KeyColumnValueStore(change_feed=5, **self.options)
+        self.seq, changes = self.store.changes_since()
+        self.assertEqual(changes, [])
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def changes(self, seq=None, **kwargs):
+        """Returns the changes since seq (by default, since setUp), without
+        their sequence numbers."""
+        seq, changes = self.store.changes_since(
+            self.seq if seq is None else seq, **kwargs)
+        return [change[1:] for change in changes]
+
+    def test_changes(self):
+        self.store.set('a', 'x', '1')
+        self.store.delete('a', 'x')
+        self.store.delete('a', 'x')  # doesn't change anything
+        self.store.delete_key('b')  # nor does this
+        self.store.set('b', 'y', '2')
+        self.store.delete_key('b')
+        self.assertEqual(self.changes(), [('set', 'a', 'x', '1'),
+                                          ('delete', 'a', 'x'),
+                                          ('set', 'b', 'y', '2'),
+                                          ('delete_key', 'b')])
+
+    def test_sequence_numbers(self):
+        self.store.set('a', 'x', '1')
+        self.store.set('a', 'x', '2')
+        seq, changes = self.store.changes_since(self.seq)
+        self.assertEqual([change[0] for change in changes],
+                         [self.seq + 1, self.seq + 2])
+        self.assertEqual(seq, self.seq + 2)
+        self.assertEqual(self.store.changes_since(seq), (seq, []))
+        self.assertEqual(self.changes(limit=1), [('set', 'a', 'x', '1')])
+        self.assertEqual(self.changes(self.seq + 1),
+                         [('set', 'a', 'x', '2')])
+
+    def test_batches(self):
+        with self.store.batch():
+            self.store.set('a', 'x', '1')
+            self.store.set('b', 'x', '2')
+            self.assertEqual(self.changes(), [])
+        try:
+            with self.store.batch():
+                self.store.set('c', 'x', '3')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.changes(), [('set', 'a', 'x', '1'),
+                                          ('set', 'b', 'x', '2')])
+
+    def test_bounded(self):
+        for i in xrange(7):
+            self.store.set('a', 'x', str(i))
+        self.assertRaises(ChangesLost, self.store.changes_since, self.seq)
+        self.assertRaises(ChangesLost, self.store.changes_since,
+                          self.seq + 1)
+        self.assertEqual(len(self.changes(self.seq + 2)), 5)
+        self.assertRaises(ChangesLost, self.store.changes_since,
+                          self.seq + 8)
+
+    def test_bulk_load_loses_changes(self):
+        self.store.bulk_load([('a', 'x', '1')])
+        self.assertRaises(ChangesLost, self.store.changes_since, self.seq)
+        seq, changes = self.store.changes_since()
+        self.store.set('a', 'x', '2')
+        self.assertEqual(self.changes(seq), [('set', 'a', 'x', '2')])
+
+    def test_restart(self):
+        self.store.set('a', 'x', '1')
+        seq, changes = self.store.changes_since(self.seq)
+        self.store.close()
+        self.store = KeyColumnValueStore(self.store.path, change_feed=5,
+                                         **self.options)
+        self.assertRaises(ChangesLost, self.store.changes_since, seq)
+        self.assertTrue(self.store.changes_since()[0] > seq)
+
+    def test_long_poll(self):
+        start = time.time()
+        self.assertEqual(self.changes(timeout=0.05), [])
+        self.assertTrue(time.time() - start >= 0.05)
+        timer = threading.Timer(0.05, self.store.set, ('a', 'x', '1'))
+        timer.start()
+        self.assertEqual(self.changes(timeout=10), [('set', 'a', 'x', '1')])
+        timer.join()
+
+    def test_no_feed(self):
+        store = KeyColumnValueStore()
+        self.assertRaises(ValueError, store.changes_since)
+        os.remove(store.path)
+
+
+class ConcurrentChangeFeedTests(ChangeFeedTests):
+    options = {'concurrent': True}
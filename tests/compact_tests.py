@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import cPickle as pickle
+import os
+import slice_tests
+import spec_tests
+import unittest
+from blist import sorteddict
+from kcvstore import KeyColumnValueStore, _FrozenRow
+
+
+class FrozenLevelOneSpecTests(spec_tests.LevelOneSpecTests):
+    def setUp(self):
+        spec_tests.LevelOneSpecTests.setUp(self)
+        self.store.close()
+        self.store = KeyColumnValueStore(path=self.store.path, hot_rows=0)
+
+
+class FrozenSliceTests(slice_tests.SliceTests):
+    def setUp(self):
+        slice_tests.SliceTests.setUp(self)
+        self.store.close()
+        self.store = KeyColumnValueStore(path=self.store.path, hot_rows=0)
+
+
+class FrozenIterSliceTests(slice_tests.IterSliceTests):
+    def setUp(self):
+        slice_tests.IterSliceTests.setUp(self)
+        self.store.close()
+        self.store = KeyColumnValueStore(path=self.store.path, hot_rows=0)
+
+    def test_lazy(self):
+        # A frozen row is never changed, only replaced, so a slice of one
+        # carries on as it was.
+        slice = self.store.iter_slice('lowercase', None, None)
+        self.assertEqual(next(slice), ('a', 'val'))
+        self.store.delete('lowercase', 'b')
+        self.assertEqual(next(slice), ('b', 'val'))
+        self.assertEqual(self.cols('a', 'c'), 'ac')
+
+
+class FrozenRowTests(unittest.TestCase):
+    pairs = [('a', '1'), ('b', ''), ('c', '333')]
+
+    def test_reads(self):
+        cv = _FrozenRow(self.pairs)
+        self.assertEqual(cv.items(), self.pairs)
+        self.assertEqual(len(cv), 3)
+        self.assertEqual([cv.get(c) for c in 'abcd'], ['1', '', '333', None])
+        self.assertEqual(cv['c'], '333')
+        self.assertRaises(KeyError, cv.__getitem__, 'd')
+        self.assertTrue('b' in cv)
+        self.assertFalse('bb' in cv)
+        cols = cv.keys()
+        self.assertEqual((cols.bisect_left('b'), cols.bisect_right('b')),
+                         (1, 2))
+        self.assertTrue(None not in cols)
+
+    def test_unicode_values(self):
+        pairs = [('a', u'\xe9'), ('b', 'x')]
+        cv = _FrozenRow(pairs)
+        self.assertEqual(cv.items(), pairs)
+        self.assertEqual(cv.get('a'), u'\xe9')
+
+    def test_interned_columns(self):
+        col = ''.join(['co', 'l'])
+        self.assertTrue(_FrozenRow([(col, 'v')]).keys()[0] is intern('col'))
+
+    def test_thaw_and_pickle(self):
+        cv = _FrozenRow(self.pairs)
+        thawed = cv.thaw()
+        self.assertTrue(isinstance(thawed, sorteddict))
+        self.assertEqual(thawed.items(), self.pairs)
+        copy = pickle.loads(pickle.dumps(cv, pickle.HIGHEST_PROTOCOL))
+        self.assertTrue(isinstance(copy, _FrozenRow))
+        self.assertEqual(copy.items(), self.pairs)
+
+
+class HotRowsTests(unittest.TestCase):
+    options = {}
+
+    def setUp(self):
+        self.store = KeyColumnValueStore(hot_rows=2, **self.options)
+        for key in 'abcde':
+            for col in 'xyz':
+                self.store.set(key, col, key + col)
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def frozen(self):
+        return ''.join(sorted(key for key in self.store.get_keys()
+                              if isinstance(self.store.kcv.get(key),
+                                            _FrozenRow)))
+
+    def test_only_hot_rows_are_mutable(self):
+        self.assertEqual(self.frozen(), 'abc')
+        self.assertEqual(self.store.get_key('a'),
+                         [('x', 'ax'), ('y', 'ay'), ('z', 'az')])
+        self.assertEqual(self.store.get('b', 'y'), 'by')
+        self.assertEqual(self.store.get_slice('c', 'y', None),
+                         [('y', 'cy'), ('z', 'cz')])
+
+    def test_writes_thaw(self):
+        self.store.set('a', 'w', 'aw')
+        self.store.delete('b', 'x')
+        self.assertEqual(self.frozen(), 'cde')
+        self.assertEqual(self.store.get_key('a'),
+                         [('w', 'aw'), ('x', 'ax'), ('y', 'ay'),
+                          ('z', 'az')])
+        self.assertEqual(self.store.get_key('b'), [('y', 'by'), ('z', 'bz')])
+        self.store.delete_key('c')
+        self.assertEqual(self.store.get_key('c'), [])
+
+    def test_no_op_delete_doesnt_thaw(self):
+        self.store.delete('a', 'w')
+        self.assertEqual(self.frozen(), 'abc')
+
+    def test_batch_rollback(self):
+        try:
+            with self.store.batch():
+                self.store.set('a', 'x', 'changed')
+                self.store.delete('b', 'y')
+                self.store.delete_key('c')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        for key in 'abc':
+            self.assertEqual(self.store.get_key(key),
+                             [(col, key + col) for col in 'xyz'])
+
+    def test_reload(self):
+        self.store.close()
+        store = KeyColumnValueStore(path=self.store.path, hot_rows=2)
+        self.assertEqual(store.get_key('e'),
+                         [('x', 'ex'), ('y', 'ey'), ('z', 'ez')])
+        self.assertTrue(isinstance(store.kcv['a'], _FrozenRow))
+        self.assertFalse(isinstance(store.kcv['e'], _FrozenRow))
+        store.checkpoint()
+        store.close()
+        store = KeyColumnValueStore(path=self.store.path)
+        self.assertEqual(store.get_key('a'),
+                         [('x', 'ax'), ('y', 'ay'), ('z', 'az')])
+        store.set('a', 'x', 'thawed')
+        self.assertEqual(store.get('a', 'x'), 'thawed')
+        store.close()
+
+    def test_bulk_load(self):
+        self.store.bulk_load([('f', 'x', 'fx'), ('a', 'w', 'aw')])
+        self.assertEqual(self.frozen(), 'abcf')
+        self.assertEqual(self.store.get_key('a')[0], ('w', 'aw'))
+
+
+class ConcurrentHotRowsTests(HotRowsTests):
+    options = {'concurrent': True}
+
+
+class LazyHotRowsTests(unittest.TestCase):
+    def test_rows_are_read_frozen(self):
+        store = KeyColumnValueStore(lazy=True)
+        store.set_many([('a', 'x', 'ax'), ('b', 'x', 'bx')])
+        store.checkpoint()
+        store.close()
+        store = KeyColumnValueStore(path=store.path, hot_rows=1)
+        self.assertEqual(store.get_key('a'), [('x', 'ax')])
+        self.assertTrue(isinstance(dict.get(store.kcv, 'a'), _FrozenRow))
+        store.set('b', 'y', 'by')
+        self.assertEqual(store.get_key('b'), [('x', 'bx'), ('y', 'by')])
+        store.checkpoint()
+        store.close()
+        store = KeyColumnValueStore(path=store.path)
+        self.assertEqual(store.get_key('b'), [('x', 'bx'), ('y', 'by')])
+        store.close()
+        os.remove(store.path)
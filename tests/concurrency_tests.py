@@ -0,0 +1,114 @@
+import batch_tests
+import os
+import slice_tests
+import spec_tests
+import string
+import threading
+import unittest
+from kcvstore import KeyColumnValueStore
+
+
+def reopen_concurrently(store):
+    """Closes the store and returns a concurrent store that reads it back."""
+    store.close()
+    return KeyColumnValueStore(path=store.path, concurrent=True)
+
+
+class ConcurrentLevelOneSpecTests(spec_tests.LevelOneSpecTests):
+    def setUp(self):
+        spec_tests.LevelOneSpecTests.setUp(self)
+        self.store = reopen_concurrently(self.store)
+
+
+class ConcurrentLevelTwoSpecTests(spec_tests.LevelTwoSpecTests):
+    def setUp(self):
+        spec_tests.LevelTwoSpecTests.setUp(self)
+        self.store = reopen_concurrently(self.store)
+
+
+class ConcurrentSliceTests(slice_tests.SliceTests):
+    def setUp(self):
+        slice_tests.SliceTests.setUp(self)
+        self.store = reopen_concurrently(self.store)
+
+
+class ConcurrentBatchTests(batch_tests.BatchTests):
+    def setUp(self):
+        self.store = KeyColumnValueStore(concurrent=True)
+        self.store.set('key', 'a', 'val')
+
+
+class SnapshotReadTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore(concurrent=True)
+        for col in string.ascii_lowercase:
+            self.store.set('row', col, '0')
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def test_slice_sees_row_as_of_call(self):
+        columns = self.store.iter_slice('row', None, None)
+        self.store.set('row', 'b', '1')
+        self.store.delete('row', 'c')
+        self.store.delete_key('row')
+        self.assertEqual(list(columns),
+                         [(c, '0') for c in string.ascii_lowercase])
+        self.assertEqual(self.store.get_key('row'), [])
+
+    def test_batch_is_invisible_until_done(self):
+        seen = []
+        reader = lambda: seen.append((self.store.get('row', 'a'),
+                                      self.store.get_keys()))
+        with self.store.batch():
+            self.store.set('row', 'a', '1')
+            self.store.set('new', 'a', '1')
+            thread = threading.Thread(target=reader)
+            thread.start()
+            thread.join()
+            # ...but the batch sees its own writes
+            self.assertEqual(self.store.get('row', 'a'), '1')
+            self.assertEqual(self.store.get_keys(), set(['row', 'new']))
+        reader()
+        self.assertEqual(seen, [('0', set(['row'])),
+                                ('1', set(['row', 'new']))])
+
+    def test_failed_batch_changes_nothing(self):
+        row = self.store.get_key('row')
+        with self.assertRaises(RuntimeError):
+            with self.store.batch():
+                self.store.set('row', 'a', '1')
+                self.store.delete_key('row')
+                raise RuntimeError
+        self.assertEqual(self.store.get_key('row'), row)
+
+    def test_readers_never_see_half_a_batch(self):
+        done = threading.Event()
+        torn = []
+
+        def write():
+            for i in xrange(1, 200):
+                self.store.set_many([('row', c, str(i))
+                                     for c in string.ascii_lowercase] +
+                                    [('other', 'a', str(i))])
+            done.set()
+
+        def read():
+            while not done.is_set():
+                values = set(val for col, val in
+                             self.store.get_slice('row', None, None))
+                if len(values) > 1:
+                    torn.append(values)
+                values = self.store.multi_get([('row', 'z'), ('other', 'a')])
+                if values[1] is not None and values[0] != values[1]:
+                    torn.append(values)
+
+        threads = [threading.Thread(target=read) for i in xrange(4)]
+        threads.append(threading.Thread(target=write))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(torn, [])
+        self.assertEqual(self.store.get('row', 'q'), '199')
@@ -0,0 +1,113 @@
+import kcvtable
+import os
+import shutil
+import string
+import unittest
+from kcvlsm import LSMKeyColumnValueStore
+from kcvstore import KeyColumnValueStore
+from tempfile import NamedTemporaryFile
+
+
+class TableTests(unittest.TestCase):
+    def setUp(self):
+        with NamedTemporaryFile(delete=False) as f:
+            self.path = f.name
+            blocks = []
+            for i in range(1000):
+                key = 'key%04d' % i
+                pairs = [(c, key + c) for c in string.ascii_lowercase]
+                items = [kcvtable.column_item(key, c) for c, v in pairs]
+                blocks.append((key, kcvtable.encode_block(pairs), items))
+            kcvtable.write_table(f, blocks)
+        self.table = kcvtable.Table(self.path)
+
+    def tearDown(self):
+        self.table.close()
+        os.remove(self.path)
+
+    def test_finds_every_key(self):
+        for i in range(1000):
+            key = 'key%04d' % i
+            self.assertTrue(key in self.table)
+            self.assertEqual(self.table.get(key)[0], ('a', key + 'a'))
+        self.assertEqual(self.table.stats['misses'], 0)
+        self.assertEqual(self.table.stats['false_positives'], 0)
+
+    def test_filter_rules_out_missing_keys(self):
+        for i in range(1000):
+            self.assertEqual(self.table.get('nokey%04d' % i), None)
+        stats = self.table.stats
+        self.assertEqual(stats['misses'] + stats['false_positives'], 1000)
+        self.assertTrue(stats['false_positives'] < 50)
+
+    def test_filter_holds_columns(self):
+        may_contain = self.table.may_contain
+        self.assertTrue(may_contain(kcvtable.column_item('key0042', 'q')))
+        false_positives = sum(
+            may_contain(kcvtable.column_item('key%04d' % i, 'A'))
+            for i in range(1000))
+        self.assertTrue(false_positives < 50)
+
+    def test_sparse_index(self):
+        self.assertEqual(len(self.table.sparse), 16)
+        self.assertEqual(self.table.sparse[1], 'key%04d' % 64)
+        self.assertEqual(self.table.get('key0000')[-1], ('z', 'key0000z'))
+        self.assertEqual(self.table.get('key0999')[-1], ('z', 'key0999z'))
+        self.assertEqual(self.table.get('a'), None)
+        self.assertEqual(self.table.get('z'), None)
+
+
+class LazyStoreFilterTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore(lazy=True)
+        for key in string.ascii_lowercase:
+            self.store.set(key, 'col', 'val')
+        self.store.checkpoint()
+        self.store.close()
+        self.store = KeyColumnValueStore(path=self.store.path)
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def test_missing_lookups_skip_reading_rows(self):
+        for key in string.ascii_uppercase:
+            self.assertEqual(self.store.get(key, 'col'), None)
+            self.assertEqual(self.store.get_key(key), [])
+            self.assertEqual(self.store.get_slice(key, None, None), [])
+        for key in string.ascii_lowercase:
+            self.assertEqual(self.store.get(key, 'other'), None)
+        stats = self.store.filter_stats
+        self.assertTrue(stats['misses'] > 0)
+        self.assertEqual(stats['hits'], stats['false_positives'])
+        self.assertEqual(dict.__len__(self.store.kcv),
+                         stats['false_positives'])
+
+    def test_hits(self):
+        self.assertEqual(self.store.get('a', 'col'), 'val')
+        self.assertEqual(self.store.filter_stats['hits'], 2)
+
+
+class LSMFilterTests(unittest.TestCase):
+    def setUp(self):
+        self.store = LSMKeyColumnValueStore(max_segments=100)
+        for key in string.ascii_lowercase:
+            self.store.set(key, 'col', 'val')
+            self.store.checkpoint()
+        self.store.delete_key('a')
+        self.store.checkpoint()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+    def test_missing_lookups_skip_segments(self):
+        self.assertEqual(self.store.get('z', 'other'), None)
+        self.assertEqual(self.store.get('nokey', 'col'), None)
+        stats = self.store.filter_stats
+        self.assertTrue(stats['misses'] > 50)
+        self.assertTrue(stats['false_positives'] < 5)
+
+    def test_cleared_keys_hide_older_segments(self):
+        self.assertEqual(self.store.get('a', 'col'), None)
+        self.assertEqual(self.store.get('b', 'col'), 'val')
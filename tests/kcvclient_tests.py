@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+import unittest
+from asynckcv import Server
+from kcvclient import ClientError, HTTPClient
+from kcvstore import KeyColumnValueStore
+
+
+class HTTPClientTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore(concurrent=True, change_feed=10)
+        self.start_server()
+        self.client = HTTPClient(*self.server.address, pool_size=4)
+
+    def start_server(self, port=0):
+        self.server = Server(self.store, port=port, workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def stop_server(self):
+        self.server.shutdown()
+        self.thread.join()
+
+    def tearDown(self):
+        self.client.close()
+        self.stop_server()
+        self.store.close()
+        os.remove(self.store.path)
+
+    def test_mirrors_store(self):
+        client = self.client
+        client.set('a', 'x', '1')
+        client.set('a', 'y/z', '2')
+        client.set_many([('b', 'x', '3'), (u'\xe9', 'x', '4')])
+        self.assertEqual(client.get('a', 'y/z'), '2')
+        self.assertEqual(client.get('a', 'q'), None)
+        self.assertEqual(client.get(u'\xe9', 'x'), '4')
+        self.assertEqual(client.get_key('a'), [('x', '1'), ('y/z', '2')])
+        self.assertEqual(client.get_slice('a', 'y/z', None), [('y/z', '2')])
+        self.assertEqual(client.get_keys(), set(['a', 'b', u'\xe9']))
+        self.assertEqual(client.multi_get([('a', 'x'), ('b', 'x')]),
+                         ['1', '3'])
+        self.assertEqual(client.multi_get_slice(['a', 'b'], 'x', 'x'),
+                         [[('x', '1')], [('x', '3')]])
+        client.delete('a', 'x')
+        client.delete_key('b')
+        self.assertEqual(self.store.get_key('a'), [('y/z', '2')])
+        client.delete('a', 'y/z')
+        self.assertEqual(self.store.get_key('a'), [])
+        self.assertEqual(self.store.get_keys(), set(['a', u'\xe9']))
+
+    def test_iter_keys(self):
+        self.store.set_many((key, 'x', '1') for key in 'abcdefg')
+        client = self.client
+        self.assertEqual(list(client.iter_keys(page_size=3)), list('abcdefg'))
+        self.assertEqual(list(client.iter_keys('b', 'f', limit=4,
+                                               page_size=3)), list('bcde'))
+        self.assertEqual(list(client.iter_keys(after='e', page_size=2)),
+                         list('fg'))
+        self.assertEqual(client.count_keys(), 7)
+
+    def test_changes_since(self):
+        seq, changes = self.client.changes_since()
+        self.client.set('a', 'x', '1')
+        self.client.delete('a', 'x')
+        self.assertEqual(self.client.changes_since(seq, timeout=1), (
+            seq + 2, [[seq + 1, 'set', 'a', 'x', '1'],
+                      [seq + 2, 'delete', 'a', 'x']]))
+        self.assertEqual(self.client.changes_since(seq, limit=1)[0], seq + 1)
+        try:
+            self.client.changes_since(seq - 1)
+        except ClientError as e:
+            self.assertEqual(e.status, 410)
+        else:
+            self.fail('lost changes should raise')
+
+    def test_polls_dont_hold_up_writes(self):
+        # More polls than pooled connections, and a write that ends them.
+        seq = self.client.changes_since()[0]
+        results = []
+
+        def poll():
+            results.append(self.client.changes_since(seq, timeout=3))
+
+        polls = [threading.Thread(target=poll) for i in xrange(6)]
+        for thread in polls:
+            thread.start()
+        deadline = time.time() + 5
+        while len(self.server._polls) < 6 and time.time() < deadline:
+            time.sleep(0.01)
+        start = time.time()
+        self.client.set('a', 'x', '1')
+        self.assertTrue(time.time() - start < 1)
+        for thread in polls:
+            thread.join()
+        self.assertEqual(results,
+                         [(seq + 1, [[seq + 1, 'set', 'a', 'x', '1']])] * 6)
+
+    def test_updates(self):
+        client = self.client
+        self.assertEqual(client.increment('a', 'n'), 1)
+        self.assertEqual(client.increment('a', 'n', 2), 3)
+        self.assertTrue(client.compare_and_set('a', 'n', '3', '4'))
+        self.assertFalse(client.compare_and_set('a', 'n', '3', '5'))
+        client.append('a', 'n', '2')
+        self.assertEqual(self.store.get('a', 'n'), '42')
+        self.assertTrue(client.compare_and_set('a', 'n', '42', None))
+        self.assertEqual(self.store.get_key('a'), [])
+        self.assertRaises(ClientError, client.increment, 'a', 'n', 0.5)
+
+    def test_prefixes_and_counts(self):
+        self.store.set_many(('a', col, '1') for col in ['p:1', 'p:2', 'q:1'])
+        client = self.client
+        self.assertEqual(client.get_prefix('a', 'p:'),
+                         [('p:1', '1'), ('p:2', '1')])
+        self.assertEqual(client.count_prefix('a', 'p:'), 2)
+        self.assertEqual(client.count_slice('a', 'p:2', None), 2)
+        self.assertEqual(client.count_columns('a'), 3)
+        self.assertEqual(client.count_columns('b'), 0)
+
+    def test_errors(self):
+        self.assertRaises(ClientError, self.client.set_many, [['a', 'b']])
+
+    def test_concurrent_calls_are_coalesced(self):
+        requests = []
+        original = self.client._request
+
+        def request(method, path, *args, **kwargs):
+            requests.append(path)
+            return original(method, path, *args, **kwargs)
+
+        self.client._request = request
+        results = {}
+
+        def work(i):
+            for j in xrange(20):
+                col = '%02d-%02d' % (i, j)
+                self.client.set('key', col, col)
+                results[col] = self.client.get('key', col)
+
+        threads = [threading.Thread(target=work, args=(i,))
+                   for i in xrange(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 200)
+        self.assertTrue(all(col == val for col, val in results.items()))
+        self.assertEqual(len(self.store.get_key('key')), 200)
+        self.assertTrue(len(requests) < 400)
+
+    def test_reads_are_retried(self):
+        self.client.set('a', 'b', 'c')
+        port = self.server.address[1]
+        self.stop_server()
+        self.start_server(port)
+        # The pooled connection is now dead, so the read needs a retry.
+        self.assertEqual(self.client.get_key('a'), [('b', 'c')])
@@ -0,0 +1,94 @@
+import os
+import threading
+import unittest
+from kcvproto import Client, ProtocolError, Server
+from kcvproto import decode_fields, encode_fields
+from kcvstore import KeyColumnValueStore
+
+
+class EncodingTests(unittest.TestCase):
+    def test_round_trip(self):
+        fields = ['key', '', None, u'\xe9', 'x' * 1000]
+        self.assertEqual(decode_fields(encode_fields(fields)),
+                         [u'key', u'', None, u'\xe9', u'x' * 1000])
+        self.assertTrue(all(isinstance(field, unicode) for field in
+                            decode_fields(encode_fields(['a', u'\xe9']))))
+
+    def test_not_utf8(self):
+        self.assertRaises(ValueError, decode_fields, encode_fields(['\xff']))
+
+    def test_truncated(self):
+        self.assertRaises(ValueError, decode_fields,
+                          encode_fields(['abc'])[:-1])
+
+
+class ProtocolTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore(concurrent=True)
+        self.server = Server(self.store, port=0, workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = Client(*self.server.address)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.store.close()
+        os.remove(self.store.path)
+
+    def test_calls(self):
+        client = self.client
+        self.assertEqual(client.set('a', 'x', '1'), None)
+        client.set_many([('a', 'y', '2'), ('a', 'z', '3'), ('b', 'x', '4')])
+        self.assertEqual(client.get('a', 'y'), '2')
+        self.assertEqual(client.get('a', 'q'), None)
+        self.assertEqual(client.get_key('a'),
+                         [('x', '1'), ('y', '2'), ('z', '3')])
+        self.assertEqual(client.get_slice('a', 'y', None),
+                         [('y', '2'), ('z', '3')])
+        self.assertEqual(client.get_keys(), set(['a', 'b']))
+        self.assertEqual(client.multi_get([('a', 'x'), ('b', 'y')]),
+                         ['1', None])
+        client.delete('a', 'x')
+        client.delete_key('b')
+        client.delete_many([('a', 'z')])
+        self.assertEqual(self.store.get_key('a'), [('y', '2')])
+        self.assertEqual(self.store.get_keys(), set(['a']))
+
+    def test_non_ascii(self):
+        # Strings written over HTTP are unicode, and both have to match.
+        self.store.set(u'caf\xe9', u'x', u'1')
+        self.assertEqual(self.client.get(u'caf\xe9', 'x'), u'1')
+        self.client.set(u'na\xefve', u'\xe9', u'\u2603')
+        self.assertEqual(self.store.get(u'na\xefve', u'\xe9'), u'\u2603')
+        self.assertEqual(self.client.get_keys(),
+                         set([u'caf\xe9', u'na\xefve']))
+        self.assertRaises(ProtocolError, self.client.get, '\xff', 'x')
+        self.assertEqual(self.client.get(u'caf\xe9', 'x'), u'1')
+
+    def test_errors(self):
+        self.assertRaises(ProtocolError, self.client._call, 99, [], list)
+        self.assertRaises(ProtocolError, self.client._call, 1, ['a'], list)
+        self.assertRaises(ProtocolError, self.client.set, 'a', 'b', None)
+        # ...and the connection is still good.
+        self.assertEqual(self.client.get('a', 'b'), None)
+
+    def test_pipeline(self):
+        pipeline = self.client.pipeline()
+        for i in xrange(1000):
+            pipeline.set('key', '%04d' % i, str(i))
+        pipeline.get('key', '0500')
+        pipeline.get_slice('key', '0998', None)
+        results = pipeline.execute()
+        self.assertEqual(results[:1000], [None] * 1000)
+        self.assertEqual(results[1000:], [
+            '500', [('0998', '998'), ('0999', '999')]])
+
+    def test_pipeline_error(self):
+        pipeline = self.client.pipeline()
+        pipeline.set('a', 'b', 'c')
+        pipeline.set('a', 'b', None)
+        pipeline.get('a', 'b')
+        self.assertRaises(ProtocolError, pipeline.execute)
+        self.assertEqual(self.client.get('a', 'b'), 'c')
@@ -0,0 +1,148 @@
+import os
+import shutil
+import unittest
+from kcvlsm import LSMKeyColumnValueStore
+from kcvshard import ShardedKeyColumnValueStore
+from kcvstore import KeyColumnValueStore
+
+
+class KeyIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.store = self.open_store()
+        self.store.set_many((key, 'col', 'val') for key in 'abcdefghij')
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def open_store(self, path=None):
+        return KeyColumnValueStore(path=path)
+
+    def reopen(self):
+        self.store.close()
+        self.store = self.open_store(self.store.path)
+
+    def keys(self, *args, **kwargs):
+        return ''.join(self.store.iter_keys(*args, **kwargs))
+
+    def test_ranges(self):
+        self.assertEqual(self.keys(), 'abcdefghij')
+        self.assertEqual(self.keys('c', 'f'), 'cdef')
+        self.assertEqual(self.keys('cc', None), 'defghij')
+        self.assertEqual(self.keys(None, 'cc'), 'abc')
+        self.assertEqual(self.keys('0', '~'), 'abcdefghij')
+        self.assertEqual(self.keys('f', 'c'), '')
+
+    def test_paging(self):
+        self.assertEqual(self.keys(limit=3), 'abc')
+        self.assertEqual(self.keys(limit=3, after='c'), 'def')
+        self.assertEqual(self.keys('b', 'g', after='cc'), 'defg')
+        self.assertEqual(self.keys('e', None, after='a'), 'efghij')
+        self.assertEqual(self.keys(after='j'), '')
+        pages = []
+        after = None
+        while True:
+            page = list(self.store.iter_keys(limit=4, after=after))
+            if not page:
+                break
+            pages.append(''.join(page))
+            after = page[-1]
+        self.assertEqual(pages, ['abcd', 'efgh', 'ij'])
+
+    def test_writes(self):
+        self.store.delete_key('c')
+        self.store.set('bb', 'col', 'val')
+        self.store.set('z', 'col', 'val')
+        self.assertEqual(self.keys(), 'abbbdefghijz')
+        self.assertEqual(self.store.count_keys(), 11)
+        self.reopen()
+        self.assertEqual(self.keys('b', 'd'), 'bbbd')
+        self.assertEqual(self.store.count_keys(), 11)
+
+    def test_count_keys(self):
+        self.assertEqual(self.store.count_keys(), 10)
+        self.store.delete_key('a')
+        self.store.delete_key('a')
+        self.assertEqual(self.store.count_keys(), 9)
+
+    def test_batch_reads_its_own_writes(self):
+        with self.store.batch():
+            self.store.delete_key('b')
+            self.store.set('bb', 'col', 'val')
+            self.store.set('c', 'new', 'val')
+            self.assertEqual(self.keys('a', 'c'), 'abbc')
+            self.assertEqual(self.store.count_keys(), 10)
+        self.assertEqual(self.keys('a', 'c'), 'abbc')
+
+    def test_rollback(self):
+        try:
+            with self.store.batch():
+                self.store.delete_key('b')
+                self.store.set('bb', 'col', 'val')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.keys(), 'abcdefghij')
+        self.assertEqual(self.store.count_keys(), 10)
+
+
+class ConcurrentKeyIndexTests(KeyIndexTests):
+    def open_store(self, path=None):
+        return KeyColumnValueStore(path=path, concurrent=True)
+
+
+class LazyKeyIndexTests(KeyIndexTests):
+    def setUp(self):
+        KeyIndexTests.setUp(self)
+        self.store.checkpoint()
+        self.reopen()
+
+    def open_store(self, path=None):
+        return KeyColumnValueStore(path=path, lazy=True)
+
+    def test_added_keys_merge_with_the_table(self):
+        self.store.set('0', 'col', 'val')
+        self.store.set('ee', 'col', 'val')
+        self.store.delete_key('f')
+        self.store.delete_key('ee')
+        self.store.set('f', 'col', 'val')
+        self.assertEqual(self.keys(), '0abcdefghij')
+        self.assertEqual(self.keys('d', 'g'), 'defg')
+
+
+class LSMKeyIndexTests(KeyIndexTests):
+    def open_store(self, path=None):
+        return LSMKeyColumnValueStore(path=path, memtable_bytes=256)
+
+    def reopen(self):
+        self.store.close()
+        self.store = self.open_store(self.store.directory)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+    def test_layers(self):
+        self.store.checkpoint()
+        self.store.delete_key('d')
+        self.store.set('dd', 'col', 'val')
+        self.assertEqual(self.keys('c', 'e'), 'cdde')
+        self.assertEqual(self.store.count_keys(), 10)
+
+
+class ShardedKeyIndexTests(KeyIndexTests):
+    def open_store(self, path=None):
+        return ShardedKeyColumnValueStore(path=path, shards=3)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+    # Batches span shards, but only the batch's own shards see its writes.
+    test_batch_reads_its_own_writes = None
+    test_rollback = None
+
+    def test_merges_shards(self):
+        self.assertTrue(all(shard.count_keys() < 10
+                            for shard in self.store.shards))
+        self.assertEqual(self.keys(limit=5, after='b'), 'cdefg')
@@ -0,0 +1,98 @@
+import os
+import slice_tests
+import spec_tests
+import string
+import unittest
+from kcvstore import KeyColumnValueStore
+
+
+def reopen_lazily(store):
+    """Checkpoints the store as a table and returns a lazy store that reads it
+    back."""
+    store.lazy = True
+    store.checkpoint()
+    store.close()
+    return KeyColumnValueStore(path=store.path)
+
+
+class LazyLevelOneSpecTests(spec_tests.LevelOneSpecTests):
+    def setUp(self):
+        spec_tests.LevelOneSpecTests.setUp(self)
+        self.store = reopen_lazily(self.store)
+
+
+class LazyLevelTwoSpecTests(spec_tests.LevelTwoSpecTests):
+    def setUp(self):
+        spec_tests.LevelTwoSpecTests.setUp(self)
+        self.store = reopen_lazily(self.store)
+
+
+class LazySliceTests(slice_tests.SliceTests):
+    def setUp(self):
+        slice_tests.SliceTests.setUp(self)
+        self.store = reopen_lazily(self.store)
+
+
+class LazyStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore(lazy=True)
+        for key in string.ascii_lowercase:
+            for col in string.ascii_uppercase:
+                self.store.set(key, col, key + col)
+        self.store = reopen_lazily(self.store)
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def reloaded(self):
+        return KeyColumnValueStore(path=self.store.path)
+
+    def test_rows_are_read_on_demand(self):
+        self.assertEqual(len(self.store.kcv), 26)
+        self.assertEqual(dict.__len__(self.store.kcv), 0)
+        self.assertEqual(self.store.get('q', 'Q'), 'qQ')
+        self.assertEqual(self.store.get('q', 'q'), None)
+        self.assertEqual(self.store.get('Q', 'Q'), None)
+        self.assertEqual(dict.__len__(self.store.kcv), 1)
+        self.assertEqual(len(self.store.kcv), 26)
+
+    def test_get_keys(self):
+        self.store.get_key('m')
+        self.assertEqual(self.store.get_keys(), set(string.ascii_lowercase))
+
+    def test_writes_after_load_persist(self):
+        self.store.set('a', 'a', 'new')
+        self.store.set('new', 'col', 'val')
+        self.store.delete('b', 'B')
+        self.store.delete_key('c')
+        for store in (self.store, self.reloaded()):
+            self.assertEqual(store.get('a', 'a'), 'new')
+            self.assertEqual(store.get('a', 'A'), 'aA')
+            self.assertEqual(store.get_key('new'), [('col', 'val')])
+            self.assertEqual(len(store.get_key('b')), 25)
+            self.assertEqual(store.get_key('c'), [])
+            self.assertEqual(store.get_keys(),
+                             set(string.ascii_lowercase) - {'c'} | {'new'})
+
+    def test_deleted_keys_stay_deleted(self):
+        self.store.delete_key('d')
+        self.assertEqual(self.store.get_key('d'), [])
+        self.assertEqual(len(self.store.kcv), 25)
+        self.store.set('d', 'col', 'val')
+        self.assertEqual(self.store.get_key('d'), [('col', 'val')])
+        self.store.delete_key('d')
+        self.assertEqual(self.reloaded().get_key('d'), [])
+
+    def test_checkpoint_merges_table_and_log(self):
+        self.store.get_key('e')
+        self.store.set('e', 'new', 'val')
+        self.store.delete_key('f')
+        self.store.set('zz', 'col', 'val')
+        self.store.checkpoint()
+        new_store = self.reloaded()
+        self.assertEqual(new_store.get('e', 'new'), 'val')
+        self.assertEqual(new_store.get('g', 'G'), 'gG')
+        self.assertEqual(new_store.get_key('f'), [])
+        self.assertEqual(new_store.get_key('zz'), [('col', 'val')])
+        self.assertEqual(len(new_store.kcv), 26)
@@ -0,0 +1,193 @@
+import os
+import random
+import shutil
+import slice_tests
+import spec_tests
+import string
+import unittest
+from kcvlsm import LSMKeyColumnValueStore
+from kcvstore import KeyColumnValueStore
+
+
+class LSMLevelOneSpecTests(spec_tests.LevelOneSpecTests):
+    def setUp(self):
+        self.store = LSMKeyColumnValueStore(memtable_bytes=64)
+        self.store.set('a', 'aa', 'x')
+        self.store.set('a', 'ab', 'x')
+        self.store.set('c', 'cc', 'x')
+        self.store.set('c', 'cd', 'x')
+        self.store.set('d', 'de', 'x')
+        self.store.set('d', 'df', 'x')
+        self.store.checkpoint()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+
+class LSMSliceTests(slice_tests.SliceTests):
+    def setUp(self):
+        self.store = LSMKeyColumnValueStore(max_segments=2)
+        for col in string.ascii_lowercase:
+            self.store.set('lowercase', col, 'val')
+        self.store.checkpoint()
+        for col in string.ascii_uppercase:
+            self.store.set('uppercase', col, 'val')
+            self.store.checkpoint()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+
+class LSMStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.store = LSMKeyColumnValueStore(max_segments=3)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+    def reloaded(self):
+        self.store.close()
+        self.store = LSMKeyColumnValueStore(self.store.directory,
+                                            max_segments=3)
+        return self.store
+
+    def segments(self):
+        return [name for name in os.listdir(self.store.directory)
+                if name.startswith('segment')]
+
+    def test_flush_writes_segment(self):
+        self.store.set('key', 'col', 'val')
+        self.store.checkpoint()
+        self.assertEqual(len(self.segments()), 1)
+        self.assertEqual(self.store.kcv, {})
+        self.assertEqual(self.store.get('key', 'col'), 'val')
+        self.assertEqual(self.reloaded().get('key', 'col'), 'val')
+
+    def test_tombstones_hide_older_segments(self):
+        self.store.set('key', 'colA', 'val')
+        self.store.set('key', 'colB', 'val')
+        self.store.set('other', 'col', 'val')
+        self.store.checkpoint()
+        self.store.delete('key', 'colA')
+        self.store.delete_key('other')
+        for store in (self.store, self.reloaded()):
+            self.assertEqual(store.get('key', 'colA'), None)
+            self.assertEqual(store.get_key('key'), [('colB', 'val')])
+            self.assertEqual(store.get_key('other'), [])
+            self.assertEqual(store.get_keys(), {'key'})
+        self.store.checkpoint()
+        self.assertEqual(self.store.get_keys(), {'key'})
+
+    def test_deleting_every_column_keeps_key(self):
+        self.store.set('key', 'col', 'val')
+        self.store.checkpoint()
+        self.store.delete('key', 'col')
+        self.store.checkpoint()
+        self.assertEqual(self.store.get_keys(), {'key'})
+        self.assertEqual(self.store.get_key('key'), [])
+
+    def test_merge_keeps_segment_count_bounded(self):
+        for i in range(10):
+            self.store.set('key', str(i), 'val')
+            self.store.delete('key', str(i - 1))
+            self.store.checkpoint()
+        self.assertTrue(len(self.segments()) <= 3)
+        for store in (self.store, self.reloaded()):
+            self.assertEqual(store.get_key('key'), [('9', 'val')])
+
+    def test_merges_keep_tombstones_above_oldest_segment(self):
+        self.store.set_many(('key%03d' % i, 'col', 'val') for i in range(200))
+        self.store.checkpoint()
+        self.store.delete('key001', 'col')
+        self.store.delete_key('key002')
+        self.store.checkpoint()
+        for i in range(3):
+            self.store.set('new', str(i), 'val')
+            self.store.checkpoint()
+        # Small segments were merged, without the big, oldest one.
+        self.assertEqual(sorted(self.segments()), [
+            'segment-00000001-00000001.kcv', 'segment-00000002-00000004.kcv',
+            'segment-00000005-00000005.kcv'])
+        for store in (self.store, self.reloaded()):
+            self.assertEqual(store.get('key001', 'col'), None)
+            self.assertEqual(store.get_key('key002'), [])
+            self.assertEqual(store.get('key003', 'col'), 'val')
+            self.assertEqual(store.count_keys(), 200)
+
+    def test_write_amplification_is_logarithmic(self):
+        # Merging every segment whenever there are too many would rewrite
+        # the data about once per flush.
+        store = LSMKeyColumnValueStore(max_segments=2)
+        written = []
+        write_segment = store._write_segment
+
+        def counting(*args):
+            segment = write_segment(*args)
+            written.append(segment.size)
+            return segment
+
+        store._write_segment = counting
+        for i in range(64):
+            store.set_many(('key%06d' % (i * 20 + j), 'col', 'v' * 50)
+                           for j in range(20))
+            store.checkpoint()
+        total = sum(segment.size for segment in store.levels)
+        self.assertTrue(sum(written) < 8 * total)
+        self.assertEqual(store.count_keys(), 64 * 20)
+        store.close()
+        shutil.rmtree(store.directory)
+
+    def test_superseded_segments_are_removed(self):
+        for i in range(4):
+            self.store.set('key', str(i), 'val')
+            self.store.checkpoint()
+        self.assertEqual(self.segments(), ['segment-00000001-00000004.kcv'])
+        # Simulate a crash after a merge, but before its inputs were removed.
+        shutil.copy(os.path.join(self.store.directory, self.segments()[0]),
+                    os.path.join(self.store.directory,
+                                 'segment-00000002-00000002.kcv'))
+        self.assertEqual(len(self.reloaded().get_key('key')), 4)
+        self.assertEqual(self.segments(), ['segment-00000001-00000004.kcv'])
+
+    def test_failed_batch_is_rolled_back(self):
+        self.store.set('key', 'col', 'val')
+        self.store.checkpoint()
+        try:
+            with self.store.batch():
+                self.store.delete_key('key')
+                self.store.set('key', 'new', 'val')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        for store in (self.store, self.reloaded()):
+            self.assertEqual(store.get_key('key'), [('col', 'val')])
+
+    def test_matches_in_memory_store(self):
+        memory = KeyColumnValueStore()
+        store = LSMKeyColumnValueStore(memtable_bytes=256, max_segments=2)
+        rng = random.Random(0)
+        for i in range(2000):
+            key = rng.choice('abcde')
+            col = rng.choice(string.ascii_lowercase)
+            op = rng.random()
+            for s in (memory, store):
+                if op < 0.7:
+                    s.set(key, col, str(i))
+                elif op < 0.95:
+                    s.delete(key, col)
+                else:
+                    s.delete_key(key)
+        store.close()
+        reloaded = LSMKeyColumnValueStore(store.directory)
+        for s in (store, reloaded):
+            self.assertEqual(s.get_keys(), memory.get_keys())
+            for key in 'abcde':
+                self.assertEqual(s.get_key(key), memory.get_key(key))
+                self.assertEqual(s.get_slice(key, 'f', 'p'),
+                                 memory.get_slice(key, 'f', 'p'))
+        reloaded.close()
+        shutil.rmtree(store.directory)
+        os.remove(memory.path)
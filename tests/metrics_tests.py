@@ -0,0 +1,150 @@
+import os
+import unittest
+from kcvlsm import LSMKeyColumnValueStore
+from kcvmetrics import Metrics, render
+from kcvstore import KeyColumnValueStore, SNAPSHOT
+
+
+class MetricsTests(unittest.TestCase):
+    options = {}
+
+    def setUp(self):
+        self.store = KeyColumnValueStore(metrics=True, **self.options)
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def test_operations_are_counted(self):
+        self.store.set('a', 'b', 'c')
+        self.store.set_many([('a', 'c', 'd'), ('b', 'c', 'd')])
+        self.store.get('a', 'b')
+        self.store.get_slice('a', None, None)
+        operations = self.store.metrics.operations
+        self.assertEqual(operations['set'].count, 1)
+        self.assertEqual(operations['set_many'].count, 1)
+        self.assertEqual(operations['get'].count, 1)
+        self.assertEqual(operations['get_slice'].count, 1)
+        self.assertTrue(operations['set'].sum > 0)
+        self.assertEqual(sum(operations['set'].counts), 1)
+
+    def test_nested_operations_are_not_counted(self):
+        self.store.increment('a', 'n')
+        self.store.append('a', 'n', '0')
+        self.store.compare_and_set('a', 'n', '10', '11')
+        operations = self.store.metrics.operations
+        self.assertEqual(sorted(operations),
+                         ['append', 'compare_and_set', 'increment'])
+        self.store.get('a', 'n')
+        self.assertEqual(operations['get'].count, 1)
+
+    def test_errors_are_counted(self):
+        self.assertRaises(AssertionError, self.store.set, 'a', 'b', None)
+        self.assertEqual(self.store.metrics.errors['set'], 1)
+
+    def test_persistence_is_broken_out(self):
+        persist = self.store.metrics.persist
+        persist_bytes = self.store.metrics.persist_bytes
+        self.assertEqual(persist['snapshot'].count, 1)  # creating the file
+        self.store.set('a', 'b', 'c')
+        self.store.delete('a', 'b')
+        self.assertEqual(persist['log'].count, 2)
+        self.assertTrue(persist_bytes['log'] > 0)
+        written = persist_bytes['snapshot']
+        self.store.checkpoint()
+        self.assertEqual(persist['snapshot'].count, 2)
+        self.assertEqual(persist_bytes['snapshot'] - written,
+                         os.path.getsize(self.store.path))
+
+    def test_snapshot_persistence(self):
+        store = KeyColumnValueStore(persistence=SNAPSHOT, metrics=True)
+        store.set('a', 'b', 'c')
+        self.assertEqual(store.metrics.persist['snapshot'].count, 2)
+        os.remove(store.path)
+
+    def test_size_stats(self):
+        self.store.set_many([('a', 'x', '1'), ('a', 'y', '2'),
+                             ('b', 'x', '3')])
+        self.assertEqual(self.store.size_stats(), {'keys': 2, 'columns': 3})
+        self.store.lazy = True
+        self.store.checkpoint()
+        self.store.close()
+        store = KeyColumnValueStore(path=self.store.path)
+        store.get('a', 'x')
+        store.delete_key('b')
+        store.set('c', 'x', '4')
+        self.assertEqual(store.size_stats(), {'keys': 2, 'columns': 3})
+        store.set('c', 'y', '5')
+        self.assertEqual(store.size_stats(), {'keys': 2, 'columns': 4})
+        store.close()
+
+    def test_size_stats_follow_writes(self):
+        store = self.store
+
+        def columns():
+            return store.size_stats()['columns']
+
+        store.set_many([('a', 'x', '1'), ('a', 'y', '2'), ('b', 'x', '3')])
+        store.set('a', 'x', 'overwritten')
+        store.delete('a', 'missing')
+        self.assertEqual(columns(), 3)
+        try:
+            with store.batch():
+                store.delete_key('a')
+                store.set('a', 'z', '4')
+                store.set('c', 'x', '5')
+                store.delete('b', 'x')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(columns(), 3)
+        store.bulk_load([('a', 'x', '6'), ('a', 'w', '7'), ('d', 'x', '8')])
+        self.assertEqual(columns(), 5)
+        store.close()
+        store = self.store = KeyColumnValueStore(path=store.path,
+                                                 **self.options)
+        store.delete_key('a')
+        self.assertEqual(store.size_stats(), {'keys': 2, 'columns': 2})
+
+    def test_lsm_size_stats(self):
+        store = LSMKeyColumnValueStore(memtable_bytes=64)
+        for i in xrange(20):
+            store.set(str(i % 3), str(i), 'v')
+        store.delete('0', '0')
+        self.assertEqual(store.size_stats(), {'keys': 3, 'columns': 19})
+        store.close()
+
+    def test_off_by_default(self):
+        store = KeyColumnValueStore(path=self.store.path)
+        store.set('a', 'b', 'c')
+        self.assertEqual(store.metrics, None)
+        store.close()
+
+
+class ConcurrentMetricsTests(MetricsTests):
+    # A concurrent store throws away a failed batch's staged rows rather
+    # than undoing it.
+    options = {'concurrent': True}
+
+
+class RenderTests(unittest.TestCase):
+    def test_prometheus_format(self):
+        metrics = Metrics()
+        metrics.operation('get', 0.00002)
+        metrics.operation('get', 0.2, failed=True)
+        metrics.persisted('log', 0.001, 42)
+        text = render(metrics, {'keys': 3}, {'filter': {'hits': 5}})
+        lines = text.splitlines()
+        self.assertIn('# TYPE kcv_operation_seconds histogram', lines)
+        self.assertIn('kcv_operation_seconds_bucket{le="1e-05",op="get"} 0',
+                      lines)
+        self.assertIn('kcv_operation_seconds_bucket{le="2.5e-05",op="get"} 1',
+                      lines)
+        self.assertIn('kcv_operation_seconds_bucket{le="+Inf",op="get"} 2',
+                      lines)
+        self.assertIn('kcv_operation_seconds_count{op="get"} 2', lines)
+        self.assertIn('kcv_operation_errors_total{op="get"} 1', lines)
+        self.assertIn('kcv_persist_bytes_total{kind="log"} 42', lines)
+        self.assertIn('# TYPE kcv_keys gauge', lines)
+        self.assertIn('kcv_keys 3', lines)
+        self.assertIn('kcv_filter_total{stat="hits"} 5', lines)
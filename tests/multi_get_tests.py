@@ -0,0 +1,27 @@
+import os
+import unittest
+from kcvstore import KeyColumnValueStore
+
+
+class MultiGetTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore()
+        self.store.set_many([('a', 'x', '1'), ('a', 'y', '2'), ('a', 'z', '3'),
+                             ('b', 'x', '4')])
+
+    def tearDown(self):
+        os.remove(self.store.path)
+
+    def test_multi_get(self):
+        self.assertEqual(self.store.multi_get([('a', 'y'), ('b', 'x'),
+                                               ('b', 'y'), ('c', 'x'),
+                                               ('a', 'x')]),
+                         ['2', '4', None, None, '1'])
+        self.assertEqual(self.store.multi_get([]), [])
+
+    def test_multi_get_slice(self):
+        self.assertEqual(self.store.multi_get_slice(['b', 'c', 'a'], 'x', 'y'),
+                         [[('x', '4')], [], [('x', '1'), ('y', '2')]])
+        self.assertEqual(self.store.multi_get_slice(['a'], None, None),
+                         [self.store.get_key('a')])
+        self.assertEqual(self.store.multi_get_slice([], None, None), [])
@@ -1,6 +1,8 @@
 import os
+import threading
 import unittest
-from kcvstore import KeyColumnValueStore
+from kcvstore import KeyColumnValueStore, SNAPSHOT
+from kcvstore import NONE, GROUP_COMMIT, FSYNC
 from tempfile import NamedTemporaryFile
 
 
@@ -48,3 +50,159 @@ class PersistenceTestsWithArgument(PersistenceTestsWithoutArgument):
         with NamedTemporaryFile(delete=False) as tmp:
             path = tmp.name
         self.store = KeyColumnValueStore(path=path)
+
+
+class SnapshotPersistenceTests(PersistenceTestsWithoutArgument):
+    def setUp(self):
+        self.store = KeyColumnValueStore(persistence=SNAPSHOT)
+
+
+class FsyncPersistenceTests(PersistenceTestsWithoutArgument):
+    def setUp(self):
+        self.store = KeyColumnValueStore(durability=FSYNC)
+
+
+class FsyncSnapshotPersistenceTests(PersistenceTestsWithoutArgument):
+    def setUp(self):
+        self.store = KeyColumnValueStore(persistence=SNAPSHOT,
+                                         durability=FSYNC)
+
+
+class GroupCommitPersistenceTests(PersistenceTestsWithoutArgument):
+    def setUp(self):
+        self.store = KeyColumnValueStore(durability=GROUP_COMMIT,
+                                         commit_interval_ms=1)
+
+    def test_concurrent_writers(self):
+        def write(key):
+            for i in range(20):
+                self.store.set(key, str(i), 'val')
+        keys = [str(i) for i in range(10)]
+        writers = [threading.Thread(target=write, args=(key,)) for key in keys]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        new_store = KeyColumnValueStore(path=self.store.path)
+        self.assertEqual(new_store.get_keys(), set(keys))
+        for key in keys:
+            self.assertEqual(len(new_store.get_key(key)), 20)
+
+
+class UnbufferedPersistenceTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore(durability=NONE)
+
+    def tearDown(self):
+        os.remove(self.store.path)
+
+    def test_close_flushes(self):
+        self.store.set('key', 'col', 'val')
+        self.store.close()
+        new_store = KeyColumnValueStore(path=self.store.path)
+        self.assertEqual(new_store.get('key', 'col'), 'val')
+
+
+class LogPersistenceTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore()
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def test_writes_append(self):
+        self.store.set('key', 'col', 'val')
+        size = os.path.getsize(self.store.path)
+        self.store.set('key', 'col', 'new_val')
+        self.assertTrue(os.path.getsize(self.store.path) > size)
+        new_store = KeyColumnValueStore(path=self.store.path)
+        self.assertEqual(new_store.get('key', 'col'), 'new_val')
+
+    def test_noop_deletes_are_not_logged(self):
+        size = os.path.getsize(self.store.path)
+        self.store.delete('key', 'col')
+        self.store.delete_key('key')
+        self.assertEqual(os.path.getsize(self.store.path), size)
+
+    def test_torn_record_is_discarded(self):
+        self.store.set('key', 'colA', 'val')
+        size = os.path.getsize(self.store.path)
+        self.store.set('key', 'colB', 'val')
+        self.store.close()
+        with open(self.store.path, 'r+b') as log:
+            log.truncate(os.path.getsize(self.store.path) - 3)
+        new_store = KeyColumnValueStore(path=self.store.path)
+        self.assertEqual(new_store.get_key('key'), [('colA', 'val')])
+        self.assertEqual(os.path.getsize(self.store.path), size)
+        new_store.set('key', 'colC', 'val')
+        newer_store = KeyColumnValueStore(path=self.store.path)
+        self.assertEqual(newer_store.get_key('key'),
+                         [('colA', 'val'), ('colC', 'val')])
+
+    def test_loads_snapshot_files(self):
+        old_store = KeyColumnValueStore(persistence=SNAPSHOT)
+        old_store.set('key', 'col', 'val')
+        new_store = KeyColumnValueStore(path=old_store.path)
+        new_store.set('key', 'col', 'new_val')
+        newer_store = KeyColumnValueStore(path=old_store.path)
+        self.assertEqual(newer_store.get_key('key'), [('col', 'new_val')])
+        new_store.close()
+        os.remove(old_store.path)
+
+
+class CheckpointTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore()
+        for i in range(100):
+            self.store.set('key', 'col', str(i))
+        self.store.set('key', 'other', 'val')
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def assertReloads(self, expected):
+        new_store = KeyColumnValueStore(path=self.store.path)
+        self.assertEqual(new_store.get_key('key'), expected)
+
+    def test_checkpoint_shrinks_log(self):
+        size = os.path.getsize(self.store.path)
+        self.store.checkpoint()
+        self.assertTrue(os.path.getsize(self.store.path) < size)
+        self.assertReloads([('col', '99'), ('other', 'val')])
+
+    def test_writes_after_checkpoint_persist(self):
+        self.store.checkpoint()
+        self.store.delete('key', 'other')
+        self.assertReloads([('col', '99')])
+
+    def test_background_checkpoint_keeps_concurrent_writes(self):
+        checkpointer = self.store.checkpoint(background=True)
+        for i in range(100, 200):
+            self.store.set('key', 'col', str(i))
+        self.store.delete('key', 'other')
+        checkpointer.join()
+        self.assertReloads([('col', '199')])
+        self.store.set('key', 'new', 'val')
+        self.assertReloads([('col', '199'), ('new', 'val')])
+
+    def assertBoundsLog(self, **kwargs):
+        unbounded = KeyColumnValueStore()
+        bounded = KeyColumnValueStore(**kwargs)
+        for store in (unbounded, bounded):
+            for i in range(1000):
+                store.set('key', 'col', str(i))
+            store.close()
+        self.assertTrue(os.path.getsize(bounded.path) <
+                        os.path.getsize(unbounded.path))
+        new_store = KeyColumnValueStore(path=bounded.path)
+        self.assertEqual(new_store.get_key('key'), [('col', '999')])
+        os.remove(unbounded.path)
+        os.remove(bounded.path)
+
+    def test_checkpoint_records_bounds_log(self):
+        self.assertBoundsLog(checkpoint_records=10)
+
+    def test_checkpoint_bytes_bounds_log(self):
+        self.assertBoundsLog(checkpoint_bytes=512)
@@ -0,0 +1,138 @@
+import os
+import shutil
+import unittest
+from kcvlsm import LSMKeyColumnValueStore
+from kcvshard import ShardedKeyColumnValueStore
+from kcvstore import KeyColumnValueStore
+
+
+COLUMNS = ['2026-09:x', '2026-10:a', '2026-10:b', '2026-10:c', '2026-11:a',
+           '2026-10\xff', '2026-10\xff\xff:z']
+
+
+class PrefixTests(unittest.TestCase):
+    def setUp(self):
+        self.store = self.open_store()
+        self.store.set_many(('k', col, col.upper()) for col in COLUMNS)
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.store.path)
+
+    def open_store(self, path=None):
+        return KeyColumnValueStore(path=path)
+
+    def reopen(self):
+        self.store.close()
+        self.store = self.open_store(self.store.path)
+
+    def columns(self, prefix, **options):
+        return [col for col, val in
+                self.store.iter_prefix('k', prefix, **options)]
+
+    def test_get_prefix(self):
+        self.assertEqual(self.store.get_prefix('k', '2026-10:'), [
+            ('2026-10:a', '2026-10:A'), ('2026-10:b', '2026-10:B'),
+            ('2026-10:c', '2026-10:C')])
+        self.assertEqual(self.columns('2026-1'), sorted(COLUMNS)[1:])
+        self.assertEqual(self.columns('2026-10\xff'),
+                         ['2026-10\xff', '2026-10\xff\xff:z'])
+        self.assertEqual(self.columns(''), sorted(COLUMNS))
+        self.assertEqual(self.columns('2026-12'), [])
+        self.assertEqual(self.store.get_prefix('missing', ''), [])
+
+    def test_iter_prefix_paging(self):
+        self.assertEqual(self.columns('2026-10:', limit=2),
+                         ['2026-10:a', '2026-10:b'])
+        self.assertEqual(self.columns('2026-10:', after='2026-10:a'),
+                         ['2026-10:b', '2026-10:c'])
+        self.assertEqual(self.columns('2026-10:', reverse=True, limit=2),
+                         ['2026-10:c', '2026-10:b'])
+
+    def test_counts(self):
+        store = self.store
+        self.assertEqual(store.count_columns('k'), len(COLUMNS))
+        self.assertEqual(store.count_columns('missing'), 0)
+        self.assertEqual(store.count_prefix('k', '2026-10:'), 3)
+        self.assertEqual(store.count_prefix('k', ''), len(COLUMNS))
+        self.assertEqual(store.count_prefix('missing', ''), 0)
+        for start, stop in [(None, None), ('2026-10:a', '2026-10:c'),
+                            ('2026-10:b', None), (None, '2026-10:b'),
+                            ('2026-10:c', '2026-10:a'), ('nope', None),
+                            ('nope', 'nada'), ('2026-10:b', '2026-10:b')]:
+            self.assertEqual(store.count_slice('k', start, stop),
+                             len(store.get_slice('k', start, stop)))
+        self.assertEqual(store.count_slice('missing', None, None), 0)
+
+    def test_writes(self):
+        self.store.delete('k', '2026-10:b')
+        self.store.set('k', '2026-10:d', 'D')
+        self.assertEqual(self.store.count_prefix('k', '2026-10:'), 3)
+        self.assertEqual(self.store.count_slice('k', '2026-10:a', '2026-10:d'),
+                         3)
+        self.reopen()
+        self.assertEqual(self.columns('2026-10:'),
+                         ['2026-10:a', '2026-10:c', '2026-10:d'])
+        self.assertEqual(self.store.count_columns('k'), len(COLUMNS))
+
+    def test_batch_counts_its_own_writes(self):
+        with self.store.batch():
+            self.store.set('k', '2026-10:bb', 'BB')
+            self.store.delete_key('j')
+            self.assertEqual(self.store.count_prefix('k', '2026-10:'), 4)
+            self.assertEqual(self.store.count_columns('k'),
+                             len(COLUMNS) + 1)
+
+    def test_unicode(self):
+        self.store.set('u', u'caf\xe9', '1')
+        self.store.set('u', u'caf\U0010ffff', '2')
+        self.store.set('u', u'cag', '3')
+        self.assertEqual(self.store.count_prefix('u', u'caf'), 2)
+        self.assertEqual(self.store.get_prefix('u', u'caf\xe9'),
+                         [(u'caf\xe9', '1')])
+
+
+class ConcurrentPrefixTests(PrefixTests):
+    def open_store(self, path=None):
+        return KeyColumnValueStore(path=path, concurrent=True)
+
+
+class FrozenPrefixTests(PrefixTests):
+    def open_store(self, path=None):
+        return KeyColumnValueStore(path=path, hot_rows=0)
+
+
+class LazyPrefixTests(PrefixTests):
+    def setUp(self):
+        PrefixTests.setUp(self)
+        self.store.checkpoint()
+        self.reopen()
+
+    def open_store(self, path=None):
+        return KeyColumnValueStore(path=path, lazy=True)
+
+
+class LSMPrefixTests(PrefixTests):
+    def open_store(self, path=None):
+        return LSMKeyColumnValueStore(path=path, memtable_bytes=256)
+
+    def reopen(self):
+        self.store.close()
+        self.store = self.open_store(self.store.directory)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+
+class ShardedPrefixTests(PrefixTests):
+    def open_store(self, path=None):
+        return ShardedKeyColumnValueStore(path=path, shards=3)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
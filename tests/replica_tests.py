@@ -0,0 +1,153 @@
+import os
+import time
+import unittest
+from kcvstore import KeyColumnValueStore, NONE, SNAPSHOT
+
+
+class ReplicaTests(unittest.TestCase):
+    options = {}
+
+    def setUp(self):
+        self.store = KeyColumnValueStore(**self.options)
+        self.store.set('a', 'x', '1')
+        self.replica = KeyColumnValueStore(self.store.path, replica=True,
+                                           **self.options)
+
+    def tearDown(self):
+        self.replica.close()
+        self.store.close()
+        os.remove(self.store.path)
+
+    def test_loads_the_store(self):
+        self.assertEqual(self.replica.get_key('a'), [('x', '1')])
+        self.assertEqual(self.replica.replica_lag(),
+                         {'bytes': 0, 'seconds': 0.0})
+
+    def test_catches_up(self):
+        self.store.set('a', 'y', '2')
+        self.store.set_many([('b', 'x', '3'), ('c', 'x', '4')])
+        self.store.delete_key('c')
+        self.assertEqual(self.replica.get_keys(), set(['a']))
+        self.assertTrue(self.replica.replica_lag()['bytes'] > 0)
+        self.assertEqual(self.replica.catch_up(), 3)
+        self.assertEqual(self.replica.get_slice('a', 'y', None), [('y', '2')])
+        self.assertEqual(self.replica.get_keys(), set(['a', 'b']))
+        self.assertEqual(self.replica.replica_lag()['bytes'], 0)
+        self.assertEqual(self.replica.catch_up(), 0)
+
+    def test_lag(self):
+        self.replica._caught_up -= 10
+        self.assertEqual(self.replica.replica_lag()['seconds'], 0.0)
+        self.store.set('a', 'y', '2')
+        self.assertTrue(self.replica.replica_lag()['seconds'] >= 10)
+        self.replica.catch_up()
+        self.assertEqual(self.replica.replica_lag()['seconds'], 0.0)
+
+    def test_waits_for_torn_records(self):
+        self.store.set('a', 'y', '2')
+        with open(self.store.path, 'rb') as f:
+            log = f.read()
+        with open(self.store.path, 'r+b') as f:
+            f.truncate(len(log) - 3)
+        self.assertEqual(self.replica.catch_up(), 0)
+        self.assertEqual(self.replica.get('a', 'y'), None)
+        with open(self.store.path, 'ab') as f:
+            f.write(log[-3:])
+        self.assertEqual(self.replica.catch_up(), 1)
+        self.assertEqual(self.replica.get('a', 'y'), '2')
+
+    def test_reloads_after_checkpoint(self):
+        self.store.set('a', 'y', '2')
+        self.replica.catch_up()
+        self.store.set('b', 'x', '3')
+        self.store.checkpoint()
+        self.store.set('c', 'x', '4')
+        self.assertEqual(self.replica.catch_up(), None)
+        self.assertEqual(self.replica.get_keys(), set(['a', 'b', 'c']))
+        self.assertEqual(self.replica.get_key('a'), [('x', '1'), ('y', '2')])
+        self.store.delete('a', 'x')
+        self.assertEqual(self.replica.catch_up(), 1)
+        self.assertEqual(self.replica.get_key('a'), [('y', '2')])
+
+    def test_read_only(self):
+        self.assertRaises(ValueError, self.replica.set, 'a', 'x', '2')
+        self.assertRaises(ValueError, self.replica.delete_key, 'a')
+        self.assertRaises(ValueError, self.replica.set_many, [])
+        self.assertRaises(ValueError, self.replica.bulk_load, [])
+        self.assertRaises(ValueError, self.replica.checkpoint)
+        self.assertEqual(self.store.get_key('a'), [('x', '1')])
+
+    def test_follow(self):
+        self.replica.follow(interval=0.01)
+        self.store.set('b', 'x', '2')
+        deadline = time.time() + 5
+        while self.replica.get('b', 'x') is None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.replica.get('b', 'x'), '2')
+
+
+class ConcurrentReplicaTests(ReplicaTests):
+    options = {'concurrent': True, 'cache_entries': 10}
+
+    def test_cache_follows_the_log(self):
+        self.assertEqual(self.replica.get_key('a'), [('x', '1')])
+        self.store.set('a', 'y', '2')
+        self.replica.catch_up()
+        self.assertEqual(self.replica.get_key('a'), [('x', '1'), ('y', '2')])
+        self.store.checkpoint()
+        self.store.set('a', 'z', '3')
+        self.replica.catch_up()
+        self.assertEqual(self.replica.get_key('a'),
+                         [('x', '1'), ('y', '2'), ('z', '3')])
+
+
+class LazyReplicaTests(ReplicaTests):
+    options = {'lazy': True, 'hot_rows': 1}
+
+    def test_reloads_lazily(self):
+        self.store.set_many(('key%d' % i, 'x', str(i)) for i in xrange(100))
+        self.store.checkpoint()
+        self.replica.catch_up()
+        self.assertEqual(dict.__len__(self.replica.kcv), 0)
+        self.assertEqual(self.replica.get('key42', 'x'), '42')
+        self.assertEqual(self.replica.count_keys(), 101)
+
+
+class SnapshotReplicaTests(unittest.TestCase):
+    def test_follows_snapshots(self):
+        store = KeyColumnValueStore(persistence=SNAPSHOT, durability=NONE)
+        replica = KeyColumnValueStore(store.path, replica=True)
+        store.set('a', 'x', '1')
+        replica.catch_up()
+        self.assertEqual(replica.get_key('a'), [('x', '1')])
+        self.assertRaises(ValueError, KeyColumnValueStore, replica=True)
+        replica.close()
+        os.remove(store.path)
+
+    def test_follows_several_snapshots_between_catch_ups(self):
+        # Each write replaces the file, and a file system is free to reuse
+        # the inode of the one before last for it.
+        store = KeyColumnValueStore(persistence=SNAPSHOT, durability=NONE)
+        store.set('a', '0', '0')
+        replica = KeyColumnValueStore(store.path, replica=True)
+        for writes in xrange(2, 6):
+            for i in xrange(writes):
+                store.set('a', str(i), str(i))
+            self.assertTrue(replica.replica_lag()['bytes'] > 0)
+            replica.catch_up()
+            self.assertEqual(replica.get_key('a'), store.get_key('a'))
+        replica.close()
+        os.remove(store.path)
+
+    def test_follows_several_checkpoints_between_catch_ups(self):
+        store = KeyColumnValueStore()
+        store.set('a', 'x', '1')
+        replica = KeyColumnValueStore(store.path, replica=True)
+        store.checkpoint()
+        store.set('a', 'y', '2')
+        store.checkpoint()
+        replica.catch_up()
+        self.assertEqual(replica.get_key('a'), [('x', '1'), ('y', '2')])
+        replica.close()
+        store.close()
+        os.remove(store.path)
@@ -0,0 +1,132 @@
+import os
+import shutil
+import slice_tests
+import spec_tests
+import threading
+import unittest
+from kcvshard import ShardedKeyColumnValueStore
+
+
+def reopen_sharded(store, shards=4):
+    """Copies the store's contents into a new sharded store."""
+    sharded = ShardedKeyColumnValueStore(shards=shards)
+    sharded.set_many((key, col, val) for key in store.get_keys()
+                     for col, val in store.get_key(key))
+    store.close()
+    os.remove(store.path)
+    return sharded
+
+
+class ShardedLevelOneSpecTests(spec_tests.LevelOneSpecTests):
+    def setUp(self):
+        spec_tests.LevelOneSpecTests.setUp(self)
+        self.store = reopen_sharded(self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+
+class ShardedLevelTwoSpecTests(spec_tests.LevelTwoSpecTests):
+    def setUp(self):
+        spec_tests.LevelTwoSpecTests.setUp(self)
+        self.store = reopen_sharded(self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+
+class ShardedSliceTests(slice_tests.SliceTests):
+    def setUp(self):
+        slice_tests.SliceTests.setUp(self)
+        self.store = reopen_sharded(self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+
+class ShardedStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.store = ShardedKeyColumnValueStore(shards=4)
+        self.store.set_many(('key%d' % i, 'col%d' % j, str(i * j))
+                            for i in xrange(40) for j in xrange(3))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.directory)
+
+    def reopened(self, **options):
+        self.store.close()
+        return ShardedKeyColumnValueStore(self.store.directory, shards=4,
+                                          **options)
+
+    def test_keys_are_spread_over_shards(self):
+        counts = [len(shard.get_keys()) for shard in self.store.shards]
+        self.assertEqual(sum(counts), 40)
+        self.assertTrue(all(counts))
+        self.assertEqual(len(os.listdir(self.store.directory)), 5)
+
+    def test_reload(self):
+        self.store.delete('key7', 'col1')
+        self.store.delete_key('key8')
+        store = self.reopened()
+        self.assertEqual(store.get_keys(),
+                         set('key%d' % i for i in xrange(40)) -
+                         set(['key8']))
+        self.assertEqual(store.get_key('key7'),
+                         [('col0', '0'), ('col2', '14')])
+        self.store = store
+
+    def test_reload_lazily(self):
+        for shard in self.store.shards:
+            shard.lazy = True
+        self.store.checkpoint()
+        self.store = self.reopened()
+        self.assertTrue(all(shard.lazy for shard in self.store.shards))
+        self.assertEqual(self.store.get('key9', 'col2'), '18')
+
+    def test_shard_count_is_fixed(self):
+        self.store.close()
+        self.assertRaises(ValueError, ShardedKeyColumnValueStore,
+                          self.store.directory, shards=5)
+        self.store = self.reopened()
+
+    def test_multi_key_methods(self):
+        self.assertEqual(self.store.multi_get([('key3', 'col2'),
+                                               ('nope', 'col1'),
+                                               ('key30', 'col1')]),
+                         ['6', None, '30'])
+        self.assertEqual(self.store.multi_get_slice(['key2', 'key1'],
+                                                    'col1', 'col2'),
+                         [[('col1', '2'), ('col2', '4')],
+                          [('col1', '1'), ('col2', '2')]])
+        self.store.delete_many([('key1', 'col0'), ('key2', 'col0')])
+        self.assertEqual(self.store.multi_get([('key1', 'col0'),
+                                               ('key2', 'col0')]),
+                         [None, None])
+
+    def test_batch_rolls_back_every_shard(self):
+        with self.assertRaises(RuntimeError):
+            with self.store.batch():
+                for i in xrange(40):
+                    self.store.set('key%d' % i, 'col0', 'new')
+                raise RuntimeError
+        self.assertEqual(self.store.get('key5', 'col0'), '0')
+
+    def test_concurrent_writers(self):
+        def write(i):
+            for j in xrange(50):
+                self.store.set('writer%d' % i, str(j), str(j))
+
+        threads = [threading.Thread(target=write, args=(i,))
+                   for i in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        store = self.reopened()
+        for i in xrange(8):
+            self.assertEqual(len(store.get_key('writer%d' % i)), 50)
+        self.store = store
@@ -59,3 +59,73 @@ class SliceTests(unittest.TestCase):
         self.assertEqual(self.store.get_slice('mixedcase', None, 'Z'), [])
         self.assertEqual(self.store.get_slice('mixedcase', 'a', None), [])
         self.assertEqual(self.store.get_slice('mixedcase', None, None), [])
+
+
+class IterSliceTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore()
+        for col in string.ascii_lowercase:
+            self.store.set('lowercase', col, 'val')
+
+    def tearDown(self):
+        os.remove(self.store.path)
+
+    def cols(self, *args, **kwargs):
+        return ''.join(c for c, _ in self.store.iter_slice('lowercase', *args,
+                                                           **kwargs))
+
+    def test_matches_get_slice(self):
+        for start, stop in [(None, None), ('c', 'f'), ('f', None),
+                            (None, 'f'), ('0', 'f'), ('c', '~'), ('z', 'a'),
+                            ('0', '~')]:
+            self.assertEqual(
+                list(self.store.iter_slice('lowercase', start, stop)),
+                self.store.get_slice('lowercase', start, stop))
+        self.assertEqual(list(self.store.iter_slice('missing', None, None)),
+                         [])
+
+    def test_reverse(self):
+        self.assertEqual(self.cols('c', 'f', reverse=True), 'fedc')
+        self.assertEqual(self.cols(None, None, reverse=True),
+                         string.ascii_lowercase[::-1])
+
+    def test_exclusive(self):
+        self.assertEqual(self.cols('c', 'f', start_exclusive=True), 'def')
+        self.assertEqual(self.cols('c', 'f', stop_exclusive=True), 'cde')
+        self.assertEqual(self.cols('c', 'f', start_exclusive=True,
+                                   stop_exclusive=True), 'de')
+        self.assertEqual(self.cols('c', 'c', stop_exclusive=True), '')
+
+    def test_limit(self):
+        self.assertEqual(self.cols(None, None, limit=3), 'abc')
+        self.assertEqual(self.cols('x', None, limit=5), 'xyz')
+        self.assertEqual(self.cols(None, None, limit=3, reverse=True), 'zyx')
+        self.assertEqual(self.cols(None, None, limit=0), '')
+
+    def test_paging(self):
+        for reverse in (False, True):
+            pages = []
+            after = None
+            while True:
+                page = self.cols(None, None, limit=4, reverse=reverse,
+                                 after=after)
+                if not page:
+                    break
+                pages.append(page)
+                after = page[-1]
+            expected = string.ascii_lowercase
+            if reverse:
+                expected = expected[::-1]
+            self.assertEqual(''.join(pages), expected)
+            self.assertEqual(len(pages), 7)
+
+    def test_after_deleted_column(self):
+        self.store.delete('lowercase', 'd')
+        self.assertEqual(self.cols('b', 'g', after='d'), 'efg')
+        self.assertEqual(self.cols('b', 'g', after='d', reverse=True), 'cb')
+
+    def test_lazy(self):
+        slice = self.store.iter_slice('lowercase', None, None)
+        self.assertEqual(next(slice), ('a', 'val'))
+        self.store.delete('lowercase', 'b')
+        self.assertEqual(next(slice), ('c', 'val'))
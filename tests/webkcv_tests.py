@@ -0,0 +1,188 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from kcvstore import KeyColumnValueStore
+
+# webkcv opens kcvstore.pickle in the current directory when it's imported,
+# so that's done somewhere out of the way, and its store swapped out.
+_directory = tempfile.mkdtemp()
+_cwd = os.getcwd()
+os.chdir(_directory)
+try:
+    import webkcv
+finally:
+    os.chdir(_cwd)
+    webkcv.store.close()
+    shutil.rmtree(_directory)
+
+
+class WebKCVTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyColumnValueStore(concurrent=True, metrics=True,
+                                         change_feed=10)
+        self.previous = webkcv.store, webkcv.writer
+        webkcv.store = webkcv.writer = self.store
+        self.client = webkcv.app.test_client()
+
+    def tearDown(self):
+        webkcv.store, webkcv.writer = self.previous
+        self.store.close()
+        os.remove(self.store.path)
+
+    def request(self, method, path, data=None, **kwargs):
+        response = self.client.open(path, method=method, data=data,
+                                    **kwargs)
+        return response.status_code, json.loads(response.data)
+
+    def test_routes(self):
+        self.assertEqual(self.request('POST', '/', {
+            'key': 'a', 'col': 'x', 'val': '1'}), (201, {'result': None}))
+        self.assertEqual(self.request('PUT', '/a/y', {'val': '2'}),
+                         (301, {'result': None}))
+        self.assertEqual(self.request('GET', '/a/y'), (200, {'value': '2'}))
+        self.assertEqual(self.request('GET', '/a/q'), (200, {'value': None}))
+        self.assertEqual(self.request('GET', '/a'), (200, {'columns': [
+            ['x', '1'], ['y', '2']]}))
+        self.assertEqual(self.request('GET', '/a?start=y'),
+                         (200, {'columns': [['y', '2']]}))
+        self.assertEqual(self.request('DELETE', '/a/x'),
+                         (200, {'result': None}))
+        self.assertEqual(self.store.get_key('a'), [('y', '2')])
+        self.assertEqual(self.request('DELETE', '/a'),
+                         (200, {'result': None}))
+        self.assertEqual(self.store.get_keys(), set())
+
+    def test_bulk(self):
+        self.assertEqual(self.request('POST', '/_bulk', json.dumps(
+            [['a', 'x', '1'], [u'caf\xe9', 'x', '2']]))[0], 201)
+        self.assertEqual(self.store.get_key(u'caf\xe9'), [('x', '2')])
+        self.assertEqual(self.request('GET', '/caf%C3%A9/x'),
+                         (200, {'value': '2'}))
+        for body in ({'a': 'b'}, [['a', 'b']], [['a', 'b', 1]], ['abc'],
+                     [['a', 'b', 'c', 'd']]):
+            self.assertEqual(self.request('POST', '/_bulk',
+                                          json.dumps(body))[0], 400)
+        self.assertEqual(self.store.get_keys(), set(['a', u'caf\xe9']))
+
+    def test_multi_get(self):
+        self.store.set_many([('a', 'x', '1'), ('b', 'x', '2')])
+        self.assertEqual(self.request('POST', '/_mget', json.dumps({
+            'pairs': [['a', 'x'], ['a', 'y']], 'keys': ['a', 'b'],
+            'start': 'x'})), (200, {'values': ['1', None],
+                                    'slices': [[['x', '1']], [['x', '2']]]}))
+        for body in ([1, 2], {'pairs': [['a']]}, {'pairs': [['a', 1]]},
+                     {'pairs': 'ab'}, {'keys': 'abc'}, {'keys': [1]},
+                     {'keys': ['a'], 'start': 1}):
+            self.assertEqual(self.request('POST', '/_mget',
+                                          json.dumps(body))[0], 400)
+
+    def test_paging(self):
+        self.store.set_many(('a', col, col.upper()) for col in 'pqrst')
+        self.assertEqual(self.request('GET', '/a?limit=2'), (200, {
+            'columns': [['p', 'P'], ['q', 'Q']], 'next': 'q'}))
+        self.assertEqual(self.request('GET', '/a?limit=2&after=r'), (200, {
+            'columns': [['s', 'S'], ['t', 'T']], 'next': None}))
+        self.assertEqual(self.request('GET', '/a?limit=2&reverse=true'),
+                         (200, {'columns': [['t', 'T'], ['s', 'S']],
+                                'next': 's'}))
+        self.assertEqual(self.request('GET', '/a?limit=0')[0], 400)
+        self.assertEqual(self.request('GET', '/a?limit=-1')[0], 400)
+
+    def test_key_listing(self):
+        self.store.set_many((key, 'x', '1') for key in 'abcde')
+        self.assertEqual(self.request('GET', '/'),
+                         (200, {'keys': list('abcde')}))
+        self.assertEqual(self.request('GET', '/?start=b&stop=d'),
+                         (200, {'keys': list('bcd')}))
+        self.assertEqual(self.request('GET', '/?limit=2&after=a'),
+                         (200, {'keys': list('bc'), 'next': 'c'}))
+        self.assertEqual(self.request('GET', '/?count=true'),
+                         (200, {'count': 5}))
+        self.assertEqual(self.request('GET', '/?limit=0')[0], 400)
+        self.assertEqual(self.request('GET', '/?limit=-1')[0], 400)
+
+    def test_prefixes_and_counts(self):
+        self.store.set_many(('a', col, '1') for col in ['p:1', 'p:2', 'q:1'])
+        self.assertEqual(self.request('GET', '/a?prefix=p:'), (200, {
+            'columns': [['p:1', '1'], ['p:2', '1']]}))
+        self.assertEqual(self.request('GET', '/a?prefix=p:&limit=1'), (200, {
+            'columns': [['p:1', '1']], 'next': 'p:1'}))
+        self.assertEqual(self.request('GET', '/a?prefix=p:&count=true'),
+                         (200, {'count': 2}))
+        self.assertEqual(self.request('GET', '/a?start=p:2&count=true'),
+                         (200, {'count': 2}))
+        self.assertEqual(self.request('GET', '/a?count=true'),
+                         (200, {'count': 3}))
+
+    def test_changes(self):
+        status, body = self.request('GET', '/_changes')
+        seq = body['seq']
+        threading.Timer(0.05, self.store.set, ('a', 'x', '1')).start()
+        self.assertEqual(self.request('GET', '/_changes?seq=%d' % seq), (
+            200, {'seq': seq + 1, 'changes': [[seq + 1, 'set', 'a', 'x',
+                                               '1']]}))
+        self.assertEqual(self.request('GET', '/_changes?seq=%d&timeout=0' %
+                                      (seq + 1)),
+                         (200, {'seq': seq + 1, 'changes': []}))
+        self.assertEqual(self.request('GET', '/_changes?seq=%d' %
+                                      (seq - 1))[0], 410)
+        for query in ('limit=0', 'limit=-1', 'limit=x', 'timeout=abc',
+                      'timeout=-1', 'timeout=nan'):
+            self.assertEqual(self.request('GET', '/_changes?seq=%d&%s' %
+                                          (seq, query))[0], 400)
+        self.assertEqual(self.request('GET', '/_changes?seq=x')[0], 400)
+        self.assertEqual(self.request('GET', '/_changes?seq=%d&limit=1' %
+                                      seq)[1]['seq'], seq + 1)
+
+    def test_updates(self):
+        def update(**query):
+            return self.request('POST', '/a/n', json.dumps(query),
+                                content_type='application/json')
+
+        self.assertEqual(update(op='increment', delta=5),
+                         (200, {'result': 5}))
+        self.assertEqual(update(op='compare_and_set', expected='5', val='7'),
+                         (200, {'result': True}))
+        self.assertEqual(update(op='append', suffix='0'),
+                         (200, {'result': None}))
+        self.assertEqual(self.store.get('a', 'n'), '70')
+        self.assertEqual(update(op='increment', delta='x')[0], 400)
+        self.assertEqual(update(op='nonsense')[0], 400)
+        self.assertEqual(update(op='compare_and_set', val=5)[0], 400)
+        self.assertEqual(update(op='compare_and_set', expected=[])[0], 400)
+        self.assertEqual(update(op='append', suffix=5)[0], 400)
+        self.assertEqual(update(op='append', suffix=None)[0], 400)
+        self.assertEqual(self.request('POST', '/a/n', '[1]',
+                                      content_type='application/json')[0],
+                         400)
+        self.assertEqual(self.store.get('a', 'n'), '70')
+
+    def test_metrics(self):
+        self.store.set('a', 'x', '1')
+        self.client.get('/a/x')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('kcv_keys 1' in response.data)
+        self.assertTrue('kcv_http_request_seconds_count{endpoint="get"} 1'
+                        in response.data)
+
+    def test_replica_lag_header(self):
+        self.assertEqual(self.client.get('/').headers.get('X-Replica-Lag'),
+                         None)
+        self.store.set('a', 'x', '1')
+        replica = KeyColumnValueStore(self.store.path, replica=True)
+        webkcv.store = replica
+        try:
+            response = self.client.get('/a/x')
+            self.assertEqual(json.loads(response.data), {'value': '1'})
+            self.assertEqual(response.headers['X-Replica-Lag'], '0.000')
+        finally:
+            webkcv.store = self.store
+            replica.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
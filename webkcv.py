@@ -1,35 +1,219 @@
+import argparse
+import kcvmetrics
+import os
+import signal
+import socket
+import sys
 from flask import Flask
+from flask import Response
+from flask import g
 from flask import json
 from flask import make_response
 from flask import request
-from kcvstore import KeyColumnValueStore
+from kcvclient import ClientError, HTTPClient
+from kcvstore import ChangesLost, KeyColumnValueStore
+from timeit import default_timer as clock
+from werkzeug.serving import make_server
 
 app = Flask(__name__)
 
-store = KeyColumnValueStore(path='kcvstore.pickle')
+store = KeyColumnValueStore(path='kcvstore.pickle', concurrent=True,
+                            metrics=True, change_feed=10000)
+
+# The longest a poll of /_changes waits, which has to be well within the
+# timeout of the client that readers forward polls with.
+MAX_POLL_SECONDS = 20
+
+# Writes go through writer, which is the store itself, except in the reader
+# processes of serve_readers, where it's a client of the writer process.
+writer = store
+
+def write(method, *args):
+    result = getattr(writer, method)(*args)
+    if writer is not store:
+        # Catching up straight away lets whoever made the write read it back
+        # from this reader.
+        store.catch_up()
+    return result
+
+def strings(value):
+    # Whether part of a decoded JSON body is an array of strings, rather
+    # than whatever the store would choke on (or, for a lone string, take
+    # for a list of its characters).
+    return isinstance(value, list) and all(isinstance(s, basestring)
+                                           for s in value)
+
+def string_lists(value, size):
+    # Whether it's an array of arrays of size strings, as the [key, col, val]
+    # triples of /_bulk and [key, col] pairs of /_mget have to be.
+    return isinstance(value, list) and all(
+        strings(item) and len(item) == size for item in value)
+
+@app.before_request
+def start_timer():
+    g.start = clock()
+
+@app.after_request
+def record_request(response):
+    # Timing the whole request, next to the store's own timings of its
+    # operations, shows how much goes on Flask and JSON.
+    if store.metrics is not None and 'start' in g:
+        store.metrics.observe(store.metrics.requests,
+                              request.endpoint or 'unknown',
+                              clock() - g.start)
+    if store.replica:
+        # Every read from a replica says how stale it might be.
+        response.headers['X-Replica-Lag'] = '%.3f' % (
+            store.replica_lag()['seconds'])
+    return response
+
+@app.errorhandler(ClientError)
+def forwarding_failed(error):
+    # Passes on the writer's answer to a request forwarded by a reader.
+    return Response(error.body, error.status, mimetype='application/json')
+
+@app.route('/metrics')
+def metrics():
+    # Note that this hides any key named "metrics" from get_key_or_slice.
+    gauges = dict(store.size_stats(), log_records=store._log_records,
+                  log_bytes=store._log_bytes)
+    if store.replica:
+        gauges['replica_lag'] = store.replica_lag()
+    counters = {'filter': dict(store.filter_stats)}
+    if store.cache_stats:
+        counters['cache'] = dict(store.cache_stats)
+    text = kcvmetrics.render(store.metrics or kcvmetrics.Metrics(), gauges,
+                             counters)
+    return Response(text, mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def get_keys():
-    return json.jsonify(keys=list(store.get_keys()))
+    # Lists the keys between start and stop (both optional) in order, a page
+    # of limit keys at a time if limit is given, just like a paged slice.
+    # With count=true, only counts the keys instead.
+    if request.args.get('count') in ('1', 'true'):
+        return json.jsonify(count=store.count_keys())
+    start = request.args.get('start')
+    stop = request.args.get('stop')
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return make_response(json.jsonify(error='limit must be positive'),
+                             400)
+    if limit is None:
+        return json.jsonify(keys=list(store.iter_keys(start, stop)))
+    after = request.args.get('after')
+    keys = list(store.iter_keys(start, stop, limit=limit + 1, after=after))
+    next_after = keys[limit - 1] if len(keys) > limit else None
+    return json.jsonify(keys=keys[:limit], next=next_after)
 
 @app.route('/', methods=['POST'])
 def set_new():
     key = request.form.get('key')
     col = request.form.get('col')
     val = request.form.get('val')
-    return make_response(json.jsonify(result=store.set(key, col, val)), 201)
+    return make_response(json.jsonify(result=write('set', key, col, val)), 201)
+
+@app.route('/_bulk', methods=['POST'])
+def set_many():
+    # Expects a JSON array of [key, col, val] triples, which are all set in a
+    # single batch.
+    triples = request.get_json(force=True)
+    if not string_lists(triples, 3):
+        return make_response(json.jsonify(
+            error='expected an array of [key, col, val] strings'), 400)
+    return make_response(json.jsonify(result=write('set_many', triples)), 201)
+
+@app.route('/_mget', methods=['POST'])
+def multi_get():
+    # Expects a JSON object with any of "pairs", an array of [key, col] pairs
+    # to get the values of, and "keys", an array of keys to get the slices
+    # between "start" and "stop" (both optional) of.  Answering them all in
+    # one response saves a round trip per value or slice.
+    query = request.get_json(force=True)
+    if not isinstance(query, dict):
+        return make_response(json.jsonify(error='expected an object'), 400)
+    if not string_lists(query.get('pairs', []), 2) or \
+            not strings(query.get('keys', [])) or \
+            not all(isinstance(query.get(name), (basestring, type(None)))
+                    for name in ('start', 'stop')):
+        return make_response(json.jsonify(error='expected strings'), 400)
+    values = store.multi_get(query.get('pairs', []))
+    slices = store.multi_get_slice(query.get('keys', []), query.get('start'),
+                                   query.get('stop'))
+    return json.jsonify(values=values, slices=slices)
+
+@app.route('/_changes')
+def changes():
+    # Long-polls the change feed: waits up to timeout seconds for changes
+    # made since the sequence number seq, then returns them (at most limit
+    # of them) as [seq, op, key, col, val] arrays (without the col and val,
+    # or val, that deletes don't have), along with the seq to poll with next.
+    # Without seq, just returns the current one, to start from.  Answers 410
+    # if the changes have been dropped from the feed, in which case whatever
+    # the client keeps up to date has to be reread.
+    try:
+        seq, limit = [None if value is None else int(value) for value in
+                      (request.args.get('seq'), request.args.get('limit'))]
+        timeout = float(request.args.get('timeout', MAX_POLL_SECONDS))
+    except ValueError:
+        return make_response(json.jsonify(error='expected numbers'), 400)
+    if limit is not None and limit < 1:
+        return make_response(json.jsonify(error='limit must be positive'),
+                             400)
+    if not timeout >= 0:  # NaN included
+        return make_response(json.jsonify(error='timeout must not be '
+                                          'negative'), 400)
+    timeout = min(timeout, MAX_POLL_SECONDS)
+    try:
+        seq, changes = writer.changes_since(seq, limit, timeout)
+    except ChangesLost as e:
+        return make_response(json.jsonify(error=str(e)), 410)
+    return json.jsonify(seq=seq, changes=changes)
 
 @app.route('/<key>')
 def get_key_or_slice(key):
     # Since get_slice(key, None, None) == get_key(key), we can do both with
-    # just get_slice.
+    # just get_slice.  With prefix, gets the columns starting with it
+    # instead of a slice.  With count=true, only counts the columns, from
+    # their positions in the row, without reading any values.
     start = request.args.get('start')
     stop = request.args.get('stop')
-    return json.jsonify(columns=store.get_slice(key, start, stop))
+    prefix = request.args.get('prefix')
+    if request.args.get('count') in ('1', 'true'):
+        if prefix is not None:
+            count = store.count_prefix(key, prefix)
+        elif start is None and stop is None:
+            count = store.count_columns(key)
+        else:
+            count = store.count_slice(key, start, stop)
+        return json.jsonify(count=count)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        # With no columns in the page, there'd be no next one to resume from.
+        return make_response(json.jsonify(error='limit must be positive'),
+                             400)
+    if limit is None:
+        if prefix is not None:
+            return json.jsonify(columns=store.get_prefix(key, prefix))
+        return json.jsonify(columns=store.get_slice(key, start, stop))
+    # Paging through the slice: ask for one more column than the limit to
+    # find out whether there's another page, and if so, hand back the last
+    # column of this one as the token to pass in as after to get it.
+    after = request.args.get('after')
+    reverse = request.args.get('reverse') in ('1', 'true')
+    if prefix is not None:
+        columns = store.iter_prefix(key, prefix, limit=limit + 1,
+                                    reverse=reverse, after=after)
+    else:
+        columns = store.iter_slice(key, start, stop, limit=limit + 1,
+                                   reverse=reverse, after=after)
+    columns = list(columns)
+    next_after = columns[limit - 1][0] if len(columns) > limit else None
+    return json.jsonify(columns=columns[:limit], next=next_after)
 
 @app.route('/<key>', methods=['DELETE'])
 def delete_key(key):
-    return json.jsonify(result=store.delete_key(key))
+    return json.jsonify(result=write('delete_key', key))
 
 @app.route('/<key>/<col>')
 def get(key, col):
@@ -37,12 +221,98 @@ def get(key, col):
 
 @app.route('/<key>/<col>', methods=['DELETE'])
 def delete(key, col):
-    return json.jsonify(result=store.delete(key, col))
+    return json.jsonify(result=write('delete', key, col))
+
+@app.route('/<key>/<col>', methods=['POST'])
+def update(key, col):
+    # Expects a JSON object naming an atomic read-modify-write "op":
+    # * compare_and_set, setting the column to "val" if it's "expected" (a
+    #   null for either meaning the column's missing), answering whether it
+    #   did as the result
+    # * increment, adding "delta" (1 by default) to it, answering the sum
+    # * append, appending "suffix" to it
+    query = request.get_json(force=True)
+    if not isinstance(query, dict):
+        return make_response(json.jsonify(error='expected an object'), 400)
+    if not all(isinstance(query.get(name), (basestring, type(None)))
+               for name in ('expected', 'val')) or \
+            not isinstance(query.get('suffix', ''), basestring):
+        return make_response(json.jsonify(error='expected strings'), 400)
+    op = query.get('op')
+    try:
+        if op == 'compare_and_set':
+            result = write('compare_and_set', key, col, query.get('expected'),
+                           query.get('val'))
+        elif op == 'increment':
+            result = write('increment', key, col, query.get('delta', 1))
+        elif op == 'append':
+            result = write('append', key, col, query['suffix'])
+        else:
+            return make_response(json.jsonify(error='unknown op'), 400)
+    except (KeyError, ValueError) as e:
+        return make_response(json.jsonify(error=str(e)), 400)
+    return json.jsonify(result=result)
 
 @app.route('/<key>/<col>', methods=['PUT'])
 def overwrite(key, col):
     val = request.form.get('val')
-    return make_response(json.jsonify(result=store.set(key, col, val)), 301)
+    return make_response(json.jsonify(result=write('set', key, col, val)), 301)
+
+def serve_readers(host, port, readers, writer_port):
+    # Forks readers processes up front, which all accept requests on
+    # host:port, each answering reads from its own replica of the store (so
+    # reads aren't limited to the one core the GIL allows a process), and
+    # forwarding writes to this process, the only writer, which serves them
+    # on writer_port.  Replicas follow the writer's log, so they lag behind
+    # it by up to a tenth of a second or so: see the X-Replica-Lag header.
+    writer_server = make_server('127.0.0.1', writer_port, app, threaded=True)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    children = []
+    for i in xrange(readers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                writer_server.socket.close()
+                serve_replica(host, listener, writer_port)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    listener.close()
+    # Take the readers down with the writer, even if it's terminated.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    try:
+        writer_server.serve_forever()
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        store.close()
+
+def serve_replica(host, listener, writer_port):
+    global store, writer
+    store = KeyColumnValueStore(path=store.path, concurrent=True,
+                                metrics=True, replica=True)
+    store.follow()
+    writer = HTTPClient('127.0.0.1', writer_port)
+    make_server(host, 0, app, threaded=True,
+                fd=listener.fileno()).serve_forever()
 
 if __name__ == '__main__':
-    app.run()
+    parser = argparse.ArgumentParser(description='Serves the store in '
+                                     'kcvstore.pickle over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--readers', type=int, default=0, help='number of '
+                        'reader processes to fork, each with a read replica '
+                        'of the store (default: none, just serve it)')
+    parser.add_argument('--writer-port', type=int, default=5002,
+                        help='port the writer listens on for the readers')
+    args = parser.parse_args()
+    if args.readers:
+        serve_readers(args.host, args.port, args.readers, args.writer_port)
+    else:
+        # Threaded, so that a long poll of /_changes doesn't hold up every
+        # other request (the write that would end it, say) behind it.
+        app.run(args.host, args.port, threaded=True)